@@ -0,0 +1,123 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+
+# 已結束、不再佔用庫存的訂單狀態
+CLOSED_STATUSES = ("已出貨", "已取消")
+
+
+def _to_date(value):
+    """將 date、datetime 或 'YYYY-MM-DD' 開頭的字串轉為 date，無法解析時回傳 None"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+# ==================== AvailableToPromise ====================
+class AvailableToPromise:
+    """可承諾量 (ATP) 查詢引擎
+
+    每個產品以「日」為單位建立未來 horizon_days 天的供需淨額：生產中訂單的剩餘數量為供給
+    （預計在開始生產後 lead_time_days 天完成），所有未結訂單的數量為需求（落在訂單日期，
+    逾期的算在今天）。淨額累加後再取「由後往前的最小值」，即為不影響之後任何承諾的前提下，
+    到某日為止還能承諾的數量（不含現有庫存量）。查詢時加上目前庫存量，只需一次陣列取值。
+
+    供需淨額只取決於訂單，ProductionManager 的 order_listeners 會在訂單加入、移除、狀態轉換
+    （包含生產入庫更新已生產數量）或欄位變更時通知，此時只將該產品標記為需重建，
+    下次查詢時以品名索引取出該產品的訂單重算。庫存量在查詢時直接讀取產品表，
+    因此入庫、出庫本身不必重建。
+    """
+
+    def __init__(self, inventory, production_manager, horizon_days=180, lead_time_days=7):
+        """建立引擎並掛上異動通知
+
+        Args:
+            inventory: 庫存管理系統 (Inventory)
+            production_manager: 生產管理系統 (ProductionManager)
+            horizon_days: 預測的天數，超過的日期以最後一天計
+            lead_time_days: 生產中訂單自開始生產到完成的預估天數
+        """
+        self.inventory = inventory
+        self.production_manager = production_manager
+        self.horizon_days = horizon_days
+        self.lead_time_days = lead_time_days
+        self.start = date.today()
+        self._profiles = {}  # 產品名稱 -> 由後往前最小累計淨額陣列
+        production_manager.order_listeners.append(self.invalidate)
+
+    def close(self):
+        """移除異動通知"""
+        if self.invalidate in self.production_manager.order_listeners:
+            self.production_manager.order_listeners.remove(self.invalidate)
+
+    def invalidate(self, product_name=None):
+        """標記產品需重建，None 表示全部"""
+        if product_name is None:
+            self._profiles.clear()
+        else:
+            self._profiles.pop(product_name, None)
+
+    def _bucket(self, day):
+        """日期對應的陣列位置（今天之前算今天，超過預測範圍算最後一天）"""
+        if day is None:
+            return 0
+        return min(max((day - self.start).days, 0), self.horizon_days)
+
+    def _profile(self, product_name):
+        """取得（必要時重建）產品的由後往前最小累計淨額"""
+        today = date.today()
+        if today != self.start:
+            self.start = today
+            self._profiles.clear()
+        profile = self._profiles.get(product_name)
+        if profile is not None:
+            return profile
+
+        net = np.zeros(self.horizon_days + 1)
+        for order in self.production_manager.find_orders(prod_name=product_name):
+            if order.status in CLOSED_STATUSES:
+                continue
+            order_date = _to_date(getattr(order, 'date', None) or order.submitted)
+            net[self._bucket(order_date)] -= order.quantity
+            if order.status == "生產中":
+                started = _to_date(getattr(order, 'production_date', None)) or today
+                finish = started + timedelta(days=self.lead_time_days)
+                net[self._bucket(finish)] += max(order.quantity - order.produced_quantity, 0)
+
+        profile = np.minimum.accumulate(np.cumsum(net)[::-1])[::-1]
+        self._profiles[product_name] = profile
+        return profile
+
+    def available_to_promise(self, product_name, by_date=None):
+        """到指定日期為止還能承諾的數量
+
+        Args:
+            product_name: 產品名稱
+            by_date: 日期 (date、datetime 或 'YYYY-MM-DD')，預設為今天
+
+        Returns:
+            可承諾數量（不足時為 0；數量皆為整數時回傳 int）
+        """
+        day = _to_date(by_date) if by_date is not None else None
+        on_hand = self.inventory.get_product_quantity(product_name) or 0
+        available = max(on_hand + float(self._profile(product_name)[self._bucket(day)]), 0.0)
+        return int(available) if available.is_integer() else available
+
+    def earliest_promise_date(self, product_name, quantity):
+        """最早可承諾指定數量的日期
+
+        Returns:
+            date，預測範圍內無法承諾時回傳 None
+        """
+        on_hand = self.inventory.get_product_quantity(product_name) or 0
+        # 由後往前最小值是非遞減陣列，可直接二分搜尋
+        position = int(np.searchsorted(self._profile(product_name), quantity - on_hand, side='left'))
+        if position > self.horizon_days:
+            return None
+        return self.start + timedelta(days=position)
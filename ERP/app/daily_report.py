@@ -13,9 +13,9 @@ import matplotlib
 # 字型設定：用微軟正黑體或 Noto Sans TC，防止中文亂碼
 matplotlib.rcParams['font.sans-serif'] = ['Microsoft JhengHei', 'Noto Sans TC']
 matplotlib.rcParams['axes.unicode_minus'] = False
-import os
 import re
-import json
+
+from inventory_storage import load_order_records
 
 matplotlib.use("TkAgg")
 
@@ -47,18 +47,14 @@ class DailyReport:
         style.configure("TCombobox", font=default_font)
 
     def load_sample_data(self):
-        # 載入 JSON 檔案資料
-        json_path = r"working_data/orders_data.json"
-        if not os.path.exists(json_path):
-            messagebox.showerror("檔案錯誤", f"找不到檔案：{json_path}\n請確認檔案路徑與名稱正確")
+        # 載入訂單資料（依儲存模式讀取 JSON 檔案或 SQLite 資料庫）
+        try:
+            orders = load_order_records()
+        except FileNotFoundError as e:
+            messagebox.showerror("檔案錯誤", f"找不到檔案：{e.filename or e}\n請確認檔案路徑與名稱正確")
             self.root.destroy()
             return
 
-        with open(json_path, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-
-        orders = json_data.get("orders", [])
-
         # 將訂單資料轉為 DataFrame
         df = pd.DataFrame(orders)
 
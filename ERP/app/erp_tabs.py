@@ -4,7 +4,8 @@ import pandas as pd
 from datetime import datetime
 import os
 import sys
-import json
+import itertools
+from functools import partial
 from tkcalendar import Calendar  # 需要安裝 tkcalendar 套件: pip install tkcalendar
 
 
@@ -17,9 +18,30 @@ if current_dir not in sys.path:
 from inventory_core import Inventory
 from inventory_core import ProductionManager
 from inventory_core import Order
+import inventory_storage
+from inventory_storage import atomic_write_json, load_inventory_file
+from json_stream import iter_section
+from persistence_worker import PersistenceWorker
+from atp_engine import AvailableToPromise
+from order_events import OrderEventLog
+from order_import import normalize_order_frame, normalize_inventory_frame, format_error_report
+from order_import import ERROR_COLUMNS, INVENTORY_ERROR_COLUMNS
+from import_cache import ImportCache
+from workbook_reader import iter_workbook_chunks
+from import_worker import ImportWorker
 
 
 class ProductionManagerGUI:
+    ORDER_SNAPSHOT_EVENTS = 5000  # 距上次訂單快照累積多少筆事件後重寫快照
+    EXCEL_STREAM_BYTES = 5 * 1024 * 1024  # 超過此大小的 Excel 檔以唯讀模式分段串流讀取
+    EXCEL_CHUNK_ROWS = 5000  # 串流讀取時每段的列數
+    # 合併匯入 JSON 訂單時讀取的欄位與預設值
+    JSON_ORDER_DEFAULTS = {
+        'trans_type': 'SO', 'trans_id': '', 'seq_id': '001', 'prod_id': '', 'prod_name': '',
+        'quantity': 0, 'price': 0.0, 'cust_id': '', 'cust_name': '', 'facto_id': '', 'facto_name': '',
+        'date': '', 'status': '新訂單', 'allocated_quantity': 0, 'produced_quantity': 0,
+    }
+    
     def __init__(self, root):
         self.root = root
         self.root.title("庫存日常異動")
@@ -27,10 +49,21 @@ class ProductionManagerGUI:
         self.root.iconbitmap("assets/erp_icon.ico")
         
         # 初始化空的資料結構
-        self.inventory = Inventory()
-        self.inventory.products = {}  # 保持空白
-        self.inventory.database_path = "working_data/inventory_data.json"  # 使用工作資料路徑
-        self.production_manager = ProductionManager(self.inventory)
+        # 儲存模式由 inventory_storage.STORAGE_MODE 決定（預設為交易日誌，異動只追加不重寫整個檔案）
+        self.storage_mode = inventory_storage.STORAGE_MODE
+        # 介面只需要目前庫存量，交易歷史延遲到查詢時才讀取（JSON 模式每次都重寫整個檔案，仍需完整載入）
+        # 工作資料在此已載入，auto_load_working_data 直接沿用，不再重讀
+        self.inventory = Inventory(inventory_storage.app_database_path(), storage_mode=self.storage_mode,
+                                   lazy_history=self.storage_mode != "json")
+        # 訂單狀態轉換寫入事件日誌，狀態變更不必每次重寫整份訂單資料
+        self.order_events = OrderEventLog(inventory_storage.ORDER_EVENTS_PATH)
+        self.orders_snapshot_seq = 0  # 訂單快照已包含的最後事件序號
+        self.production_manager = ProductionManager(self.inventory, event_log=self.order_events)
+        self.atp = AvailableToPromise(self.inventory, self.production_manager)  # 可承諾量查詢
+        self.import_cache = ImportCache()  # 同一份 Excel 再次匯入時略過解析
+        
+        # 背景寫檔執行緒：異動後的存檔不在介面執行緒等待磁碟，連續異動合併為一次寫入
+        self.save_worker = PersistenceWorker()
         
         # 資料來源追蹤
         self.current_data_source = {
@@ -53,35 +86,24 @@ class ProductionManagerGUI:
         # 檢查並自動載入工作資料
         self.auto_load_working_data()
         
+        # 已結束月份的交易移到封存區（封存清單記錄處理進度，每月只會實際執行一次）
+        self.inventory.archive_closed_months()
+        
         # 設定程式關閉時的處理
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.poll_save_errors()
         
     def auto_load_working_data(self):
-        """自動檢查並載入 working_data 資料夾中的 JSON 檔案"""
+        """自動檢查並載入 working_data 資料夾中的工作資料"""
         print("檢查 working_data 資料夾...")
         
-        # 檢查庫存資料
-        inventory_file = "working_data/inventory_data.json"
-        if os.path.exists(inventory_file):
-            try:
-                self.load_inventory_from_json(inventory_file)
-                self.current_data_source["inventory"] = inventory_file
-                self.inventory_source_label.config(text="目前資料來源: inventory_data.json (自動載入)")
-                self.production_source_label.config(text="目前資料來源: inventory_data.json (自動載入)")
-                print("✅ 已自動載入庫存資料")
-            except Exception as e:
-                print(f"❌ 自動載入庫存資料失敗: {e}")
+        if self.storage_mode == "sqlite":
+            self.auto_load_sqlite_data()
+        else:
+            self.auto_load_json_data()
         
-        # 檢查訂單資料
-        orders_file = "working_data/orders_data.json"
-        if os.path.exists(orders_file):
-            try:
-                self.load_orders_from_json(orders_file)
-                self.current_data_source["orders"] = orders_file
-                self.order_source_label.config(text="目前資料來源: orders_data.json (自動載入)")
-                print("✅ 已自動載入訂單資料")
-            except Exception as e:
-                print(f"❌ 自動載入訂單資料失敗: {e}")
+        # 依訂單重算保留量，修正存檔中的尚可分配量
+        self.production_manager.reconcile_reservations()
         
         # 刷新所有顯示
         self.refresh_inventory()
@@ -91,6 +113,57 @@ class ProductionManagerGUI:
         # 如果沒有載入任何資料，顯示空白介面
         if not any(self.current_data_source.values()):
             print("📋 沒有找到工作資料，顯示空白介面")
+
+    def auto_load_json_data(self):
+        """載入 JSON 工作檔案"""
+        # 庫存資料已由 Inventory 初始化時載入（延遲模式只讀取產品表），這裡只更新資料來源
+        inventory_file = inventory_storage.INVENTORY_JSON_PATH
+        if self.inventory.storage.exists() and self.inventory.products:
+            self.current_data_source["inventory"] = inventory_file
+            self.inventory_source_label.config(text="目前資料來源: inventory_data.json (自動載入)")
+            self.production_source_label.config(text="目前資料來源: inventory_data.json (自動載入)")
+            print("✅ 已自動載入庫存資料")
+        
+        # 檢查訂單資料
+        orders_file = inventory_storage.ORDERS_JSON_PATH
+        if os.path.exists(orders_file):
+            try:
+                self.load_orders_from_json(orders_file)
+                # 重播快照之後的訂單事件
+                self.orders_snapshot_seq = next(iter_section(orders_file, 'event_seq'), 0)
+                self.production_manager.replay_events(self.orders_snapshot_seq)
+                self.production_manager.orders_dirty = False
+                self.current_data_source["orders"] = orders_file
+                self.order_source_label.config(text="目前資料來源: orders_data.json (自動載入)")
+                print("✅ 已自動載入訂單資料")
+            except Exception as e:
+                print(f"❌ 自動載入訂單資料失敗: {e}")
+
+    def auto_load_sqlite_data(self):
+        """載入 SQLite 工作資料庫；資料庫尚無資料時先從 JSON 工作檔案匯入"""
+        storage = self.inventory.storage
+        try:
+            json_storage = inventory_storage.JournalStorage(inventory_storage.INVENTORY_JSON_PATH)
+            # 產品表已由 Inventory 初始化時載入；資料庫尚無資料時才匯入 JSON 並重新載入
+            if not self.inventory.products and (json_storage.exists()
+                                                or os.path.exists(inventory_storage.ORDERS_JSON_PATH)):
+                storage.import_json(inventory_storage.INVENTORY_JSON_PATH, inventory_storage.ORDERS_JSON_PATH)
+                print("✅ 已將 JSON 工作資料匯入 SQLite 資料庫")
+                self.inventory.load_data()
+            if self.inventory.products:
+                self.current_data_source["inventory"] = storage.database_path
+                self.inventory_source_label.config(text="目前資料來源: erp_data.db (自動載入)")
+                self.production_source_label.config(text="目前資料來源: erp_data.db (自動載入)")
+                print("✅ 已自動載入庫存資料")
+            
+            orders_data = storage.load_orders()
+            if orders_data:
+                self.load_orders_from_records(orders_data)
+                self.current_data_source["orders"] = storage.database_path
+                self.order_source_label.config(text="目前資料來源: erp_data.db (自動載入)")
+                print("✅ 已自動載入訂單資料")
+        except Exception as e:
+            print(f"❌ 自動載入資料庫失敗: {e}")
         
     def create_main_frame(self):
         self.main_frame = ttk.Frame(self.root, padding="10")
@@ -198,7 +271,7 @@ class ProductionManagerGUI:
             "日期", "訂單編號", "客戶", "序號", "品號", "產品", "數量", 
             "單價", "金額", "尚可分配量", "現有庫存量", "狀態"
         )
-        self.order_tree = ttk.Treeview(order_list_frame, columns=columns, show="headings")
+        self.order_tree = ttk.Treeview(order_list_frame, columns=columns, show="headings", selectmode="extended")
         
         # 設定欄位標題和寬度
         column_widths = {
@@ -238,6 +311,21 @@ class ProductionManagerGUI:
         allocate_btn = ttk.Button(order_action_frame, text="分配庫存", command=self.allocate_inventory)
         allocate_btn.pack(fill=tk.X, pady=5)
         
+        # 批次分配按鈕
+        batch_allocate_btn = ttk.Button(order_action_frame, text="批次分配", command=self.batch_allocate_orders)
+        batch_allocate_btn.pack(fill=tk.X, pady=5)
+        
+        # 入庫自動分配開關（預設關閉，勾選後生產或入庫才自動分配給待料訂單）
+        self.auto_allocate_var = tk.BooleanVar(value=False)
+        auto_allocate_chk = ttk.Checkbutton(
+            order_action_frame, text="入庫自動分配", variable=self.auto_allocate_var,
+            command=lambda: self.production_manager.set_auto_allocation(self.auto_allocate_var.get()))
+        auto_allocate_chk.pack(fill=tk.X, pady=5)
+        
+        # 可承諾量查詢按鈕
+        atp_btn = ttk.Button(order_action_frame, text="可承諾查詢", command=self.query_available_to_promise)
+        atp_btn.pack(fill=tk.X, pady=5)
+        
         # 訂單出貨按鈕
         ship_btn = ttk.Button(order_action_frame, text="訂單出貨", command=self.ship_order_from_list)
         ship_btn.pack(fill=tk.X, pady=5)
@@ -297,6 +385,10 @@ class ProductionManagerGUI:
         produce_btn = ttk.Button(production_action_frame, text="生產", command=self.produce_from_product_list)
         produce_btn.pack(fill=tk.X, pady=5)
         
+        # 缺料分析按鈕
+        shortfall_btn = ttk.Button(production_action_frame, text="缺料分析", command=self.show_shortfall_plan)
+        shortfall_btn.pack(fill=tk.X, pady=5)
+        
         # 重新整理按鈕
         refresh_prod_btn = ttk.Button(production_action_frame, text="重新整理", command=self.refresh_product_list)
         refresh_prod_btn.pack(fill=tk.X, pady=5)
@@ -364,6 +456,12 @@ class ProductionManagerGUI:
         """程式關閉時的處理"""
         try:
             self.auto_save_data()
+            # 等待背景寫檔完成，確保關閉前資料都已寫入
+            self.save_worker.close()
+            self.order_events.close()
+            for key, error in self.save_worker.pop_errors():
+                print(f"關閉時儲存失敗 ({key}): {error}")
+                messagebox.showwarning("儲存警告", f"資料儲存時發生問題: {error}")
             print("程式關閉前已自動儲存資料")
         except Exception as e:
             print(f"關閉時儲存失敗: {e}")
@@ -373,7 +471,7 @@ class ProductionManagerGUI:
     # ==================== 新增的匯入功能方法 ====================
     
     def import_order_data(self):
-        """匯入訂單資料"""
+        """匯入訂單資料（在背景執行，可取消，取消或失敗時回復原有訂單）"""
         file_types = [
             ("All files", "*.*"),
             ("Excel files", "*.xlsx"), 
@@ -386,29 +484,65 @@ class ProductionManagerGUI:
             initialdir="initial_data"  # 從 initial_data 資料夾選擇
         )
         
-        if file_path:
+        if not file_path:
+            return
+        
+        # 已有訂單時可選擇合併匯入，只套用變更並保留本地狀態
+        merge = bool(self.production_manager.orders) and messagebox.askyesno(
+            "匯入方式", "是否以合併模式匯入？\n\n是：只套用新增與內容有變更的訂單，保留本地狀態\n否：清除現有訂單後完整匯入")
+        delete_missing = merge and messagebox.askyesno("匯入方式", "是否刪除檔案中沒有的訂單？")
+        
+        production_manager = self.production_manager
+        previous_orders = dict(production_manager.orders)
+        previous_dirty = production_manager.orders_dirty
+        undo = []  # 合併匯入修改既有訂單前的 (訂單, 欄位, 原值)
+        
+        def job(progress):
             try:
-                if file_path.endswith('.json'):
-                    self.load_orders_from_json(file_path)
-                elif file_path.endswith('.xlsx'):
-                    self.load_orders_from_excel(file_path)
-                
-                self.current_data_source["orders"] = file_path
-                self.order_source_label.config(text=f"目前資料來源: {os.path.basename(file_path)}")
-                
-                # 刷新顯示
-                self.refresh_order_list()
-                
-                # 自動儲存資料
-                self.auto_save_data()
-                
-                messagebox.showinfo("成功", f"已成功匯入訂單資料：{os.path.basename(file_path)}")
-                
-            except Exception as e:
-                messagebox.showerror("錯誤", f"匯入訂單資料失敗: {str(e)}")
+                # 各段新增訂單時建立的產品併入同一個庫存批次，取消或失敗時一併移除
+                with self.inventory.batch():
+                    if merge:
+                        return self.merge_orders_from_file(file_path, delete_missing, progress, undo)
+                    if file_path.endswith('.json'):
+                        self.load_orders_from_json(file_path, progress)
+                        return None, None
+                    if file_path.endswith('.xlsx'):
+                        return None, self.load_orders_from_excel(file_path, progress)
+                    return None, None
+            except BaseException:
+                # 取消或失敗：庫存批次已回復，再還原被修改的欄位並換回匯入前的訂單（重建索引並重算保留量）
+                for order, field, value in reversed(undo):
+                    setattr(order, field, value)
+                production_manager.orders = previous_orders
+                production_manager.orders_dirty = previous_dirty
+                raise
+        
+        def finish(result):
+            report, errors = result
+            self.current_data_source["orders"] = file_path
+            self.order_source_label.config(text=f"目前資料來源: {os.path.basename(file_path)}")
+            
+            # 刷新顯示（保留量改變，庫存的尚可分配量一併更新）
+            self.refresh_order_list()
+            self.refresh_inventory()
+            self.refresh_product_list()
+            
+            # 自動儲存資料
+            self.auto_save_data()
+            
+            message = f"已成功匯入訂單資料：{os.path.basename(file_path)}"
+            if report is not None:
+                counts = report['異動'].value_counts()
+                message += (f"\n\n新增 {counts.get('新增', 0)} 筆，更新 {counts.get('更新', 0)} 筆，"
+                            f"刪除 {counts.get('刪除', 0)} 筆")
+            if errors is not None and not errors.empty:
+                message += f"\n\n{len(errors)} 列無法匯入：\n{format_error_report(errors, limit=10)}"
+            messagebox.showinfo("成功", message)
+        
+        self.run_import("匯入訂單資料", job, finish)
 
     def import_production_data(self):
-        """匯入生產資料"""
+        """匯入生產資料（在背景執行，可取消，取消或失敗時回復原有庫存）"""
         file_types = [
             ("All files", "*.*"),
             ("Excel files", "*.xlsx"), 
@@ -422,28 +556,11 @@ class ProductionManagerGUI:
         )
         
         if file_path:
-            try:
-                if file_path.endswith('.json'):
-                    self.load_production_from_json(file_path)
-                elif file_path.endswith('.xlsx'):
-                    self.load_production_from_excel(file_path)
-                
-                self.current_data_source["production"] = file_path
-                self.production_source_label.config(text=f"目前資料來源: {os.path.basename(file_path)}")
-                
-                # 刷新顯示
-                self.refresh_product_list()
-                
-                # 自動儲存資料
-                self.auto_save_data()
-                
-                messagebox.showinfo("成功", f"已成功匯入生產資料：{os.path.basename(file_path)}")
-                
-            except Exception as e:
-                messagebox.showerror("錯誤", f"匯入生產資料失敗: {str(e)}")
+            self.import_inventory_file(file_path, "生產資料", "production", self.production_source_label,
+                                       self.load_production_from_json, self.load_production_from_excel)
 
     def import_inventory_data(self):
-        """匯入庫存資料"""
+        """匯入庫存資料（在背景執行，可取消，取消或失敗時回復原有庫存）"""
         file_types = [
             ("All files", "*.*"),
             ("Excel files", "*.xlsx"), 
@@ -457,245 +574,440 @@ class ProductionManagerGUI:
         )
         
         if file_path:
+            self.import_inventory_file(file_path, "庫存資料", "inventory", self.inventory_source_label,
+                                       self.load_inventory_from_json, self.load_inventory_from_excel)
+
+    def import_inventory_file(self, file_path, label, source_key, source_label, load_json, load_excel):
+        """在背景匯入庫存或生產資料檔案，完成後與訂單保留量對帳並更新畫面
+
+        Args:
+            file_path: xlsx 或 JSON 檔案路徑
+            label: 顯示用的資料名稱
+            source_key: current_data_source 的鍵
+            source_label: 顯示資料來源的 Label
+            load_json / load_excel: 載入函式，接收 (file_path, progress)
+        """
+        def job(progress):
+            errors = None
             try:
                 if file_path.endswith('.json'):
-                    self.load_inventory_from_json(file_path)
+                    load_json(file_path, progress)
                 elif file_path.endswith('.xlsx'):
-                    self.load_inventory_from_excel(file_path)
-                
-                self.current_data_source["inventory"] = file_path
-                self.inventory_source_label.config(text=f"目前資料來源: {os.path.basename(file_path)}")
-                
-                # 刷新顯示
-                self.refresh_inventory()
-                self.refresh_product_list()  # 生產管理也需要更新
-                
-                # 自動儲存資料
-                self.auto_save_data()
-                
-                messagebox.showinfo("成功", f"已成功匯入庫存資料：{os.path.basename(file_path)}")
+                    errors = load_excel(file_path, progress)
+            except BaseException:
+                # 載入函式的批次異動已回復原有庫存，依回復後的庫存重算尚可分配量
+                self.production_manager.reconcile_reservations()
+                raise
+            # 匯入的尚可分配量與目前訂單的保留量對帳
+            drift = self.production_manager.reconcile_reservations()
+            return errors, drift
+        
+        def finish(result):
+            errors, drift = result
+            self.current_data_source[source_key] = file_path
+            source_label.config(text=f"目前資料來源: {os.path.basename(file_path)}")
+            
+            # 刷新顯示
+            self.refresh_inventory()
+            self.refresh_product_list()  # 生產管理也需要更新
+            
+            # 自動儲存資料
+            self.auto_save_data()
+            
+            message = f"已成功匯入{label}：{os.path.basename(file_path)}"
+            if not drift.empty:
+                message += f"\n{len(drift)} 個產品的尚可分配量與訂單保留量不一致，已依訂單修正"
+            if errors is not None and not errors.empty:
+                message += f"\n\n{len(errors)} 列無法匯入：\n{format_error_report(errors, limit=10)}"
+            messagebox.showinfo("成功", message)
+        
+        self.run_import(f"匯入{label}", job, finish)
+
+    def run_import(self, title, job, finish):
+        """在背景執行緒執行匯入，顯示進度與每秒處理列數，可取消；完成後在介面執行緒呼叫 finish(結果)
+
+        進度視窗為強制回應視窗，匯入期間無法操作其他功能，背景執行緒修改資料時介面不會同時讀寫；
+        畫面只在 finish 中更新一次。job 在取消或失敗時須自行回復資料後再拋出例外。
+
+        Args:
+            title: 進度視窗標題
+            job: job(progress) -> 結果，在背景執行緒執行
+            finish: finish(結果)，匯入完成後在介面執行緒執行
+        """
+        # 先寫完尚未完成的背景存檔，避免與匯入同時讀取資料
+        self.save_worker.flush()
+        worker = ImportWorker(job)
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.geometry("380x140")
+        dialog.resizable(False, False)
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        status_var = tk.StringVar(value="讀取中...")
+        ttk.Label(dialog, textvariable=status_var).pack(fill=tk.X, padx=10, pady=(15, 5))
+        progress_bar = ttk.Progressbar(dialog, mode='determinate', maximum=100)
+        progress_bar.pack(fill=tk.X, padx=10, pady=5)
+        
+        def cancel():
+            worker.cancel()
+            cancel_btn.config(state=tk.DISABLED)
+            status_var.set("取消中，正在回復資料...")
+        
+        cancel_btn = ttk.Button(dialog, text="取消", command=cancel)
+        cancel_btn.pack(pady=5)
+        dialog.protocol("WM_DELETE_WINDOW", cancel)
+        
+        def poll():
+            for event in worker.poll():
+                if event[0] == 'progress':
+                    if worker.cancelling:
+                        continue
+                    _, done, total, rate = event
+                    if total:
+                        progress_bar.config(mode='determinate')
+                        progress_bar['value'] = min(done / total, 1) * 100
+                        status_var.set(f"已處理 {done:,} / {total:,} 列（每秒 {rate:,.0f} 列）")
+                    else:
+                        # 工作表未記錄總列數時只顯示處理中
+                        progress_bar.config(mode='indeterminate')
+                        progress_bar.step(10)
+                        status_var.set(f"已處理 {done:,} 列（每秒 {rate:,.0f} 列）")
+                    continue
                 
-            except Exception as e:
-                messagebox.showerror("錯誤", f"匯入庫存資料失敗: {str(e)}")
+                dialog.grab_release()
+                dialog.destroy()
+                if event[0] == 'done':
+                    finish(event[1])
+                elif event[0] == 'cancelled':
+                    messagebox.showinfo("已取消", f"已取消{title}，資料已回復")
+                else:
+                    messagebox.showerror("錯誤", f"{title}失敗: {str(event[1])}")
+                return
+            self.root.after(100, poll)
+        
+        worker.start()
+        self.root.after(100, poll)
 
     # ==================== 資料載入方法（修復版本）====================
     
-    def load_orders_from_json(self, file_path):
-        """從JSON檔案載入訂單資料"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
+    def load_orders_from_json(self, file_path, progress=None):
+        """從JSON檔案載入訂單資料（串流讀取，邊解析邊建立訂單）"""
+        self.load_orders_from_records(iter_section(file_path, 'orders'), progress)
+
+    def load_orders_from_records(self, orders_data, progress=None):
+        """從訂單字典列表（orders_data.json 格式）載入訂單資料
+
+        Args:
+            orders_data: 訂單字典的可迭代物件
+            progress: 每讀取 EXCEL_CHUNK_ROWS 筆呼叫 progress(已讀取筆數, 0)（總數未知）
+        """
         # 清空現有訂單
         self.production_manager.orders = {}
         
-        orders_data = data.get('orders', [])
-        order_keys_added = set()
-        
-        for order_data in orders_data:
-            try:
-                order = Order(
-                    trans_type=order_data.get('trans_type', 'SO'),
-                    trans_id=order_data.get('trans_id', ''),
-                    seq_id=order_data.get('seq_id', '001'),
-                    prod_id=order_data.get('prod_id', ''),
-                    prod_name=order_data.get('prod_name', ''),
-                    quantity=order_data.get('quantity', 0),
-                    price=order_data.get('price', 0.0),
-                    cust_id=order_data.get('cust_id', ''),
-                    cust_name=order_data.get('cust_name', ''),
-                    facto_id=order_data.get('facto_id', ''),
-                    facto_name=order_data.get('facto_name', '')
-                )
-                
-                # 設置額外屬性
-                order.date = order_data.get('date', datetime.now().strftime("%Y-%m-%d"))
-                order.status = order_data.get('status', '新訂單')
-                order.allocated_quantity = order_data.get('allocated_quantity', 0)
-                
-                # 檢查重複
-                order_key = order.order_key
-                if order_key in order_keys_added:
-                    print(f"警告：發現重複的訂單 {order_key}，跳過")
+        def build_orders():
+            for count, order_data in enumerate(orders_data, 1):
+                if progress and count % self.EXCEL_CHUNK_ROWS == 0:
+                    progress(count, 0)
+                try:
+                    order = Order(
+                        trans_type=order_data.get('trans_type', 'SO'),
+                        trans_id=order_data.get('trans_id', ''),
+                        seq_id=order_data.get('seq_id', '001'),
+                        prod_id=order_data.get('prod_id', ''),
+                        prod_name=order_data.get('prod_name', ''),
+                        quantity=order_data.get('quantity', 0),
+                        price=order_data.get('price', 0.0),
+                        cust_id=order_data.get('cust_id', ''),
+                        cust_name=order_data.get('cust_name', ''),
+                        facto_id=order_data.get('facto_id', ''),
+                        facto_name=order_data.get('facto_name', '')
+                    )
+                    
+                    # 設置額外屬性
+                    order.date = order_data.get('date', datetime.now().strftime("%Y-%m-%d"))
+                    order.status = order_data.get('status', '新訂單')
+                    order.allocated_quantity = order_data.get('allocated_quantity', 0)
+                    order.produced_quantity = order_data.get('produced_quantity', 0)
+                    yield order
+                    
+                except Exception as e:
+                    print(f"處理訂單資料時發生錯誤: {e}")
                     continue
-                
-                # 修復：使用 preserve_status=True 保留原有狀態
-                self.production_manager.add_order(order, preserve_status=True)
-                order_keys_added.add(order_key)
-                
-                print(f"已載入訂單 {order_key}，產品：{order.prod_name}，狀態：{order.status}")
-                
-            except Exception as e:
-                print(f"處理訂單資料時發生錯誤: {e}")
-                continue
         
-        print(f"成功載入 {len(order_keys_added)} 筆訂單")
+        # 修復：使用 preserve_status=True 保留原有狀態
+        summary = self.production_manager.add_orders(build_orders(), preserve_status=True)
+        loaded = summary['added'] + summary['overwritten']
+        if progress:
+            progress(loaded, loaded)
+        print(f"成功載入 {loaded} 筆訂單")
 
-    def load_orders_from_excel(self, file_path):
-        """從Excel檔案載入訂單資料"""
-        df = pd.read_excel(file_path)
-        
+    def read_excel_chunks(self, file_path, progress=None):
+        """分段讀取 Excel 工作表：大檔以唯讀模式串流，小檔直接整張讀取為一段
+
+        Args:
+            file_path: xlsx 檔案路徑
+            progress: progress(已讀取列數, 總列數)，預設印出進度
+
+        Yields:
+            DataFrame，索引為資料在工作表中的列號
+        """
+        progress = progress or self.print_import_progress
+        if os.path.getsize(file_path) < self.EXCEL_STREAM_BYTES:
+            df = pd.read_excel(file_path)
+            df.index = df.index + 2  # 標題列之後由第 2 列開始
+            yield df
+            progress(len(df), len(df))
+            return
+        yield from iter_workbook_chunks(file_path, self.EXCEL_CHUNK_ROWS, progress=progress)
+
+    def iter_import_parts(self, file_path, kind, progress=None):
+        """依序產出整理後的 (資料, 錯誤報告)：來源檔案未變更時讀取匯入快取，否則解析 Excel 並寫入快取
+
+        Args:
+            file_path: xlsx 檔案路徑
+            kind: 'orders' 或 'inventory'
+            progress: progress(已處理列數, 總列數)，預設印出進度
+        """
+        cached = self.import_cache.reader(file_path, kind)
+        if cached is not None:
+            print(f"來源檔案未變更，使用匯入快取：{os.path.basename(file_path)}")
+            yield from cached.parts(progress or self.print_import_progress)
+            return
+        normalize = normalize_order_frame if kind == 'orders' else normalize_inventory_frame
+        seen_keys = set()  # 跨段檢查重複的訂單key或品名
+        with self.import_cache.writer(file_path, kind) as writer:
+            for chunk in self.read_excel_chunks(file_path, progress):
+                part = normalize(chunk, row_numbers=chunk.index, seen_keys=seen_keys)
+                writer.append(part, rows=len(chunk))
+                yield part
+
+    @staticmethod
+    def print_import_progress(done, total):
+        if total:
+            print(f"匯入進度：{done}/{total} 列 ({done / total:.0%})")
+        else:
+            print(f"匯入進度：已處理 {done} 列")
+
+    def iter_json_order_frames(self, file_path):
+        """分段讀取訂單 JSON 檔（orders_data.json 格式），每段轉為整理後的訂單 DataFrame"""
+        records = iter_section(file_path, 'orders')
+        while True:
+            chunk = list(itertools.islice(records, self.EXCEL_CHUNK_ROWS))
+            if not chunk:
+                return
+            frame = pd.DataFrame.from_records(chunk)
+            for field, default in self.JSON_ORDER_DEFAULTS.items():
+                frame[field] = frame[field].fillna(default) if field in frame else default
+            frame = frame[list(self.JSON_ORDER_DEFAULTS)]
+            for field in ('trans_id', 'seq_id'):
+                frame[field] = frame[field].astype(str)
+            yield frame[~(frame['trans_id'] + "-" + frame['seq_id']).duplicated()]
+
+    def merge_orders_from_file(self, file_path, delete_missing=False, progress=None, undo=None):
+        """合併匯入訂單：只套用新增與內容有變更的訂單，既有訂單保留本地狀態
+
+        Args:
+            file_path: xlsx 或訂單 JSON 檔案路徑
+            delete_missing: 是否刪除檔案中沒有的訂單
+            progress: progress(已處理列數, 總列數)
+            undo: 若提供列表，記錄修改既有訂單前的 (訂單, 欄位, 原值)（見 ProductionManager.merge_order_frame）
+
+        Returns:
+            (異動明細 DataFrame（訂單key、異動、變更欄位）, 錯誤報告 DataFrame)
+        """
+        if file_path.endswith('.json'):
+            def json_parts():
+                done = 0
+                for frame in self.iter_json_order_frames(file_path):
+                    yield frame, None
+                    done += len(frame)
+                    if progress:
+                        progress(done, 0)
+            parts = json_parts()
+        else:
+            parts = self.iter_import_parts(file_path, 'orders', progress)
+        
+        incoming_keys = set()
+        reports, errors = [], []
+        for orders, chunk_errors in parts:
+            incoming_keys.update(orders['trans_id'] + "-" + orders['seq_id'])
+            _, report = self.production_manager.merge_order_frame(orders, reconcile=False, undo=undo)
+            reports.append(report)
+            if chunk_errors is not None:
+                errors.append(chunk_errors)
+        
+        if delete_missing:
+            missing = [order_key for order_key in self.production_manager.orders if order_key not in incoming_keys]
+            self.production_manager.remove_orders(missing)
+            reports.append(pd.DataFrame({'訂單key': missing, '異動': "刪除", '變更欄位': ""}))
+        self.production_manager.reconcile_reservations()
+        
+        report = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=['訂單key', '異動', '變更欄位'])
+        errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=ERROR_COLUMNS)
+        for line in report[report['異動'] != "新增"].head(20).itertuples(index=False, name=None):
+            print(f"{line[1]} {line[0]} {line[2]}")
+        return report, errors
+
+    def load_orders_from_excel(self, file_path, progress=None):
+        """從Excel檔案載入訂單資料（每段以向量化運算整理後批次加入，大檔分段串流讀取，未變更的檔案讀取快取）
+
+        Returns:
+            錯誤報告 DataFrame（列號、單號、序號、原因），沒有錯誤時為空
+        """
         # 清空現有訂單
         self.production_manager.orders = {}
         
-        # 用於追蹤重複的訂單key
-        order_keys_added = set()
-        
-        for index, row in df.iterrows():
-            try:
-                # 修復：正確讀取單價
-                unit_price = float(row.get('單價', 0.0))
-                
-                # 構建訂單的唯一識別碼
-                trans_id = str(row.get('單號', ""))
-                seq_id = str(row.get('序號', "")).zfill(3)  # 確保序號是3位數格式
-                order_key = f"{trans_id}-{seq_id}"
-                
-                # 檢查是否已經添加過這個訂單
-                if order_key in order_keys_added:
-                    print(f"警告：發現重複的訂單 {order_key}，跳過")
-                    continue
-                
-                order = Order(
-                    trans_type=row.get('交易類型', "SO"),
-                    trans_id=trans_id,
-                    seq_id=seq_id,
-                    prod_id=row.get('品號', ""),
-                    prod_name=row.get('品名', ""),
-                    quantity=row.get('訂購數量', 0),
-                    price=unit_price,
-                    cust_id=row.get('客戶代號', ""),
-                    cust_name=row.get('客戶名稱', ""),
-                    facto_id=row.get('廠商代號', "F001"),
-                    facto_name=row.get('廠商名稱', "預設廠商")
-                )
-                
-                # 設置訂單的日期和狀態 - 保留原始狀態
-                order.date = str(row.get('提交日期', ""))
-                order.status = str(row.get('狀態', "新訂單"))
-                order.allocated_quantity = row.get('已分配量', 0)  # 新增：讀取已分配量
-                
-                # 修復：使用 preserve_status=True 保留原有狀態
-                self.production_manager.add_order(order, preserve_status=True)
-                order_keys_added.add(order_key)
-                
-                print(f"已載入訂單 {order_key}，產品：{order.prod_name}，狀態：{order.status}")
-                
-                # 確保對應的產品存在於庫存中
-                product_name = order.prod_name
-                if product_name not in self.inventory.products:
-                    initial_quantity = int(row.get('現有庫存量', 0))
-                    self.inventory.add_product(product_name, initial_quantity=initial_quantity)
-                    self.inventory.products[product_name]['cost'] = 100.0
-                    self.inventory.products[product_name]['allocatable'] = int(row.get('尚可分配量', 0))
-                    self.inventory.products[product_name]['product_id'] = row.get('品號', "")
-            
-            except Exception as e:
-                print(f"處理第 {index+1} 行訂單資料時發生錯誤: {e}")
-                print(f"該行資料: {dict(row)}")
-                continue
-        
-        print(f"成功載入 {len(order_keys_added)} 筆訂單")
+        errors = []
+        loaded = 0
+        for orders, chunk_errors in self.iter_import_parts(file_path, 'orders', progress):
+            # 修復：使用 preserve_status=True 保留原有狀態
+            summary = self.production_manager.add_order_frame(orders, preserve_status=True, reconcile=False)
+            loaded += summary['added'] + summary['overwritten']
+            errors.append(chunk_errors)
+        self.production_manager.reconcile_reservations()
+        
+        errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=ERROR_COLUMNS)
+        if not errors.empty:
+            print(f"訂單資料有 {len(errors)} 列無法匯入：\n{format_error_report(errors)}")
+        print(f"成功載入 {loaded} 筆訂單")
+        return errors
 
-    def load_production_from_json(self, file_path):
+    def load_production_from_json(self, file_path, progress=None):
         """從JSON檔案載入生產資料"""
         # 生產資料主要是庫存資料的子集，所以調用庫存載入
-        self.load_inventory_from_json(file_path)
+        self.load_inventory_from_json(file_path, progress)
 
-    def load_production_from_excel(self, file_path):
+    def load_production_from_excel(self, file_path, progress=None):
         """從Excel檔案載入生產資料"""
         # 生產資料主要是庫存資料的子集，所以調用庫存載入
-        self.load_inventory_from_excel(file_path)
+        return self.load_inventory_from_excel(file_path, progress)
+
+    def load_inventory_from_json(self, file_path, progress=None):
+        """從JSON檔案載入庫存資料（含尚未合併的交易日誌）
 
-    def load_inventory_from_json(self, file_path):
-        """從JSON檔案載入庫存資料"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        Args:
+            file_path: JSON 檔案路徑
+            progress: 讀取完成、替換庫存之前呼叫 progress(產品數, 產品數)
+        """
+        products_data, _ = load_inventory_file(file_path)
+        if progress:
+            progress(len(products_data), len(products_data))
         
         # 清空現有庫存
         self.inventory.products = {}
         
-        products_data = data.get('products', {})
         for product_name, product_info in products_data.items():
             self.inventory.products[product_name] = product_info
 
-    def load_inventory_from_excel(self, file_path):
-        """從Excel檔案載入庫存資料"""
-        df = pd.read_excel(file_path)
-        
-        # 清空現有庫存
-        self.inventory.products = {}
-        
-        for _, row in df.iterrows():
-            try:
-                product_name = str(row['品名'])
-                product_id = str(row['品號'])
-                unit_cost = float(row['單位成本'])
-                allocatable_qty = int(row['尚可分配量'])
-                current_stock = int(row['現有庫存量'])
-                
-                # 新增產品到庫存系統
-                if product_name not in self.inventory.products:
+    def load_inventory_from_excel(self, file_path, progress=None):
+        """從Excel檔案載入庫存資料（大檔分段串流讀取，每段整理後立即加入，未變更的檔案讀取快取）
+
+        Returns:
+            錯誤報告 DataFrame（列號、品名、原因），沒有錯誤時為空
+        """
+        errors = []
+        with self.inventory.batch():  # 整批匯入只保存一次，失敗時回復原有庫存
+            # 清空現有庫存
+            self.inventory.products = {}
+            
+            for products, chunk_errors in self.iter_import_parts(file_path, 'inventory', progress):
+                for product_name, product_id, unit_cost, allocatable_qty, current_stock in \
+                        products.itertuples(index=False, name=None):
+                    # 新增產品到庫存系統
                     self.inventory.add_product(product_name, initial_quantity=current_stock)
                     
                     # 設置產品的詳細資訊
                     self.inventory.products[product_name]['cost'] = unit_cost
-                    self.inventory.products[product_name]['allocatable'] = allocatable_qty
+                    self.inventory.products[product_name]['allocatable'] = allocatable_qty  # 匯入檔記錄的值，之後與訂單保留量對帳
                     self.inventory.products[product_name]['product_id'] = product_id
-                    
-            except Exception as e:
-                print(f"處理庫存資料時發生錯誤: {e}")
-                continue
+                errors.append(chunk_errors)
+        
+        errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=INVENTORY_ERROR_COLUMNS)
+        if not errors.empty:
+            print(f"庫存資料有 {len(errors)} 列無法匯入：\n{format_error_report(errors)}")
+        return errors
 
     # ==================== 自動儲存功能 ====================
     
     def auto_save_data(self):
-        """自動儲存所有資料到JSON檔案"""
+        """自動儲存所有資料（交給背景寫檔執行緒，連續多次呼叫只會寫入最新狀態）"""
         try:
-            # 儲存庫存資料
-            if self.inventory.products:
-                inventory_data = {
-                    'products': self.inventory.products,
-                    'transactions': [t.to_dict() for t in self.inventory.transactions] if hasattr(self.inventory, 'transactions') else []
-                }
-                with open("working_data/inventory_data.json", 'w', encoding='utf-8') as f:
-                    json.dump(inventory_data, f, ensure_ascii=False, indent=4)
-                print("✅ 庫存資料已儲存")
-            
-            # 儲存訂單資料 - 即使是空的也要儲存
-            orders_data = []
-            if self.production_manager.orders:
-                for order_key, order in self.production_manager.orders.items():
-                    order_dict = {
-                        'trans_type': order.trans_type,
-                        'trans_id': order.trans_id,
-                        'seq_id': order.seq_id,
-                        'prod_id': order.prod_id,
-                        'prod_name': order.prod_name,
-                        'quantity': order.quantity,
-                        'price': order.price,
-                        'cust_id': order.cust_id,
-                        'cust_name': order.cust_name,
-                        'facto_id': order.facto_id,
-                        'facto_name': order.facto_name,
-                        'date': getattr(order, 'date', datetime.now().strftime("%Y-%m-%d")),
-                        'status': order.status,
-                        'allocated_quantity': getattr(order, 'allocated_quantity', 0)
-                    }
-                    orders_data.append(order_dict)
+            # 日誌累積過多時在介面執行緒合併為快照，快照內容才會與日誌序號一致
+            if self.inventory.storage.needs_compaction():
+                self.inventory.save_data()
             
-            # 總是儲存訂單檔案，即使是空的
-            order_save_data = {'orders': orders_data}
-            with open("working_data/orders_data.json", 'w', encoding='utf-8') as f:
-                json.dump(order_save_data, f, ensure_ascii=False, indent=4)
+            # 儲存庫存資料（交易已寫入日誌，這裡只保存產品表）
+            if self.inventory.products:
+                self.save_worker.submit('products', self.save_products_job)
             
-            print(f"✅ 訂單資料已儲存 ({len(orders_data)} 筆訂單)")
-            print("✅ 資料已自動儲存至 working_data/ 目錄")
+            # 訂單有新增或替換、事件累積過多、或 SQLite 模式（訂單表不記錄事件序號）時才寫入快照；
+            # 這裡只複製訂單列表，轉換與寫入在背景進行
+            event_seq = self.order_events.seq
+            if (self.production_manager.orders_dirty or self.storage_mode == "sqlite"
+                    or event_seq - self.orders_snapshot_seq >= self.ORDER_SNAPSHOT_EVENTS):
+                orders = list(self.production_manager.orders.values())
+                self.save_worker.submit('orders', partial(self.save_orders_job, orders, event_seq))
+                self.production_manager.orders_dirty = False
+                self.orders_snapshot_seq = event_seq
             
         except Exception as e:
             print(f"❌ 自動儲存失敗: {str(e)}")
             # 顯示錯誤訊息給使用者
             messagebox.showwarning("儲存警告", f"資料儲存時發生問題: {str(e)}")
 
+    def save_products_job(self):
+        """背景寫檔：保存產品表"""
+        if not self.inventory.save_products(compact=False):
+            raise IOError("庫存資料寫入失敗")
+        print("✅ 庫存資料已儲存")
+
+    def save_orders_job(self, orders, event_seq=0):
+        """背景寫檔：保存訂單資料（JSON 模式以暫存檔改名方式寫入）
+
+        Args:
+            orders: 訂單物件列表
+            event_seq: 快照對應的訂單事件序號，載入時只重播其後的事件
+        """
+        orders_data = [self.order_to_dict(order) for order in orders]
+        if self.storage_mode == "sqlite":
+            self.inventory.storage.save_orders(orders_data)
+        else:
+            # event_seq 寫在訂單之前，載入時讀到訂單區段前即可取得
+            atomic_write_json(inventory_storage.ORDERS_JSON_PATH, {'event_seq': event_seq, 'orders': orders_data})
+        
+        print(f"✅ 訂單資料已儲存 ({len(orders_data)} 筆訂單)")
+        print("✅ 資料已自動儲存至 working_data/ 目錄")
+
+    @staticmethod
+    def order_to_dict(order):
+        """將訂單轉為 orders_data.json 格式的字典"""
+        return {
+            'trans_type': order.trans_type,
+            'trans_id': order.trans_id,
+            'seq_id': order.seq_id,
+            'prod_id': order.prod_id,
+            'prod_name': order.prod_name,
+            'quantity': order.quantity,
+            'price': order.price,
+            'cust_id': order.cust_id,
+            'cust_name': order.cust_name,
+            'facto_id': order.facto_id,
+            'facto_name': order.facto_name,
+            'date': getattr(order, 'date', datetime.now().strftime("%Y-%m-%d")),
+            'status': order.status,
+            'allocated_quantity': getattr(order, 'allocated_quantity', 0),
+            'produced_quantity': order.produced_quantity
+        }
+
+    def poll_save_errors(self):
+        """定期取出背景寫檔的錯誤並提示使用者"""
+        for key, error in self.save_worker.pop_errors():
+            print(f"❌ 自動儲存失敗 ({key}): {error}")
+            messagebox.showwarning("儲存警告", f"資料儲存時發生問題: {error}")
+        self.root.after(500, self.poll_save_errors)
+
     # ==================== 原有的功能方法（保持不變）====================
     
     def add_inventory_dialog(self):
@@ -740,7 +1052,6 @@ class ProductionManagerGUI:
                 # 新增產品
                 self.inventory.add_product(product_name, initial_quantity=quantity)
                 self.inventory.products[product_name]['cost'] = cost
-                self.inventory.products[product_name]['allocatable'] = quantity
                 self.inventory.products[product_name]['product_id'] = product_id or f"P{hash(product_name) % 1000:03d}"
                 
                 dialog.destroy()
@@ -779,16 +1090,12 @@ class ProductionManagerGUI:
                 messagebox.showerror("錯誤", f"調整後庫存數量不能小於0，當前: {current_qty}, 調整: {adjust_qty}")
                 return
             
-            # 調整庫存
+            # 調整庫存（尚可分配量 = 庫存量 - 保留量，隨庫存量變動）
             if adjust_qty > 0:
-                self.inventory.stock_in(product_name, adjust_qty, "手動調整")
-                # 增加尚可分配量
-                self.inventory.products[product_name]['allocatable'] += adjust_qty
+                # 入庫後自動分配給待料訂單
+                self.inventory.receive_stock(product_name, adjust_qty, "手動調整")
             elif adjust_qty < 0:
                 self.inventory.stock_out(product_name, abs(adjust_qty), "手動調整", "手動調整")
-                # 減少尚可分配量，但不能小於0
-                allocatable = self.inventory.products[product_name].get('allocatable', 0)
-                self.inventory.products[product_name]['allocatable'] = max(0, allocatable + adjust_qty)
             
             self.adj_qty_var.set("0")  # 重置調整數量
             self.refresh_inventory()
@@ -811,7 +1118,7 @@ class ProductionManagerGUI:
         
         # 添加到列表 - 包含成本資訊
         for product, info in inventory.items():
-            allocatable = info.get('allocatable', 0)
+            allocatable = self.inventory.get_available_quantity(product)
             cost = info.get('cost', 0.0)
             product_id = info.get('product_id', "P" + str(hash(product) % 1000))  # 使用實際品號或生成簡單品號
             
@@ -834,7 +1141,7 @@ class ProductionManagerGUI:
         
         # 添加到列表 - 包含成本資訊
         for product, info in inventory.items():
-            allocatable = info.get('allocatable', 0)
+            allocatable = self.inventory.get_available_quantity(product)
             cost = info.get('cost', 0.0)
             product_id = info.get('product_id', "P" + str(hash(product) % 1000))  # 使用實際品號或生成簡單品號
             
@@ -861,11 +1168,8 @@ class ProductionManagerGUI:
                 messagebox.showerror("錯誤", "生產數量必須大於0")
                 return
             
-            # 增加庫存
-            self.inventory.stock_in(product_name, quantity, "生產")
-            
-            # 增加尚可分配量
-            self.inventory.products[product_name]['allocatable'] += quantity
+            # 增加庫存與尚可分配量（receive_stock 自行以批次保存）
+            self.inventory.receive_stock(product_name, quantity, "生產")
             
             self.refresh_product_list()
             self.refresh_inventory()
@@ -876,6 +1180,35 @@ class ProductionManagerGUI:
         except ValueError:
             messagebox.showerror("錯誤", "生產數量必須是整數")
     
+    def show_shortfall_plan(self):
+        """顯示所有未結訂單的缺料分析（需求、庫存、需生產量與可用天數）"""
+        plan = self.production_manager.plan_shortfall()
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("缺料分析")
+        dialog.geometry("1100x500")
+        dialog.transient(self.root)
+        
+        columns = tuple(plan.columns)
+        tree = ttk.Treeview(dialog, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=200 if col == "品名" else 90, anchor=tk.W if col == "品名" else tk.E)
+        
+        scrollbar = ttk.Scrollbar(dialog, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        for row in plan.itertuples(index=False):
+            name, *numbers, usage, coverage = row
+            tree.insert("", tk.END, values=(
+                name,
+                *(f"{value:g}" for value in numbers),
+                f"{usage:.2f}",
+                "-" if coverage == float('inf') else f"{coverage:.1f}"
+            ))
+    
     def add_order_dialog(self):
         """新增訂單對話框"""
         dialog = tk.Toplevel(self.root)
@@ -925,12 +1258,8 @@ class ProductionManagerGUI:
         customer_var = tk.StringVar()
         customer_combo = ttk.Combobox(header_frame, textvariable=customer_var, width=15)
         
-        # 獲取現有訂單中的所有客戶名稱（和篩選條件使用相同的邏輯）
-        all_order_objects = list(self.production_manager.orders.values())
-        all_customers = set()
-        for order_obj in all_order_objects:
-            if order_obj.cust_name:
-                all_customers.add(order_obj.cust_name)
+        # 獲取現有訂單中的所有客戶名稱（和篩選條件使用相同的邏輯，直接取自客戶索引）
+        all_customers = {name for name in self.production_manager.get_index_values('cust_name') if name}
         
         # 設置客戶下拉選單選項（不包含"全部"，因為新增訂單必須選擇具體客戶）
         customer_list = sorted(list(all_customers))
@@ -1100,34 +1429,35 @@ class ProductionManagerGUI:
                 order_id = order_id_var.get()  # 基礎訂單編號
                 customer = customer_var.get()
                 
-                # 修正：為每個訂單明細創建獨立的訂單，使用不同的訂單ID
-                for detail in order_details:
-                    # 為每個明細創建唯一的訂單ID（基礎ID + 序號）
-                    unique_order_id = f"{order_id}-{detail['seq_id']}"
-                    
-                    order = Order(
-                        trans_type="SO2",  # 使用 SO2 作為交易類型
-                        trans_id=unique_order_id,  # 使用唯一的訂單ID
-                        seq_id=detail["seq_id"],
-                        prod_id="P" + str(hash(detail["product"]) % 1000),
-                        prod_name=detail["product"],
-                        quantity=detail["quantity"],
-                        price=detail["price"],
-                        cust_id="C" + str(hash(customer) % 1000),
-                        cust_name=customer,
-                        facto_id="F001",
-                        facto_name="預設廠商"
-                    )
-                    
-                    # 設置訂單的日期
-                    order.date = order_date
-                    
-                    # 設置訂單的已分配量為0
-                    order.allocated_quantity = 0
+                with self.inventory.batch():  # 新產品在結束時一次保存
+                    # 修正：為每個訂單明細創建獨立的訂單，使用不同的訂單ID
+                    for detail in order_details:
+                        # 為每個明細創建唯一的訂單ID（基礎ID + 序號）
+                        unique_order_id = f"{order_id}-{detail['seq_id']}"
+                        
+                        order = Order(
+                            trans_type="SO2",  # 使用 SO2 作為交易類型
+                            trans_id=unique_order_id,  # 使用唯一的訂單ID
+                            seq_id=detail["seq_id"],
+                            prod_id="P" + str(hash(detail["product"]) % 1000),
+                            prod_name=detail["product"],
+                            quantity=detail["quantity"],
+                            price=detail["price"],
+                            cust_id="C" + str(hash(customer) % 1000),
+                            cust_name=customer,
+                            facto_id="F001",
+                            facto_name="預設廠商"
+                        )
+                        
+                        # 設置訂單的日期
+                        order.date = order_date
+                        
+                        # 設置訂單的已分配量為0
+                        order.allocated_quantity = 0
+                        
+                        # 修復：使用 preserve_status=False，新增的訂單應該是「新訂單」
+                        self.production_manager.add_order(order, preserve_status=False)
                     
-                    # 修復：使用 preserve_status=False，新增的訂單應該是「新訂單」
-                    self.production_manager.add_order(order, preserve_status=False)
-                
                 dialog.destroy()
                 self.refresh_order_list()
                 self.refresh_product_list()
@@ -1168,21 +1498,7 @@ class ProductionManagerGUI:
         order_key = self.get_order_key_from_ui(item)
             
         if messagebox.askyesno("確認", f"確定要取消訂單 {order_key} 嗎?"):
-            # 獲取訂單資訊
-            order_info = self.production_manager.get_order_status(order_key)
-            if not order_info:
-                messagebox.showerror("錯誤", f"無法獲取訂單 {order_key} 的資訊")
-                return
-                
-            # 如果訂單已經分配了庫存，需要返回庫存
-            product_name = order_info["產品"]
-            allocated_quantity = order_info.get("已分配量", 0)
-                
-            if allocated_quantity > 0 and product_name in self.inventory.products:
-                # 返回庫存的尚可分配量
-                self.inventory.products[product_name]['allocatable'] += allocated_quantity
-                
-            # 取消訂單
+            # 取消訂單（已分配的庫存隨保留量解除而回到尚可分配量）
             result = self.production_manager.cancel_order(order_key)
             if result:
                 messagebox.showinfo("成功", f"訂單 {order_key} 已取消")
@@ -1227,7 +1543,7 @@ class ProductionManagerGUI:
             messagebox.showerror("錯誤", f"產品 '{product_name}' 不存在於庫存中")
             return
             
-        allocatable_quantity = self.inventory.products[product_name].get('allocatable', 0)
+        allocatable_quantity = self.inventory.get_available_quantity(product_name)
             
         if allocatable_quantity <= 0:
             messagebox.showerror("錯誤", "沒有可分配的庫存")
@@ -1242,19 +1558,14 @@ class ProductionManagerGUI:
             
         # 確認分配
         if messagebox.askyesno("確認", f"確定要分配 {quantity_to_allocate} 個 {product_name} 到訂單 {order_key} 嗎?"):
-            # 減少尚可分配量
-            self.inventory.products[product_name]['allocatable'] -= quantity_to_allocate
-                
-            # 更新訂單的已分配量
             order = self.production_manager.orders.get(order_key)
             if order:
-                order.allocated_quantity = allocated_quantity + quantity_to_allocate
-                    
-                # 如果全部分配完成，更新狀態
-                if order.allocated_quantity >= order.quantity:
-                    order.status = "已分配"
-                else:
-                    order.status = "部分分配"
+                # 更新訂單的已分配量，如果全部分配完成則狀態為已分配（記錄為訂單事件並保留庫存）
+                new_allocated = allocated_quantity + quantity_to_allocate
+                status = "已分配" if new_allocated >= order.quantity else "部分分配"
+                if not self.production_manager.transition(order_key, status, new_allocated):
+                    messagebox.showerror("錯誤", f"訂單 {order_key} 目前狀態無法分配")
+                    return
                     
                 messagebox.showinfo("成功", f"已分配 {quantity_to_allocate} 個 {product_name} 到訂單 {order_key}")
                 self.refresh_order_list()
@@ -1264,68 +1575,104 @@ class ProductionManagerGUI:
             else:
                 messagebox.showerror("錯誤", f"找不到訂單 {order_key}")
 
-    def ship_order_from_list(self):
-        """從訂單列表出貨訂單"""
+    def batch_allocate_orders(self):
+        """依優先級與日期一次分配所有待分配訂單（先試算，確認後套用）"""
+        plan = self.production_manager.allocate_orders(dry_run=True)
+        if not plan:
+            messagebox.showinfo("提示", "沒有可分配的訂單或庫存")
+            return
+        
+        # 依產品彙總試算結果
+        totals = {}
+        for entry in plan:
+            count, quantity = totals.get(entry['product'], (0, 0))
+            totals[entry['product']] = (count + 1, quantity + entry['quantity'])
+        lines = [f"{name}：{count} 筆訂單，共 {quantity} 個" for name, (count, quantity) in totals.items()]
+        if len(lines) > 15:
+            lines = lines[:15] + [f"...等 {len(totals)} 項產品"]
+        
+        if messagebox.askyesno("確認", "將依優先級分配以下庫存:\n" + "\n".join(lines)):
+            total = self.production_manager.apply_allocation(plan)
+            messagebox.showinfo("成功", f"已分配 {len(plan)} 筆訂單，共 {total} 個")
+            self.refresh_order_list()
+            self.refresh_product_list()
+            self.refresh_inventory()
+            self.auto_save_data()  # 自動儲存
+
+    def query_available_to_promise(self):
+        """查詢選取訂單的產品到指定日期的可承諾量，以及可承諾該訂單數量的最早日期"""
         if not self.order_tree.selection():
             messagebox.showinfo("提示", "請先選擇一個訂單")
             return
         
-        item = self.order_tree.selection()[0]
-        order_key = self.get_order_key_from_ui(item)
+        order = self.production_manager.orders.get(self.get_order_key_from_ui(self.order_tree.selection()[0]))
+        if not order:
+            messagebox.showerror("錯誤", "找不到選取的訂單")
+            return
         
-        # 檢查訂單狀態
-        order_info = self.production_manager.get_order_status(order_key)
-        if not order_info:
-            messagebox.showerror("錯誤", f"無法獲取訂單 {order_key} 的資訊")
+        by_date = simpledialog.askstring("可承諾查詢", "查詢日期 (YYYY-MM-DD):",
+                                         initialvalue=datetime.now().strftime("%Y-%m-%d"), parent=self.root)
+        if not by_date:
+            return
+        try:
+            datetime.strptime(by_date, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("錯誤", "日期格式必須為 YYYY-MM-DD")
             return
         
-        if order_info["狀態"] != "已分配" and order_info["狀態"] != "部分分配":
-            messagebox.showerror("錯誤", f"只有已分配的訂單才能出貨，當前狀態: {order_info['狀態']}")
+        available = self.atp.available_to_promise(order.prod_name, by_date)
+        earliest = self.atp.earliest_promise_date(order.prod_name, order.quantity)
+        earliest_text = earliest.isoformat() if earliest else "預測範圍內無法承諾"
+        messagebox.showinfo("可承諾查詢",
+                            f"產品：{order.prod_name}\n"
+                            f"{by_date} 前可承諾量：{available:g}\n"
+                            f"再承諾 {order.quantity} 個的最早日期：{earliest_text}")
+
+    def ship_order_from_list(self):
+        """從訂單列表出貨選取的訂單（可多選，整批只保存一次）"""
+        if not self.order_tree.selection():
+            messagebox.showinfo("提示", "請先選擇一個訂單")
             return
         
-        # 檢查庫存是否足夠
-        product_name = order_info["產品"]
-        allocated_quantity = order_info.get("已分配量", 0)
+        order_keys = [self.get_order_key_from_ui(item) for item in self.order_tree.selection()]
         
-        if allocated_quantity <= 0:
-            messagebox.showerror("錯誤", "此訂單沒有分配庫存，無法出貨")
-            return
+        # 單筆時沿用原本的檢查訊息
+        if len(order_keys) == 1:
+            order_key = order_keys[0]
+            order_info = self.production_manager.get_order_status(order_key)
+            if not order_info:
+                messagebox.showerror("錯誤", f"無法獲取訂單 {order_key} 的資訊")
+                return
+            if order_info["狀態"] not in self.production_manager.SHIPPABLE_STATUSES:
+                messagebox.showerror("錯誤", f"只有已分配的訂單才能出貨，當前狀態: {order_info['狀態']}")
+                return
+            prompt = f"確定要出貨訂單 {order_key} 嗎?"
+        else:
+            prompt = f"確定要出貨選取的 {len(order_keys)} 筆訂單嗎?"
         
-        if product_name not in self.inventory.products:
-            messagebox.showerror("錯誤", f"產品 '{product_name}' 不存在於庫存中")
+        if not messagebox.askyesno("確認", prompt):
             return
         
-        available_stock = self.inventory.products[product_name]["quantity"]
+        results = self.production_manager.ship_orders(order_keys)
+        shipped = [key for key, result in results.items() if result['success']]
+        failed = [f"{key}：{result['message']}" for key, result in results.items() if not result['success']]
         
-        if available_stock < allocated_quantity:
-            messagebox.showerror("錯誤", f"庫存不足！需要: {allocated_quantity}, 可用: {available_stock}")
-            return
+        if shipped:
+            self.refresh_order_list()
+            self.refresh_product_list()
+            self.refresh_inventory()
+            self.auto_save_data()  # 自動儲存
         
-        # 確認出貨
-        if messagebox.askyesno("確認", f"確定要出貨訂單 {order_key} 嗎? 將從庫存扣除 {allocated_quantity} 個 {product_name}"):
-            # 從庫存中扣除
-            result = self.inventory.stock_out(
-                product_name, 
-                allocated_quantity, 
-                order_key, 
-                f"出貨訂單 {order_key}"
-            )
-            
-            if result:
-                # 更新訂單狀態
-                order = self.production_manager.orders.get(order_key)
-                if order:
-                    order.status = "已出貨"
-                    
-                    messagebox.showinfo("成功", f"訂單 {order_key} 已出貨")
-                    self.refresh_order_list()
-                    self.refresh_product_list()
-                    self.refresh_inventory()
-                    self.auto_save_data()  # 自動儲存
-                else:
-                    messagebox.showerror("錯誤", f"找不到訂單 {order_key}")
+        if not failed:
+            messagebox.showinfo("成功", f"已出貨 {len(shipped)} 筆訂單")
+        else:
+            if len(failed) > 15:
+                failed = failed[:15] + [f"...等 {len(failed)} 筆"]
+            message = "\n".join(failed)
+            if shipped:
+                messagebox.showwarning("部分出貨", f"已出貨 {len(shipped)} 筆訂單，以下訂單未出貨:\n{message}")
             else:
-                messagebox.showerror("錯誤", f"從庫存扣除失敗")
+                messagebox.showerror("錯誤", f"訂單未出貨:\n{message}")
 
     def refresh_order_list(self):
         """刷新訂單列表（修復版本）"""
@@ -1333,16 +1680,10 @@ class ProductionManagerGUI:
         for item in self.order_tree.get_children():
             self.order_tree.delete(item)
         
-        # 獲取所有訂單物件（不是基本資訊）
-        all_order_objects = list(self.production_manager.orders.values())
+        print(f"總共有 {len(self.production_manager.orders)} 筆訂單")
         
-        print(f"總共有 {len(all_order_objects)} 筆訂單")
-        
-        # 收集所有客戶名稱
-        all_customers = set()
-        for order_obj in all_order_objects:
-            if order_obj.cust_name:
-                all_customers.add(order_obj.cust_name)
+        # 收集所有客戶名稱（直接取自客戶索引，不必走訪所有訂單）
+        all_customers = {name for name in self.production_manager.get_index_values('cust_name') if name}
         
         # 更新客戶下拉選單選項
         customer_list = ["全部"] + sorted(list(all_customers))
@@ -1354,23 +1695,21 @@ class ProductionManagerGUI:
             self.customer_filter_var.set("全部")
             self.customer_combo.current(0)
         
-        # 應用篩選條件
-        filtered_orders = []
-        for order_obj in all_order_objects:
-            # 篩選日期 - 修改邏輯，如果日期欄位為空則不篩選日期
-            order_date = getattr(order_obj, 'date', '')
-            if self.date_var.get() and self.date_var.get() != order_date:
-                continue
-            
-            # 篩選客戶
-            if self.customer_filter_var.get() != "全部" and self.customer_filter_var.get() != order_obj.cust_name:
-                continue
-            
-            # 篩選狀態
-            if self.status_filter_var.get() != "全部" and self.status_filter_var.get() != order_obj.status:
-                continue
-            
-            filtered_orders.append(order_obj)
+        # 應用篩選條件（走訂單索引，成本與符合的筆數成正比）
+        criteria = {}
+        # 篩選日期 - 如果日期欄位為空則不篩選日期
+        if self.date_var.get():
+            criteria['date'] = self.date_var.get()
+        
+        # 篩選客戶
+        if self.customer_filter_var.get() != "全部":
+            criteria['cust_name'] = self.customer_filter_var.get()
+        
+        # 篩選狀態
+        if self.status_filter_var.get() != "全部":
+            criteria['status'] = self.status_filter_var.get()
+        
+        filtered_orders = self.production_manager.find_orders(**criteria)
         
         print(f"篩選後有 {len(filtered_orders)} 筆訂單")
         
@@ -1384,7 +1723,7 @@ class ProductionManagerGUI:
             
             if product_name in self.inventory.products:
                 stock_quantity = self.inventory.products[product_name]["quantity"]
-                allocatable_quantity = self.inventory.products[product_name].get('allocatable', 0)
+                allocatable_quantity = self.inventory.get_available_quantity(product_name)
                 product_id = self.inventory.products[product_name].get('product_id', order.prod_id)  # 獲取實際品號
             else:
                 product_id = order.prod_id  # 如果庫存中沒有，使用訂單中的品號
@@ -0,0 +1,216 @@
+import os
+import json
+import hashlib
+
+import pandas as pd
+
+from inventory_storage import atomic_write_json
+
+try:
+    import pyarrow  # noqa: F401  pd.read_feather / DataFrame.to_feather 需要
+    FEATHER_AVAILABLE = True
+except ImportError:
+    FEATHER_AVAILABLE = False
+
+
+IMPORT_CACHE_DIR = "working_data/import_cache"
+CACHE_VERSION = 1  # 整理方式改變時遞增，舊的快取自然不再命中
+
+
+def file_digest(file_path, block_size=1024 * 1024):
+    """檔案內容的 SHA-1"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ==================== ImportCache ====================
+class ImportCache:
+    """匯入快取：保存 Excel 解析並整理後的 DataFrame，來源檔案未變更時直接讀取
+
+    快取以檔案內容雜湊為鍵，不同路徑、不同人複製的同一份檔案共用一份快取；
+    另以路徑記錄檔案大小與修改時間，兩者都沒變時沿用上次的雜湊，不必重讀整個檔案。
+    每段資料各存成一個 Feather 檔（Arrow 欄位式二進位格式），讀取時依序產出，記憶體用量與分段匯入相同。
+    所有段落寫完後才寫入清單檔，清單檔存在才算命中；總大小超過上限時刪除最久未使用的項目。
+    """
+
+    def __init__(self, directory=IMPORT_CACHE_DIR, max_bytes=256 * 1024 * 1024):
+        """建立快取
+
+        Args:
+            directory: 快取資料夾
+            max_bytes: 快取總大小上限
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = FEATHER_AVAILABLE
+        self._index_path = os.path.join(directory, "index.json")
+
+    # ==================== 快取鍵 ====================
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def entry_key(self, file_path, kind):
+        """來源檔案對應的快取鍵：種類、格式版本與內容雜湊"""
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        index = self._load_index()
+        known = index.get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            digest = known['sha1']
+        else:
+            digest = file_digest(file_path)
+            index[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest}
+            atomic_write_json(self._index_path, index, indent=None)
+        return f"{kind}-v{CACHE_VERSION}-{digest}"
+
+    def _manifest_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _part_path(self, key, part, position):
+        return os.path.join(self.directory, f"{key}-{part:05d}-{position}.feather")
+
+    # ==================== 讀寫 ====================
+
+    def reader(self, file_path, kind):
+        """快取命中時回傳 CacheReader，否則回傳 None"""
+        if not self.enabled:
+            return None
+        key = self.entry_key(file_path, kind)
+        manifest_path = self._manifest_path(key)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(manifest_path)  # 記錄最近使用時間，供淘汰順序使用
+        return CacheReader(self, key, manifest)
+
+    def writer(self, file_path, kind):
+        """建立寫入器；快取停用時回傳不做任何事的寫入器"""
+        key = self.entry_key(file_path, kind) if self.enabled else None
+        return CacheWriter(self, key)
+
+    def _entries(self):
+        """目前的快取項目：快取鍵 -> [最近使用時間, 總大小, 檔案列表]"""
+        entries = {}
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name == "index.json" or not os.path.isfile(path):
+                continue
+            if name.endswith(".json"):
+                key = name[:-len(".json")]
+            elif name.endswith(".feather"):
+                key = name.rsplit('-', 2)[0]
+            else:
+                continue
+            entry = entries.setdefault(key, [0, 0, []])
+            stat = os.stat(path)
+            if name.endswith(".json"):
+                entry[0] = stat.st_mtime
+            entry[1] += stat.st_size
+            entry[2].append(path)
+        return entries
+
+    def evict(self, keep=None):
+        """總大小超過上限時，由最久未使用的項目開始刪除（不刪除 keep）
+
+        Returns:
+            刪除的項目數
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries.values())
+        removed = 0
+        for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in paths:
+                os.remove(path)
+            total -= size
+            removed += 1
+        if removed:
+            print(f"匯入快取超過 {self.max_bytes // (1024 * 1024)} MB，已刪除 {removed} 個最久未使用的項目")
+        return removed
+
+    def clear(self):
+        """刪除所有快取"""
+        for _, _, paths in self._entries().values():
+            for path in paths:
+                os.remove(path)
+
+
+# ==================== CacheReader / CacheWriter ====================
+class CacheReader:
+    """依序讀取快取項目中的各段資料"""
+
+    def __init__(self, cache, key, manifest):
+        self.cache = cache
+        self.key = key
+        self.manifest = manifest
+
+    def parts(self, progress=None):
+        """依序產出每段的 DataFrame 元組（與寫入時相同）
+
+        Args:
+            progress: 每段讀取後呼叫 progress(已讀取列數, 總列數)
+        """
+        done = 0
+        for part, (width, rows) in enumerate(self.manifest['parts']):
+            yield tuple(pd.read_feather(self.cache._part_path(self.key, part, position)) for position in range(width))
+            done += rows
+            if progress:
+                progress(done, self.manifest['rows'])
+
+
+class CacheWriter:
+    """逐段寫入快取項目，以 with 使用：正常結束時寫入清單檔並執行淘汰，發生例外或中途停止時刪除已寫的段落"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.parts = []  # [(DataFrame 數, 來源列數)]
+        self.rows = 0
+
+    def append(self, frames, rows=None):
+        """寫入一段資料
+
+        Args:
+            frames: DataFrame 元組（例如 normalize_order_frame 的 (orders, errors)）
+            rows: 此段對應的來源列數，供讀取時回報進度；預設為第一個 DataFrame 的列數
+        """
+        if self.key is None:
+            return
+        rows = len(frames[0]) if rows is None else rows
+        os.makedirs(self.cache.directory, exist_ok=True)
+        for position, frame in enumerate(frames):
+            frame.reset_index(drop=True).to_feather(self.cache._part_path(self.key, len(self.parts), position))
+        self.parts.append((len(frames), rows))
+        self.rows += rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.key is None:
+            return False
+        if exc_type is not None:
+            for part, (width, _) in enumerate(self.parts):
+                for position in range(width):
+                    path = self.cache._part_path(self.key, part, position)
+                    if os.path.exists(path):
+                        os.remove(path)
+            return False
+        atomic_write_json(self.cache._manifest_path(self.key), {'parts': self.parts, 'rows': self.rows}, indent=None)
+        self.cache.evict(keep=self.key)
+        return False
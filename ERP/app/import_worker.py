@@ -0,0 +1,68 @@
+import queue
+import threading
+import time
+
+
+class ImportCancelled(Exception):
+    """使用者取消匯入"""
+
+
+# ==================== ImportWorker ====================
+class ImportWorker:
+    """在背景執行緒執行一次匯入，進度與結果經由佇列交回介面執行緒
+
+    匯入函式接收 progress(已處理列數, 總列數) 回呼，每處理一段就呼叫一次；
+    回呼同時是取消的檢查點，使用者取消後下一次呼叫會拋出 ImportCancelled，
+    讓匯入函式中的批次異動與呼叫端的回復處理在例外中執行。
+    介面執行緒以 root.after 定期呼叫 poll 取出事件，不直接接觸背景執行緒。
+    """
+
+    def __init__(self, job):
+        """建立匯入工作（尚未啟動）
+
+        Args:
+            job: job(progress) -> 結果，在背景執行緒中執行
+        """
+        self.job = job
+        self.events = queue.Queue()  # ('progress', 已處理列數, 總列數, 每秒列數) / ('done', 結果) /
+        #                              ('cancelled', None) / ('error', 例外)
+        self._cancel = threading.Event()
+        self._started = None
+        self._thread = threading.Thread(target=self._run, name="ImportWorker", daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def cancel(self):
+        """要求取消，匯入函式在下一個檢查點停止並回復"""
+        self._cancel.set()
+
+    @property
+    def cancelling(self):
+        return self._cancel.is_set()
+
+    def progress(self, done, total):
+        """進度回呼（背景執行緒呼叫）"""
+        if self._cancel.is_set():
+            raise ImportCancelled()
+        elapsed = time.perf_counter() - self._started
+        self.events.put(('progress', done, total, done / elapsed if elapsed > 0 else 0.0))
+
+    def _run(self):
+        try:
+            # 最後一個檢查點之後才按下取消時，匯入已完成，仍視為完成
+            self.events.put(('done', self.job(self.progress)))
+        except ImportCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', e))
+
+    def poll(self):
+        """取出目前所有事件（介面執行緒呼叫）"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
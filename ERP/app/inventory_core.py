@@ -1,11 +1,19 @@
-import os
+import sys
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Optional, Union
-import json
 import logging
-from datetime import datetime
+import heapq
+import numbers
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import uuid
 
+from inventory_storage import create_storage
+from transaction_archive import TransactionArchive, archive_directory, previous_month
+from order_table import OrderTable, OrderRow
+from order_events import apply_event, can_transition, ALLOCATION_STATUSES, PRODUCTION_STATUSES
+
 # 設置日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -20,8 +28,19 @@ logger = logging.getLogger("燈具庫存系統")
 
 # # ==================== InventoryTransaction ====================
 class InventoryTransaction:
-    """庫存交易記錄類別，用於詳細記錄庫存的每次變動"""
-    
+    """庫存交易記錄類別，用於詳細記錄庫存的每次變動
+
+    為了在百萬筆以上的交易歷史中節省記憶體，記錄使用 __slots__ 儲存：
+    交易類型存為小整數代碼、時間存為微秒整數、產品名稱與備註經過 intern 共用同一字串。
+    """
+
+    __slots__ = ('transaction_id', '_timestamp', 'product_name', '_type_code', 'quantity', 'order_id', 'notes')
+
+    TYPE_NAMES = ['in', 'out', 'adjust']  # 交易類型代碼 -> 名稱
+    TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}  # 交易類型名稱 -> 代碼
+    EPOCH = datetime(1970, 1, 1)
+    MICROSECOND = timedelta(microseconds=1)
+
     def __init__(self, product_name, transaction_type, quantity, order_id=None, notes=""):
         """初始化庫存交易記錄
         
@@ -34,11 +53,47 @@ class InventoryTransaction:
         """
         self.transaction_id = str(uuid.uuid4())[:8]  # 生成短UUID作為交易ID
         self.timestamp = datetime.now()
-        self.product_name = product_name
+        self.product_name = _intern(product_name)
         self.transaction_type = transaction_type
         self.quantity = quantity
         self.order_id = order_id
-        self.notes = notes
+        self.notes = _intern(notes)
+
+    @classmethod
+    def from_dict(cls, data):
+        """由 to_dict 格式的字典還原交易記錄（不產生新的交易ID與時間）"""
+        transaction = cls.__new__(cls)
+        transaction.transaction_id = data['TransactionID']
+        transaction.timestamp = datetime.fromisoformat(data['Timestamp'])
+        transaction.product_name = _intern(data['ProductName'])
+        transaction.transaction_type = data['TransactionType']
+        transaction.quantity = data['Quantity']
+        transaction.order_id = _intern(data.get('OrderID'))
+        transaction.notes = _intern(data.get('Notes', ''))
+        return transaction
+
+    @property
+    def timestamp(self):
+        """交易時間 (datetime)"""
+        return self.EPOCH + self._timestamp * self.MICROSECOND
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = (value - self.EPOCH) // self.MICROSECOND
+
+    @property
+    def transaction_type(self):
+        """交易類型名稱"""
+        return self.TYPE_NAMES[self._type_code]
+
+    @transaction_type.setter
+    def transaction_type(self, value):
+        code = self.TYPE_CODES.get(value)
+        if code is None:
+            code = len(self.TYPE_NAMES)
+            self.TYPE_NAMES.append(value)
+            self.TYPE_CODES[value] = code
+        self._type_code = code
     
     def to_dict(self):
         """將交易記錄轉換為字典格式"""
@@ -52,42 +107,85 @@ class InventoryTransaction:
             "Notes": self.notes
         }
 
+
+def _intern(value):
+    """字串經 intern 後重複值共用同一物件，其餘型別原樣回傳"""
+    return sys.intern(value) if type(value) is str else value
+
 # ==================== Inventory ====================
 class Inventory:
     """庫存管理類別，處理產品庫存的增減與分析"""
     
-    def __init__(self, database_path="working_data/inventory_data.json"):
-        """初始化庫存管理"""
+    def __init__(self, database_path="working_data/inventory_data.json", storage_mode="json", lazy_history=False):
+        """初始化庫存管理
+
+        Args:
+            database_path: 庫存資料檔路徑
+            storage_mode: 儲存模式 ('json': 每次異動重寫整個檔案, 'journal': 快照 + 追加式交易日誌)
+            lazy_history: 載入時只讀取產品表，交易歷史等到第一次需要時才讀取
+        """
         self.products = {}  # 產品庫存資訊
-        self.transactions = []  # 庫存交易記錄
-        self.database_path = database_path
+        self._transactions = []  # 庫存交易記錄（歷史尚未讀取時只含載入後新增的交易）
+        self._product_index = {}  # 產品名稱 -> 交易在 transactions 中的位置
+        self._order_index = {}  # 訂單編號 -> 交易在 transactions 中的位置
+        self._transaction_count = 0  # 經 _append_transaction 新增的筆數，批次回復時用來判斷要移除幾筆
+        self.lazy_history = lazy_history
+        self._history_pending = False  # 是否還有尚未讀取的交易歷史
+        self._history_mark = None  # 交給儲存層以讀取載入當時的交易歷史
+        self.storage = create_storage(storage_mode, database_path)
+        self._archive = None  # 已結束月份的交易封存區
         self.alerts = []  # 庫存警報記錄
+        self._batch = None  # 進行中的批次異動
+        self.stock_listeners = []  # 可分配庫存增加時呼叫 listener(產品名稱, 數量)，例如自動分配待料訂單
+        self.reservations = {}  # 保留量帳：訂單key -> (產品名稱, 保留數量)
+        self._reserved = {}  # 產品名稱 -> 保留數量合計
+        self.transaction_listeners = []  # 新增或回復交易時呼叫 listener(交易物件)
         
         # 若資料庫檔案存在，則載入資料
         self.load_data()
+
+    @property
+    def database_path(self):
+        """庫存資料檔路徑"""
+        return self.storage.database_path
+
+    @database_path.setter
+    def database_path(self, path):
+        self.storage.database_path = path
+
+    @property
+    def archive(self):
+        """已結束月份的交易封存區，目錄隨資料檔路徑而定"""
+        directory = archive_directory(self.database_path)
+        if self._archive is None or self._archive.directory != directory:
+            self._archive = TransactionArchive(directory)
+        return self._archive
+
+    @property
+    def transactions(self):
+        """庫存交易記錄（延遲載入模式下第一次存取時才讀取歷史）"""
+        if self._history_pending:
+            self.load_history()
+        return self._transactions
     
     def load_data(self):
-        """從檔案中載入庫存資料"""
-        if os.path.exists(self.database_path):
+        """從檔案中載入庫存資料（日誌模式會一併重播交易日誌）"""
+        if self.storage.exists():
             try:
-                with open(self.database_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.products = data.get('products', {})
-                    
-                    # 轉換交易記錄為物件
-                    transactions_data = data.get('transactions', [])
-                    self.transactions = []
-                    for t in transactions_data:
-                        transaction = InventoryTransaction(
-                            t['ProductName'], 
-                            t['TransactionType'], 
-                            t['Quantity'], 
-                            t.get('OrderID'), 
-                            t.get('Notes', '')
-                        )
-                        transaction.transaction_id = t['TransactionID']
-                        transaction.timestamp = datetime.fromisoformat(t['Timestamp'])
-                        self.transactions.append(transaction)
+                self.products = {}
+                self._transactions = []
+                self._product_index = {}
+                self._order_index = {}
+                self._history_pending = False
+                if self.lazy_history:
+                    # 只讀取產品表，開啟時間與交易歷史長短無關
+                    self.products, self._history_mark = self.storage.load_lazy()
+                    self._history_pending = True
+                else:
+                    # 串流讀取：產品表就地填入，交易記錄逐段轉換為物件，不需先讀入整個檔案
+                    for chunk in self.storage.iter_load(self.products):
+                        for t in chunk:
+                            self._append_transaction(InventoryTransaction.from_dict(t))
                         
                 print(f"已從 {self.database_path} 載入庫存資料")
             except Exception as e:
@@ -95,31 +193,266 @@ class Inventory:
         else:
             print("庫存資料檔案不存在，將創建新的資料庫")
     
+    def load_history(self):
+        """讀取延遲載入的交易歷史，並接上載入後新增的交易"""
+        if not self._history_pending:
+            return
+        recent = self._transactions
+        self._transactions = []
+        self._product_index = {}
+        self._order_index = {}
+        self._history_pending = False
+        for chunk in self.storage.iter_history(self._history_mark):
+            for t in chunk:
+                self._index_transaction(InventoryTransaction.from_dict(t))
+        for transaction in recent:
+            self._index_transaction(transaction)
+        print(f"已載入 {len(self._transactions)} 筆交易歷史")
+
+    def archive_closed_months(self, today=None):
+        """將已結束月份的交易寫入封存區，熱資料只保留本月交易
+
+        封存清單記錄已處理到的月份，同一個月內重複呼叫不會再讀取交易歷史。
+
+        Args:
+            today: 判斷目前月份用的日期，預設為現在
+
+        Returns:
+            封存的交易筆數
+        """
+        if self._batch is not None:
+            logger.warning("批次異動進行中，略過交易封存")
+            return 0
+        current_month = (today or datetime.now()).strftime("%Y-%m")
+        last_closed = previous_month(current_month)
+        archive = self.archive
+        if archive.archived_through is not None and archive.archived_through >= last_closed:
+            return 0
+
+        closed = {}  # 月份 -> 交易物件列表
+        keep = []
+        for transaction in self.transactions:
+            month = transaction.timestamp.strftime("%Y-%m")
+            if month < current_month:
+                closed.setdefault(month, []).append(transaction)
+            else:
+                keep.append(transaction)
+
+        archived = 0
+        leftover = []
+        try:
+            for month, transactions in sorted(closed.items()):
+                if month in archive.manifest['segments']:
+                    # 上次封存後未及重寫熱資料：已在區段中的交易直接移除，其餘留在熱資料
+                    archived_ids = {t['TransactionID'] for t in archive.read_month(month)}
+                    remaining = [t for t in transactions if t.transaction_id not in archived_ids]
+                    if remaining:
+                        logger.warning(f"月份 {month} 已封存，另有 {len(remaining)} 筆交易保留在目前資料中")
+                    leftover.extend(remaining)
+                    archived += len(transactions) - len(remaining)
+                    continue
+                archive.write_month(month, [t.to_dict() for t in transactions])
+                archived += len(transactions)
+
+            if closed:
+                self._transactions = []
+                self._product_index = {}
+                self._order_index = {}
+                for transaction in leftover + keep:
+                    self._index_transaction(transaction)
+                self.storage.rewrite(self.products, self._transactions)
+            archive.mark_archived_through(last_closed)
+        except Exception as e:
+            print(f"封存交易失敗: {str(e)}")
+            return 0
+
+        if archived:
+            print(f"已封存 {archived} 筆交易至 {archive.directory}")
+        return archived
+
+    def get_transactions(self, start=None, end=None, product_name=None):
+        """查詢時間範圍內的交易記錄（封存區只開啟與範圍重疊的月份）
+
+        Args:
+            start: 起始時間 (ISO 字串，含)
+            end: 結束時間 (ISO 字串，不含)
+            product_name: 只查詢此產品
+
+        Returns:
+            交易字典列表，依時間排序
+        """
+        result = list(self.archive.iter_range(start, end, product_name))
+        transactions = self.transactions
+        if product_name is not None:
+            positions = self._product_index.get(product_name, [])
+        else:
+            positions = range(len(transactions))
+        for i in positions:
+            t = transactions[i].to_dict()
+            if start is not None and t['Timestamp'] < start:
+                continue
+            if end is not None and t['Timestamp'] >= end:
+                continue
+            result.append(t)
+        return result
 
-    
     def save_data(self):
-        """將庫存資料保存到檔案"""
+        """將庫存資料完整保存到檔案（日誌模式下同時清空已合併的日誌）"""
         try:
-            data = {
-                'products': self.products,
-                'transactions': [t.to_dict() for t in self.transactions]
-            }
-            with open(self.database_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            self.storage.save(self.products, self.transactions)
             print(f"庫存資料已保存到 {self.database_path}")
             return True
         except Exception as e:
             print(f"保存庫存資料失敗: {str(e)}")
             return False
 
+    def save_products(self, compact=True):
+        """保存產品表（供外部直接修改產品資訊後使用）
+
+        日誌模式只追加一筆產品表紀錄，不重寫交易歷史；JSON 模式則完整保存。
+
+        Args:
+            compact: 日誌累積過多時是否順便合併為快照。由背景寫檔執行緒呼叫時應傳 False，
+                     合併需在修改資料的執行緒進行，快照內容才會與日誌序號一致。
+        """
+        if self._batch is not None:
+            self._batch['products_replaced'] = True
+            return True
+        if not self.storage.supports_append:
+            return self.save_data()
+        try:
+            self.storage.append_products(self.products)
+        except Exception as e:
+            print(f"寫入交易日誌失敗: {str(e)}")
+            return False
+        if compact and self.storage.needs_compaction():
+            return self.save_data()
+        return True
+
+    def _persist(self, name, transaction=None):
+        """持久化單一產品的異動
+
+        日誌模式追加一筆紀錄；JSON 模式則完整保存。批次進行中只登記，等提交時一次保存。
+        """
+        if self._batch is not None:
+            self._batch['changes'].append((name, transaction))
+            return True
+        return self._write_changes([(name, self.products[name], transaction)])
+
+    def _touch(self, name):
+        """批次進行中第一次修改產品前保存其原值，回復時只需還原被修改的產品
+
+        產品表在批次中被整個替換後，原本的產品表不再被修改，不必再保存。
+        """
+        batch = self._batch
+        if batch is None or self.products is not batch['products_ref'] or name in batch['originals']:
+            return
+        product = self.products.get(name)
+        batch['originals'][name] = dict(product) if product is not None else None  # None 表示批次中新增
+
+    def _write_changes(self, changes, products_replaced=False):
+        """將異動寫入儲存"""
+        if not self.storage.supports_append:
+            return self.save_data()
+        try:
+            if products_replaced:
+                self.storage.append_products(self.products)
+            self.storage.append(changes)
+        except Exception as e:
+            print(f"寫入交易日誌失敗: {str(e)}")
+            return False
+        if self.storage.needs_compaction():
+            return self.save_data()
+        return True
+
+    @contextmanager
+    def batch(self):
+        """批次異動：區塊內的異動延後到結束時一次保存，庫存警報也在提交時才檢查
+
+        區塊內發生例外時，產品表與交易記錄會回復到進入批次前的狀態。巢狀使用時併入最外層批次。
+        產品在批次中第一次被修改時才保存原值（見 _touch），開啟批次的成本與產品數無關。
+
+        用法:
+            with inventory.batch():
+                for name, qty in rows:
+                    inventory.add_product(name, initial_quantity=qty)
+        """
+        if self._batch is not None:
+            yield self
+            return
+
+        self._batch = {
+            'originals': {},  # 產品名稱 -> 批次中第一次修改前的產品資訊（None 表示原本不存在）
+            'products_ref': self.products,  # 用於判斷批次中產品表是否被整個替換
+            'transaction_count': self._transaction_count,
+            'changes': [],  # (產品名稱, 交易物件或None)
+            'alert_checks': {},  # 產品名稱 -> 待檢查的警報種類
+            'products_replaced': False
+        }
+        try:
+            yield self
+        except Exception:
+            batch, self._batch = self._batch, None
+            replaced = self.products is not batch['products_ref']
+            self.products = batch['products_ref']
+            for name, original in batch['originals'].items():
+                if original is None:
+                    self.products.pop(name, None)
+                else:
+                    self.products[name] = original
+            while self._transaction_count > batch['transaction_count']:
+                self._pop_transaction()
+            # 保留量帳不隨批次回復；產品表被替換過時，原表的尚可分配量可能未跟上保留量的變動
+            for name in (self.products if replaced else batch['originals']):
+                self._refresh_available(name)
+            print(f"批次異動失敗，已回復 {len(batch['changes'])} 筆異動")
+            raise
+
+        batch, self._batch = self._batch, None
+        for name, checks in batch['alert_checks'].items():
+            if name in self.products:
+                for check in checks:
+                    check(name)
+        if self.products is not batch['products_ref']:
+            batch['products_replaced'] = True
+        if not batch['changes'] and not batch['products_replaced']:
+            return
+        changes = [(name, self.products[name], transaction)
+                   for name, transaction in batch['changes'] if name in self.products]
+        self._write_changes(changes, batch['products_replaced'])
+        print(f"批次異動已提交，共 {len(batch['changes'])} 筆")
+
+    def _check_alert(self, name, check):
+        """檢查庫存警報；批次進行中時延後到提交"""
+        if self._batch is not None:
+            checks = self._batch['alert_checks'].setdefault(name, [])
+            if check not in checks:
+                checks.append(check)
+            return
+        check(name)
+
+    def _check_max_stock(self, name):
+        """檢查是否超過最大庫存量"""
+        if self.products[name].get('max_stock') is not None and self.products[name]['quantity'] > self.products[name]['max_stock']:
+            alert_msg = f"'{name}' 已超過最大庫存量 ({self.products[name]['max_stock']})"
+            self.add_alert(name, "庫存過高", alert_msg)
+
+    def _check_reorder_point(self, name):
+        """檢查是否低於再訂購點"""
+        if self.products[name].get('reorder_point') is not None and self.products[name]['quantity'] <= self.products[name]['reorder_point']:
+            alert_msg = f"'{name}' 庫存量 ({self.products[name]['quantity']}) 已低於再訂購點 ({self.products[name]['reorder_point']})"
+            self.add_alert(name, "庫存過低", alert_msg)
+
     def add_product(self, product_name, initial_quantity=0, reorder_point=None, max_stock=None):
         """新增產品到庫存"""
         if product_name in self.products:
             print(f"產品 '{product_name}' 已經存在於庫存中")
             return False
             
+        self._touch(product_name)
         self.products[product_name] = {
             'quantity': initial_quantity,
+            'allocatable': initial_quantity - self._reserved.get(product_name, 0),
             'reorder_point': reorder_point,
             'max_stock': max_stock,
             'last_stock_update': datetime.now().isoformat(),
@@ -127,7 +460,7 @@ class Inventory:
         }
         
         # 保存資料
-        self.save_data()
+        self._persist(product_name)
         print(f"產品 '{product_name}' 已新增到庫存，初始數量: {initial_quantity}")
         return True
 
@@ -155,12 +488,49 @@ class Inventory:
             return None
 
     def get_product_history(self, product_name):
-        """獲取產品的歷史記錄"""
-        history = []
-        for transaction in self.transactions:
-            if transaction.product_name == product_name:
-                history.append(transaction.to_dict())
-        return history
+        """獲取產品的歷史記錄（封存區只開啟含此產品的月份，目前資料依產品索引直接取出）"""
+        return self.get_transactions(product_name=product_name)
+
+    def get_order_history(self, order_id):
+        """獲取某訂單編號的所有庫存異動（封存區沒有訂單索引，需逐月讀取）"""
+        history = [t for t in self.archive.iter_range() if t['OrderID'] == order_id]
+        transactions = self.transactions  # 延遲載入模式下先讀取歷史，索引才完整
+        return history + [transactions[i].to_dict() for i in self._order_index.get(order_id, [])]
+
+    def get_product_quantity(self, name):
+        """獲取產品目前庫存量，產品不存在時回傳 None"""
+        if name not in self.products:
+            return None
+        return self.products[name]['quantity']
+
+    def _append_transaction(self, transaction):
+        """新增交易記錄並更新產品與訂單索引"""
+        self._transaction_count += 1
+        self._index_transaction(transaction)
+        for listener in self.transaction_listeners:
+            listener(transaction)
+
+    def _index_transaction(self, transaction):
+        """將交易加入列表與索引"""
+        position = len(self._transactions)
+        self._transactions.append(transaction)
+        self._product_index.setdefault(transaction.product_name, []).append(position)
+        if transaction.order_id is not None:
+            self._order_index.setdefault(transaction.order_id, []).append(position)
+
+    def _pop_transaction(self):
+        """移除最後一筆交易記錄並更新索引（批次回復用）"""
+        self._transaction_count -= 1
+        transaction = self._transactions.pop()
+        for index, key in ((self._product_index, transaction.product_name),
+                           (self._order_index, transaction.order_id)):
+            positions = index.get(key)
+            if positions:
+                positions.pop()
+                if not positions:
+                    del index[key]
+        for listener in self.transaction_listeners:
+            listener(transaction)
 
     def stock_in(self, name, quantity, order_id=None, notes=""):
         """產品入庫"""
@@ -168,23 +538,32 @@ class Inventory:
             logger.warning(f"產品 '{name}' 不存在於庫存中，將自動新增")
             self.add_product(name)
             
+        self._touch(name)
         self.products[name]['quantity'] += quantity
         self.products[name]['last_stock_update'] = datetime.now().isoformat()
+        self._refresh_available(name)
         
         # 記錄交易
         transaction = InventoryTransaction(name, 'in', quantity, order_id, notes)
-        self.transactions.append(transaction)
+        self._append_transaction(transaction)
         
         # 檢查是否超過最大庫存量
-        if self.products[name].get('max_stock') is not None and self.products[name]['quantity'] > self.products[name]['max_stock']:
-            alert_msg = f"'{name}' 已超過最大庫存量 ({self.products[name]['max_stock']})"
-            self.add_alert(name, "庫存過高", alert_msg)
+        self._check_alert(name, self._check_max_stock)
         
         # 保存資料
-        self.save_data()
+        self._persist(name, transaction)
         logger.info(f"'{name}' 入庫 {quantity} 個。目前庫存：{self.products[name]['quantity']}")
         return True
 
+    def receive_stock(self, name, quantity, order_id=None, notes=""):
+        """入庫後通知 stock_listeners（生產或進貨等可供分配的入庫使用；尚可分配量隨庫存量增加）"""
+        with self.batch():  # 庫存量與自動分配的結果一起保存
+            if not self.stock_in(name, quantity, order_id, notes):
+                return False
+            for listener in self.stock_listeners:
+                listener(name, quantity)
+        return True
+
     def stock_out(self, name, quantity, order_id=None, notes=""):
         """產品出庫"""
         if name not in self.products:
@@ -192,20 +571,20 @@ class Inventory:
             return False
             
         if self.products[name]['quantity'] >= quantity:
+            self._touch(name)
             self.products[name]['quantity'] -= quantity
             self.products[name]['last_stock_update'] = datetime.now().isoformat()
+            self._refresh_available(name)
             
             # 記錄交易
             transaction = InventoryTransaction(name, 'out', quantity, order_id, notes)
-            self.transactions.append(transaction)
+            self._append_transaction(transaction)
             
             # 檢查是否低於再訂購點
-            if self.products[name].get('reorder_point') is not None and self.products[name]['quantity'] <= self.products[name]['reorder_point']:
-                alert_msg = f"'{name}' 庫存量 ({self.products[name]['quantity']}) 已低於再訂購點 ({self.products[name]['reorder_point']})"
-                self.add_alert(name, "庫存過低", alert_msg)
+            self._check_alert(name, self._check_reorder_point)
             
             # 保存資料
-            self.save_data()
+            self._persist(name, transaction)
             logger.info(f"'{name}' 出庫 {quantity} 個。目前庫存：{self.products[name]['quantity']}")
             return True
         else:
@@ -222,15 +601,17 @@ class Inventory:
         old_quantity = self.products[name]['quantity']
         adjustment = new_quantity - old_quantity
         
+        self._touch(name)
         self.products[name]['quantity'] = new_quantity
         self.products[name]['last_stock_update'] = datetime.now().isoformat()
+        self._refresh_available(name)
         
         # 記錄交易
         transaction = InventoryTransaction(name, 'adjust', adjustment, None, notes)
-        self.transactions.append(transaction)
+        self._append_transaction(transaction)
         
         # 保存資料
-        self.save_data()
+        self._persist(name, transaction)
         logger.info(f"'{name}' 庫存已調整，從 {old_quantity} 到 {new_quantity}")
         return True
 
@@ -241,9 +622,10 @@ class Inventory:
             logger.warning(f"產品 '{name}' 不存在於庫存中")
             return False
             
+        self._touch(name)
         self.products[name]['reorder_point'] = reorder_point
         # 保存資料
-        self.save_data()
+        self._persist(name)
         logger.info(f"'{name}' 的再訂購點已設定為 {reorder_point}")
         return True
 
@@ -253,9 +635,10 @@ class Inventory:
             logger.warning(f"產品 '{name}' 不存在於庫存中")
             return False
             
+        self._touch(name)
         self.products[name]['max_stock'] = max_stock
         # 保存資料
-        self.save_data()
+        self._persist(name)
         logger.info(f"'{name}' 的最大庫存量已設定為 {max_stock}")
         return True
 
@@ -264,10 +647,113 @@ class Inventory:
         """檢查所有產品的庫存狀態"""
         return self.products
 
+    # ==================== 保留量帳 ====================
+
+    def reserve(self, order_key, product_name, quantity):
+        """設定訂單對產品的保留量，取代該訂單原有的保留；數量為 0 時解除保留
+
+        只更新保留量帳與產品的保留合計，成本為 O(1)，不寫入儲存（保留量可由訂單重算）。
+
+        Args:
+            order_key: 訂單唯一識別碼 (訂單編號-序號)
+            product_name: 產品名稱
+            quantity: 保留數量（累計值，非增量）
+        """
+        self.release(order_key)
+        if quantity > 0:
+            self.reservations[order_key] = (product_name, quantity)
+            self._reserved[product_name] = self._reserved.get(product_name, 0) + quantity
+            self._refresh_available(product_name)
+
+    def release(self, order_key):
+        """解除訂單的保留量（出貨、取消或訂單被移除時）"""
+        reservation = self.reservations.pop(order_key, None)
+        if reservation is None:
+            return
+        product_name, quantity = reservation
+        remaining = self._reserved.get(product_name, 0) - quantity
+        if remaining:
+            self._reserved[product_name] = remaining
+        else:
+            self._reserved.pop(product_name, None)
+        self._refresh_available(product_name)
+
+    def get_reserved_quantity(self, name):
+        """產品目前被訂單保留的數量"""
+        return self._reserved.get(name, 0)
+
+    def get_available_quantity(self, name):
+        """尚可分配量 = 現有庫存量 - 保留量（負值表示保留超過庫存），產品不存在時回傳 0"""
+        product = self.products.get(name)
+        if product is None:
+            return 0
+        return product['quantity'] - self._reserved.get(name, 0)
+
+    def _refresh_available(self, name):
+        """更新產品表中的尚可分配量欄位（只供顯示與存檔，計算一律以保留量帳為準）"""
+        product = self.products.get(name)
+        if product is not None:
+            product['allocatable'] = product['quantity'] - self._reserved.get(name, 0)
+
+    def reconcile_reservations(self, order_keys, product_names, quantities):
+        """依訂單重算所有產品的保留量並取代保留量帳
+
+        訂單以產品代碼 (pd.factorize) 搭配 np.bincount 一次彙總，與目前帳上的保留合計及
+        產品表記錄的尚可分配量比對後回報差異，最後依重算結果更新產品表的尚可分配量。
+
+        Args:
+            order_keys: 訂單key 序列
+            product_names: 各訂單的產品名稱
+            quantities: 各訂單應保留的數量，0 表示不保留
+
+        Returns:
+            DataFrame，只列出有差異的產品，欄位為 品名、帳上保留量、應保留量、記錄尚可分配量、尚可分配量
+        """
+        product_names = np.asarray(product_names, dtype=object)
+        quantities = np.asarray(quantities)
+        if quantities.dtype.kind not in 'iu':
+            quantities = np.nan_to_num(quantities.astype(float))
+
+        # 產品代碼：庫存中的產品在前，只出現在訂單中的產品接在後面
+        stock_names = list(self.products)
+        codes, names = pd.factorize(pd.Index(stock_names + list(product_names)))
+        size = len(names)
+        expected = np.bincount(codes[len(stock_names):], weights=quantities, minlength=size)
+        if quantities.dtype.kind in 'iu':
+            expected = expected.astype(np.int64)
+        ledger = np.array([self._reserved.get(name, 0) for name in names], dtype=float)
+        on_hand = np.zeros(size)
+        recorded = np.full(size, np.nan)
+        on_hand[:len(stock_names)] = [info.get('quantity', 0) for info in self.products.values()]
+        recorded[:len(stock_names)] = [info.get('allocatable', np.nan) if info.get('allocatable') is not None
+                                       else np.nan for info in self.products.values()]
+        available = on_hand - expected
+        drifted = (ledger != expected) | (~np.isnan(recorded) & (recorded != available))
+
+        # 以重算結果取代保留量帳
+        held = np.flatnonzero(quantities > 0)
+        keys = np.asarray(order_keys, dtype=object)
+        self.reservations = dict(zip(keys[held].tolist(),
+                                     zip(product_names[held].tolist(), quantities[held].tolist())))
+        self._reserved = {name: total for name, total in zip(names, expected.tolist()) if total}
+        for name in stock_names:
+            self._refresh_available(name)
+
+        return pd.DataFrame({
+            '品名': names[drifted],
+            '帳上保留量': ledger[drifted],
+            '應保留量': expected[drifted],
+            '記錄尚可分配量': recorded[drifted],
+            '尚可分配量': np.where(np.arange(size) < len(stock_names), available, np.nan)[drifted]
+        })
+
 
 # ==================== Order ====================
 class Order:
     """訂單類別，用於儲存和管理訂單資訊"""
+
+    # 由 ProductionManager 建立索引的欄位；訂單加入管理後修改這些欄位會自動通知索引更新
+    INDEXED_FIELDS = frozenset(['trans_id', 'status', 'cust_name', 'prod_name', 'date'])
     
     def __init__(self, trans_type: str, trans_id: str, seq_id: str,
                  prod_id: str, prod_name: str, quantity: int, price: float,
@@ -315,6 +801,16 @@ class Order:
         self.shipping_date = None
         self.produced_quantity = 0  # 已生產數量
         
+    def __setattr__(self, name, value):
+        listener = self.__dict__.get('_index_listener')
+        if listener is None or name not in self.INDEXED_FIELDS:
+            object.__setattr__(self, name, value)
+            return
+        old_value = self.__dict__.get(name, '')
+        object.__setattr__(self, name, value)
+        if old_value != value:
+            listener(self, name, old_value, value)
+
     @property
     def amount(self) -> float:
         """計算訂單金額"""
@@ -355,14 +851,126 @@ class Order:
 class ProductionManager:
     """生產管理類別"""
     
-    def __init__(self, inventory_system=None):
+    def __init__(self, inventory_system=None, columnar=False, event_log=None):
         """初始化生產管理系統
         
         Args:
             inventory_system: 庫存管理系統的實例，如果為None則創建新的
+            columnar: 是否以欄位式訂單表 (OrderTable) 保存訂單；此時 orders 中的值為 OrderRow 檢視，
+                      加入後應修改 orders 中的檢視，而非原本傳入的 Order 物件
+            event_log: 訂單事件日誌 (OrderEventLog)，狀態轉換會寫入其中
         """
-        self.orders = {}  # 訂單清單，以 "訂單編號-序號" 為鍵
+        self.order_table = OrderTable(Order, Order.INDEXED_FIELDS) if columnar else None
+        self.event_log = event_log
+        self.orders_dirty = False  # 訂單加入或替換後尚未寫入快照（狀態轉換只寫事件日誌，不算在內）
+        self._indexes = {}  # 欄位 -> 欄位值 -> {訂單key: None}（保持插入順序的集合）
+        self._order_seq = {}  # 訂單key -> 加入順序，篩選結果依此排序
+        self._backorders = {}  # 產品名稱 -> 待分配訂單堆積 [(分配排序鍵, 訂單key)]
+        self._backorder_keys = set()  # 已在堆積中的 (產品名稱, 訂單key)
+        self.order_listeners = []  # 訂單加入、移除、狀態轉換或欄位變更時呼叫 listener(產品名稱)
         self.inventory = inventory_system if inventory_system else Inventory()  # 庫存管理
+        self.orders = {}  # 訂單清單，以 "訂單編號-序號" 為鍵
+
+    @property
+    def orders(self):
+        """訂單清單，以 "訂單編號-序號" 為鍵（新增請用 add_order，索引才會同步）"""
+        return self._orders
+
+    @orders.setter
+    def orders(self, orders):
+        """整批替換訂單清單並重建索引與保留量帳"""
+        for order in getattr(self, '_orders', {}).values():
+            order.__dict__.pop('_index_listener', None)
+        if self.order_table is not None:
+            self.order_table = OrderTable(Order, Order.INDEXED_FIELDS)
+            orders = {order_key: self._store(order) for order_key, order in orders.items()}
+        self._orders = orders
+        self.orders_dirty = True
+        for listener in self.order_listeners:
+            listener(None)
+        self._indexes = {field: {} for field in Order.INDEXED_FIELDS}
+        self._order_seq = {}
+        self._backorders = {}
+        self._backorder_keys = set()
+        for order_key, order in orders.items():
+            self._index_order(order_key, order)
+        self.reconcile_reservations()
+
+    def _store(self, order):
+        """欄位式模式下將訂單寫入訂單表並回傳列檢視，否則直接回傳訂單物件"""
+        if self.order_table is None or isinstance(order, OrderRow) and order._table is self.order_table:
+            return order
+        return self.order_table.append(order)
+
+    # ==================== 訂單索引 ====================
+
+    def _index_order(self, order_key, order):
+        """將訂單加入各欄位索引，並掛上欄位變更通知"""
+        self._order_seq[order_key] = len(self._order_seq)
+        for field, index in self._indexes.items():
+            index.setdefault(getattr(order, field, ''), {})[order_key] = None
+        order.__dict__['_indexed_key'] = order_key
+        order._index_listener = self._on_order_changed
+        self._push_backorder(order_key, order)
+        for listener in self.order_listeners:
+            listener(order.prod_name)
+
+    def _unindex_order(self, order_key, order):
+        """將訂單自各欄位索引移除"""
+        order.__dict__.pop('_index_listener', None)
+        order.__dict__.pop('_indexed_key', None)
+        self._order_seq.pop(order_key, None)
+        self.inventory.release(order_key)
+        for field, index in self._indexes.items():
+            self._discard(index, getattr(order, field, ''), order_key)
+        if isinstance(order, OrderRow) and order._table is self.order_table:
+            self.order_table.discard(order._row)
+        for listener in self.order_listeners:
+            listener(order.prod_name)
+
+    @staticmethod
+    def _discard(index, value, order_key):
+        keys = index.get(value)
+        if keys is not None:
+            keys.pop(order_key, None)
+            if not keys:
+                del index[value]
+
+    def _on_order_changed(self, order, field, old_value, new_value):
+        """訂單索引欄位被修改時，將訂單移到新值的索引位置"""
+        order_key = order.__dict__.get('_indexed_key')
+        if self._orders.get(order_key) is not order:
+            return
+        index = self._indexes[field]
+        self._discard(index, old_value, order_key)
+        index.setdefault(new_value, {})[order_key] = None
+        if field in ('status', 'prod_name'):
+            self._push_backorder(order_key, order)
+        for listener in self.order_listeners:
+            listener(order.prod_name)
+            if field == 'prod_name':
+                listener(old_value)
+
+    def find_orders(self, **criteria):
+        """依索引欄位篩選訂單，成本與符合的筆數成正比
+
+        Args:
+            criteria: 欄位=值，可用欄位為 trans_id、status、cust_name、prod_name、date
+
+        Returns:
+            符合所有條件的訂單列表，依加入順序排列
+        """
+        if not criteria:
+            return list(self._orders.values())
+        candidates = [self._indexes[field].get(value, {}) for field, value in criteria.items()]
+        smallest = min(candidates, key=len)
+        keys = [key for key in smallest if all(key in keys for keys in candidates)]
+        keys.sort(key=self._order_seq.__getitem__)
+        return [self._orders[key] for key in keys]
+
+    def get_index_values(self, field):
+        """取得索引欄位目前出現的所有值（例如全部客戶名稱）"""
+        return list(self._indexes[field])
     
     def add_order(self, order, preserve_status=False):
         """新增訂單
@@ -372,17 +980,22 @@ class ProductionManager:
             preserve_status: 是否保留原有狀態，True時不會強制設為「新訂單」
         """
         # 使用 訂單編號-序號 作為唯一識別 key
+        order = self._store(order)
         order_key = order.order_key
         
         # 檢查是否已存在相同的訂單key
         if order_key in self.orders:
             print(f"警告：訂單 {order_key} 已存在，將被覆蓋")
+            self._unindex_order(order_key, self.orders[order_key])
         
         self.orders[order_key] = order
+        self._index_order(order_key, order)
+        self.orders_dirty = True
         
         # 只有在不保留狀態時才設為新訂單
         if not preserve_status:
             order.status = "新訂單"
+        self._sync_reservation(order_key, order)
         
         # 確保產品存在於庫存系統中
         if order.prod_name not in self.inventory.products:
@@ -391,21 +1004,194 @@ class ProductionManager:
         print(f"已新增訂單 {order_key}，產品：{order.prod_name}，數量：{order.quantity}，狀態：{order.status}")
         return order_key
     
+    def add_orders(self, orders, preserve_status=False, reconcile=True):
+        """批次新增訂單：一次走訪完成驗證、去除重複與索引，缺少的產品在同一批次中新增並只保存一次
+
+        Args:
+            orders: 訂單物件的可迭代物件（可為產生器，邊讀取邊加入）
+            preserve_status: 是否保留原有狀態，True時不會強制設為「新訂單」
+            reconcile: 是否在結束時重算保留量帳；分段匯入時可傳 False，全部加入後再呼叫 reconcile_reservations
+
+        Returns:
+            統計字典 {'added': 新增筆數, 'overwritten': 覆蓋既有訂單筆數, 'skipped': 無效或重複而略過的筆數}
+        """
+        summary = {'added': 0, 'overwritten': 0, 'skipped': 0}
+        seen = set()
+        missing_products = {}  # 保持順序的集合
+        for order in orders:
+            # 單號與品名為必要欄位，數量必須是數字
+            if not order.trans_id or not order.prod_name or not isinstance(order.quantity, numbers.Number):
+                summary['skipped'] += 1
+                continue
+            order_key = order.order_key
+            if order_key in seen:
+                print(f"警告：發現重複的訂單 {order_key}，跳過")
+                summary['skipped'] += 1
+                continue
+            seen.add(order_key)
+
+            if order_key in self._orders:
+                self._unindex_order(order_key, self._orders[order_key])
+                summary['overwritten'] += 1
+            else:
+                summary['added'] += 1
+            order = self._store(order)
+            if not preserve_status:
+                order.status = "新訂單"
+            self._orders[order_key] = order
+            self._index_order(order_key, order)
+            self.orders_dirty = True
+
+            if order.prod_name not in self.inventory.products:
+                missing_products[order.prod_name] = None
+
+        # 確保產品存在於庫存系統中，批次結束時只保存一次
+        if missing_products:
+            with self.inventory.batch():
+                for product_name in missing_products:
+                    self.inventory.add_product(product_name, initial_quantity=0)
+        if reconcile:
+            self.reconcile_reservations()  # 保留量一次重算，不逐筆更新
+
+        print(f"批次新增訂單：新增 {summary['added']} 筆，覆蓋 {summary['overwritten']} 筆，略過 {summary['skipped']} 筆")
+        return summary
+
+    # Order 建構參數對應的欄位（依參數順序）
+    ORDER_INIT_FIELDS = ('trans_type', 'trans_id', 'seq_id', 'prod_id', 'prod_name', 'quantity', 'price',
+                         'cust_id', 'cust_name', 'facto_id', 'facto_name')
+
+    def add_order_frame(self, frame, preserve_status=True, reconcile=True):
+        """由已整理的訂單 DataFrame 批次新增訂單（例如 order_import.normalize_order_frame 的結果）
+
+        欄位名稱即訂單屬性名稱，建構參數以外的欄位（日期、狀態、已分配量等）設為訂單屬性。
+        以 itertuples 逐列取值，不經過 iterrows 的逐列 Series 建立。
+
+        Args:
+            frame: 訂單 DataFrame，至少包含 ORDER_INIT_FIELDS
+            preserve_status: 是否保留 status 欄位的狀態
+            reconcile: 是否在結束時重算保留量帳（見 add_orders）
+
+        Returns:
+            統計字典（見 add_orders）
+        """
+        extra_fields = [field for field in frame.columns if field not in self.ORDER_INIT_FIELDS]
+        init_count = len(self.ORDER_INIT_FIELDS)
+
+        def build_orders():
+            for values in frame[list(self.ORDER_INIT_FIELDS) + extra_fields].itertuples(index=False, name=None):
+                order = Order(*values[:init_count])
+                for field, value in zip(extra_fields, values[init_count:]):
+                    setattr(order, field, value)
+                yield order
+
+        return self.add_orders(build_orders(), preserve_status, reconcile)
+
+    # ==================== 合併匯入 ====================
+
+    # 由本系統維護的生命週期欄位：合併匯入時只在新增訂單時採用來源的值，既有訂單保留本地狀態
+    LIFECYCLE_FIELDS = ('status', 'allocated_quantity', 'produced_quantity')
+
+    def _order_field_frame(self, order_keys, fields):
+        """取得指定訂單的欄位值 DataFrame（欄位式訂單表直接取欄位陣列）"""
+        if self.order_table is not None:
+            rows = np.fromiter((self._orders[key]._row for key in order_keys), dtype=np.int64, count=len(order_keys))
+            return pd.DataFrame({field: self.order_table.column(field)[rows] for field in fields})
+        orders = [self._orders[key] for key in order_keys]
+        return pd.DataFrame({field: [getattr(order, field, None) for order in orders] for field in fields})
+
+    @staticmethod
+    def _row_hashes(frame):
+        """每列內容的雜湊；數值與文字一律以字串比較，來源檔與記憶體中的型別不同也能對應"""
+        return pd.util.hash_pandas_object(frame.astype(str), index=False).to_numpy()
+
+    def merge_order_frame(self, frame, reconcile=True, undo=None):
+        """合併匯入：以訂單key 比對來源與目前訂單，只套用新增與內容有變更的訂單
+
+        每列以雜湊比較來源欄位（不含 LIFECYCLE_FIELDS），內容相同的訂單完全不動，
+        本地的狀態、已分配量與已生產數量因此不會被匯入覆蓋。來源中沒有的訂單不在此處理，
+        需要刪除時另外呼叫 remove_orders。
+
+        Args:
+            frame: 整理後的訂單 DataFrame（見 add_order_frame），訂單key 不可重複
+            reconcile: 是否在結束時重算保留量帳（見 add_orders）
+            undo: 若提供列表，修改既有訂單前會加入 (訂單, 欄位, 原值)，供取消匯入時回復
+
+        Returns:
+            (summary, report)：summary 為 {'inserted', 'updated', 'unchanged'} 筆數；
+            report 為異動明細 DataFrame，欄位為 訂單key、異動、變更欄位
+        """
+        order_keys = (frame['trans_id'] + "-" + frame['seq_id']).to_numpy()
+        exists = np.fromiter((key in self._orders for key in order_keys), dtype=bool, count=len(order_keys))
+        fields = [field for field in frame.columns if field not in self.LIFECYCLE_FIELDS]
+
+        # 既有訂單：以雜湊找出內容有變更的列，再找出變更的欄位
+        existing_keys = order_keys[exists].tolist()
+        incoming = frame.loc[exists, fields].reset_index(drop=True)
+        current = self._order_field_frame(existing_keys, fields)
+        changed = self._row_hashes(incoming) != self._row_hashes(current)
+        differences = incoming[changed].astype(str).to_numpy() != current[changed].astype(str).to_numpy()
+
+        report = []
+        changed_products = {}  # 有欄位被更新的產品（保持順序的集合）
+        for order_key, values, different in zip(np.asarray(existing_keys, dtype=object)[changed],
+                                                incoming[changed].itertuples(index=False, name=None), differences):
+            order = self._orders[order_key]
+            changed_fields = [field for field, is_different in zip(fields, different) if is_different]
+            for field, value, is_different in zip(fields, values, different):
+                if is_different:
+                    if undo is not None:
+                        undo.append((order, field, getattr(order, field)))
+                    setattr(order, field, value)
+            report.append((order_key, "更新", "、".join(changed_fields)))
+            changed_products[order.prod_name] = None
+        if report:
+            self.orders_dirty = True
+        # 數量、單價等非索引欄位以 setattr 修改時不會觸發索引通知，更新完後逐一通知產品
+        for product_name in changed_products:
+            for listener in self.order_listeners:
+                listener(product_name)
+
+        # 新增訂單：採用來源的全部欄位（包含狀態）
+        inserted = frame[~exists]
+        if len(inserted):
+            self.add_order_frame(inserted, preserve_status=True, reconcile=False)
+            report.extend((order_key, "新增", "") for order_key in order_keys[~exists])
+        if reconcile:
+            self.reconcile_reservations()
+
+        summary = {'inserted': int((~exists).sum()), 'updated': int(changed.sum()),
+                   'unchanged': int(len(changed) - changed.sum())}
+        print(f"合併匯入：新增 {summary['inserted']} 筆，更新 {summary['updated']} 筆，未變更 {summary['unchanged']} 筆")
+        return summary, pd.DataFrame(report, columns=['訂單key', '異動', '變更欄位'])
+
+    def remove_orders(self, order_keys):
+        """移除訂單（例如合併匯入時刪除來源已沒有的訂單），保留量隨之解除
+
+        Returns:
+            實際移除的筆數
+        """
+        removed = 0
+        for order_key in order_keys:
+            order = self._orders.pop(order_key, None)
+            if order is None:
+                continue
+            self._unindex_order(order_key, order)
+            removed += 1
+        if removed:
+            self.orders_dirty = True
+            print(f"已移除 {removed} 筆訂單")
+        return removed
+    
     def get_order_by_trans_id(self, trans_id):
-        """根據訂單編號獲取該訂單的所有序號項目"""
-        matching_orders = []
-        for order_key, order in self.orders.items():
-            if order.trans_id == trans_id:
-                matching_orders.append(order)
-        return matching_orders
+        """根據訂單編號獲取該訂單的所有序號項目（走單號索引）"""
+        return self.find_orders(trans_id=trans_id)
     
     def start_production(self, order_key):
         """開始生產訂單"""
         if order_key in self.orders:
             order = self.orders[order_key]
             if order.status == "新訂單":
-                order.status = "生產中"
-                order.production_date = datetime.now()
+                self.transition(order_key, "生產中", order.produced_quantity)
                 print(f"訂單 {order_key} 開始生產，產品：{order.prod_name}，數量：{order.quantity}")
                 return True
             else:
@@ -426,13 +1212,6 @@ class ProductionManager:
             print(f"訂單 {order_key} 狀態為 {order.status}，無法生產")
             return False
         
-        # 更新訂單狀態為生產中
-        if order.status == "新訂單":
-            order.status = "生產中"
-            # 如果沒有設定生產日期，則設定為當前時間
-            if not hasattr(order, 'production_date') or not order.production_date:
-                order.production_date = datetime.now()
-        
         # 計算實際生產數量
         remaining = order.quantity - order.produced_quantity
         actual_quantity = min(quantity, remaining)
@@ -441,20 +1220,19 @@ class ProductionManager:
             print(f"訂單 {order_key} 已經生產完成")
             return False
         
-        # 更新生產數量
-        order.produced_quantity += actual_quantity
+        # 更新訂單狀態為生產中（同時記錄生產日期）
+        if order.status == "新訂單":
+            self.transition(order_key, "生產中", order.produced_quantity)
+        
+        # 更新生產數量，生產完成時轉為待出貨（同時記錄生產完成日期）
+        produced_quantity = order.produced_quantity + actual_quantity
+        self.transition(order_key, "待出貨" if produced_quantity >= order.quantity else "生產中", produced_quantity)
         
         # 將生產的產品入庫
         self.inventory.stock_in(order.prod_name, actual_quantity, f"PROD-{order_key}")
         
         print(f"訂單 {order_key} 生產了 {actual_quantity} 個 {order.prod_name}，總共已生產 {order.produced_quantity} 個，剩餘 {order.quantity - order.produced_quantity} 個")
-        
-        # 檢查是否生產完成
-        if order.produced_quantity >= order.quantity:
-            order.status = "待出貨"
-            # 設定生產完成日期
-            if not hasattr(order, 'production_complete_date') or not order.production_complete_date:
-                order.production_complete_date = datetime.now()
+        if order.status == "待出貨":
             print(f"訂單 {order_key} 生產完成，狀態更新為 {order.status}")
         
         return True
@@ -470,10 +1248,10 @@ class ProductionManager:
             print(f"訂單 {order_key} 狀態為 {order.status}，無法出貨")
             return False
         
-        # 檢查庫存是否足夠
-        inventory_info = self.inventory.get_product_info(order.prod_name)
-        if not inventory_info or inventory_info["quantity"] < order.quantity:
-            print(f"庫存不足，無法出貨。訂單需求: {order.quantity}，庫存: {inventory_info['quantity'] if inventory_info else 0}")
+        # 檢查庫存是否足夠（只需目前數量，不必重建歷史記錄）
+        stock_quantity = self.inventory.get_product_quantity(order.prod_name)
+        if stock_quantity is None or stock_quantity < order.quantity:
+            print(f"庫存不足，無法出貨。訂單需求: {order.quantity}，庫存: {stock_quantity or 0}")
             return False
         
         # 從庫存中扣除產品
@@ -482,15 +1260,190 @@ class ProductionManager:
             print(f"出貨失敗，無法從庫存中扣除產品")
             return False
         
-        # 更新訂單狀態
-        order.status = "已出貨"
-        # 設定出貨日期
-        if not hasattr(order, 'shipping_date') or not order.shipping_date:
-            order.shipping_date = datetime.now()
+        # 更新訂單狀態（同時記錄出貨日期）
+        self.transition(order_key, "已出貨", order.quantity)
         
         print(f"訂單 {order_key} 已出貨 {order.quantity} 個 {order.prod_name}")
         return True
     
+    # ==================== 訂單狀態轉換 ====================
+
+    def transition(self, order_key, to_status, quantity=0):
+        """轉換訂單狀態：依狀態機檢查是否合法，更新訂單並寫入事件日誌
+
+        Args:
+            order_key: 訂單唯一識別碼 (訂單編號-序號)
+            to_status: 新狀態
+            quantity: 到達新狀態後的累計數量（分配狀態為已分配量、生產狀態為已生產數量、
+                      已出貨為出貨數量，其他狀態為 0）
+
+        Returns:
+            是否成功轉換
+        """
+        order = self._orders.get(order_key)
+        if order is None:
+            print(f"訂單 {order_key} 不存在")
+            return False
+        from_status = order.status
+        if not can_transition(from_status, to_status):
+            print(f"訂單 {order_key} 狀態為 {from_status}，不能轉換為 {to_status}")
+            return False
+        if self.event_log is not None:
+            timestamp = self.event_log.append(order_key, from_status, to_status, quantity)['ts']
+        else:
+            timestamp = datetime.now().isoformat()
+        apply_event(order, to_status, quantity, timestamp)
+        self._sync_reservation(order_key, order)
+        # 已分配量、已生產數量不是索引欄位，修改時不會經過 _on_order_changed，在此通知
+        for listener in self.order_listeners:
+            listener(order.prod_name)
+        return True
+
+    def replay_events(self, after_seq=0):
+        """以事件日誌中快照之後的事件還原訂單狀態
+
+        Args:
+            after_seq: 訂單快照已包含的最後事件序號
+
+        Returns:
+            套用的事件數
+        """
+        if self.event_log is None:
+            return 0
+        applied = self.event_log.replay(self._orders, after_seq)
+        if applied:
+            print(f"已重播 {applied} 筆訂單事件")
+            self.reconcile_reservations()
+            for listener in self.order_listeners:
+                listener(None)
+        return applied
+
+    # ==================== 保留量 ====================
+
+    def _reservation_quantity(self, order):
+        """訂單應保留的庫存：已分配的訂單保留已分配量，生產中與待出貨的訂單保留已生產入庫的數量"""
+        if order.status in ALLOCATION_STATUSES:
+            return getattr(order, 'allocated_quantity', 0) or 0
+        if order.status in PRODUCTION_STATUSES:
+            return order.produced_quantity
+        return 0
+
+    def _sync_reservation(self, order_key, order):
+        """依訂單目前狀態更新保留量帳"""
+        self.inventory.reserve(order_key, order.prod_name, self._reservation_quantity(order))
+
+    def reconcile_reservations(self):
+        """依所有訂單一次重算保留量帳，修正並回報與帳上或產品表記錄不一致的產品
+
+        Returns:
+            差異 DataFrame（見 Inventory.reconcile_reservations），沒有差異時為空
+        """
+        order_keys = list(self._orders)
+        if self.order_table is not None:
+            # 欄位式訂單表直接以欄位陣列計算，不建立訂單物件
+            table = self.order_table
+            rows = np.fromiter((order._row for order in self._orders.values()), dtype=np.int64, count=len(order_keys))
+            status_codes, vocab = table.codes('status')
+            status = np.asarray(vocab, dtype=object)[status_codes[rows]] if len(rows) else np.zeros(0, dtype=object)
+            quantities = np.where(np.isin(status, ALLOCATION_STATUSES), table.column('allocated_quantity')[rows],
+                                  np.where(np.isin(status, PRODUCTION_STATUSES), table.column('produced_quantity')[rows], 0))
+            product_names = table.column('prod_name')[rows]
+        else:
+            product_names = [order.prod_name for order in self._orders.values()]
+            quantities = [self._reservation_quantity(order) for order in self._orders.values()]
+        drift = self.inventory.reconcile_reservations(order_keys, product_names, quantities)
+        if not drift.empty:
+            print(f"保留量對帳：{len(drift)} 個產品與訂單不一致，已依訂單修正")
+        return drift
+
+    # ==================== 批次出貨與生產 ====================
+
+    # 可以出貨的訂單狀態：已分配的訂單出貨已分配量，生產完成的訂單出貨訂單數量
+    SHIPPABLE_STATUSES = ("已分配", "部分分配", "待出貨")
+
+    def _shipping_quantity(self, order):
+        """訂單本次出貨的數量"""
+        if order.status == "待出貨":
+            return order.quantity
+        return getattr(order, 'allocated_quantity', 0) or 0
+
+    def ship_orders(self, order_keys):
+        """批次出貨：先依產品彙總檢查庫存，再於同一個庫存批次中扣庫存並只保存一次
+
+        同一產品庫存不足時，依傳入順序出貨到庫存用完為止，其餘訂單回報庫存不足。
+        重複的訂單key 只出貨一次。
+
+        Args:
+            order_keys: 訂單唯一識別碼列表
+
+        Returns:
+            訂單key -> {'success': 是否出貨, 'quantity': 出貨數量, 'message': 說明}
+        """
+        results = {}
+        to_ship = []
+        remaining_stock = {}  # 產品名稱 -> 扣除本批已排定出貨後的庫存量
+        for order_key in dict.fromkeys(order_keys):
+            order = self._orders.get(order_key)
+            if order is None:
+                results[order_key] = {'success': False, 'quantity': 0, 'message': "訂單不存在"}
+                continue
+            if order.status not in self.SHIPPABLE_STATUSES:
+                results[order_key] = {'success': False, 'quantity': 0, 'message': f"狀態為 {order.status}，無法出貨"}
+                continue
+            quantity = self._shipping_quantity(order)
+            if quantity <= 0:
+                results[order_key] = {'success': False, 'quantity': 0, 'message': "沒有分配庫存，無法出貨"}
+                continue
+            if order.prod_name not in remaining_stock:
+                remaining_stock[order.prod_name] = self.inventory.get_product_quantity(order.prod_name) or 0
+            if remaining_stock[order.prod_name] < quantity:
+                results[order_key] = {'success': False, 'quantity': 0,
+                                      'message': f"庫存不足，需要 {quantity}，可用 {remaining_stock[order.prod_name]}"}
+                continue
+            remaining_stock[order.prod_name] -= quantity
+            to_ship.append((order_key, order, quantity))
+            results[order_key] = None  # 保留傳入順序，出貨後填入結果
+
+        with self.inventory.batch():
+            for order_key, order, quantity in to_ship:
+                if not self.inventory.stock_out(order.prod_name, quantity, order_key, f"出貨訂單 {order_key}"):
+                    results[order_key] = {'success': False, 'quantity': 0, 'message': "從庫存扣除失敗"}
+                    continue
+                if not self.transition(order_key, "已出貨", quantity):
+                    # 狀態轉換被拒絕時將扣除的數量入庫回去，不留下只做一半的出貨
+                    self.inventory.stock_in(order.prod_name, quantity, order_key, f"出貨取消 {order_key}")
+                    results[order_key] = {'success': False, 'quantity': 0, 'message': f"狀態為 {order.status}，無法出貨"}
+                    continue
+                results[order_key] = {'success': True, 'quantity': quantity, 'message': "已出貨"}
+
+        succeeded = sum(1 for result in results.values() if result['success'])
+        print(f"批次出貨完成：成功 {succeeded} 筆，失敗 {len(results) - succeeded} 筆")
+        return results
+
+    def produce_many(self, quantities):
+        """批次生產：各訂單的生產入庫在同一個庫存批次中完成並只保存一次
+
+        Args:
+            quantities: 訂單key -> 生產數量
+
+        Returns:
+            訂單key -> {'success': 是否生產, 'quantity': 實際生產數量, 'message': 說明}
+        """
+        results = {}
+        with self.inventory.batch():
+            for order_key, quantity in quantities.items():
+                order = self._orders.get(order_key)
+                before = order.produced_quantity if order is not None else 0
+                if not self.produce(order_key, quantity):
+                    reason = "訂單不存在" if order is None else f"狀態為 {order.status}，無法生產或已生產完成"
+                    results[order_key] = {'success': False, 'quantity': 0, 'message': reason}
+                    continue
+                results[order_key] = {'success': True, 'quantity': order.produced_quantity - before,
+                                      'message': f"狀態：{order.status}"}
+        succeeded = sum(1 for result in results.values() if result['success'])
+        print(f"批次生產完成：成功 {succeeded} 筆，失敗 {len(results) - succeeded} 筆")
+        return results
+
     def get_order_status(self, order_key):
         """獲取訂單狀態
         
@@ -593,7 +1546,8 @@ class ProductionManager:
             print(f"訂單 {order_key} 已生產 {order.produced_quantity} 個產品，這些產品將保留在庫存中")
         
         # 更新訂單狀態
-        order.status = "已取消"
+        if not self.transition(order_key, "已取消"):
+            return False
         print(f"訂單 {order_key} 已取消")
         
         return True
@@ -604,4 +1558,274 @@ class ProductionManager:
         Returns:
             包含所有產品庫存資訊的字典
         """
-        return self.inventory.check_stocks()
\ No newline at end of file
+        return self.inventory.check_stocks()
+
+    # ==================== 批次分配 ====================
+
+    # 可以分配庫存的訂單狀態
+    ALLOCATABLE_STATUSES = ("新訂單", "部分分配")
+
+    def _allocation_key(self, order_key, order):
+        """分配順序：優先級（1為最高）、訂單日期、提交時間，最後依加入順序"""
+        submitted = order.submitted.isoformat() if order.submitted else ''
+        return (order.priority, str(getattr(order, 'date', '') or ''), submitted, self._order_seq.get(order_key, 0))
+
+    def plan_allocation(self, product_names=None):
+        """試算批次分配結果（不修改任何資料）
+
+        將狀態為「新訂單」、「部分分配」的訂單依產品分組，每個產品以堆積依優先級與日期
+        排序，依序將產品的尚可分配量分給尚未分配完的訂單，直到該產品可分配量用完。
+
+        Args:
+            product_names: 只試算這些產品，None 表示全部
+
+        Returns:
+            分配明細列表，每筆為 {'order_key', 'product', 'quantity', 'allocated_quantity', 'status'}，
+            allocated_quantity 與 status 為套用後訂單的已分配量與狀態
+        """
+        heaps = {}  # 產品名稱 -> [(排序鍵, 訂單key, 待分配量)]
+        for status in self.ALLOCATABLE_STATUSES:
+            for order_key in self._indexes['status'].get(status, ()):
+                order = self._orders[order_key]
+                if product_names is not None and order.prod_name not in product_names:
+                    continue
+                remaining = order.quantity - (getattr(order, 'allocated_quantity', 0) or 0)
+                if remaining > 0:
+                    heaps.setdefault(order.prod_name, []).append(
+                        (self._allocation_key(order_key, order), order_key, remaining))
+
+        plan = []
+        for product_name, heap in heaps.items():
+            available = self.inventory.get_available_quantity(product_name)
+            if available <= 0:
+                continue
+            heapq.heapify(heap)
+            while heap and available > 0:
+                _, order_key, remaining = heapq.heappop(heap)
+                quantity = min(remaining, available)
+                available -= quantity
+                allocated = self._orders[order_key].quantity - remaining + quantity
+                plan.append({
+                    'order_key': order_key,
+                    'product': product_name,
+                    'quantity': quantity,
+                    'allocated_quantity': allocated,
+                    'status': "已分配" if quantity >= remaining else "部分分配"
+                })
+        return plan
+
+    def apply_allocation(self, plan):
+        """套用分配明細：更新訂單已分配量與狀態（同時記入保留量帳），產品表只保存一次
+
+        Args:
+            plan: plan_allocation 的結果
+
+        Returns:
+            實際分配的總數量
+        """
+        total = 0
+        for entry in plan:
+            order = self._orders.get(entry['order_key'])
+            product = self.inventory.products.get(entry['product'])
+            if order is None or product is None:
+                print(f"找不到訂單 {entry['order_key']} 或產品 {entry['product']}，略過")
+                continue
+            if order.status not in self.ALLOCATABLE_STATUSES:
+                print(f"訂單 {entry['order_key']} 狀態為 {order.status}，無法分配")
+                continue
+            allocated_quantity = (getattr(order, 'allocated_quantity', 0) or 0) + entry['quantity']
+            status = "已分配" if allocated_quantity >= order.quantity else "部分分配"
+            if not self.transition(entry['order_key'], status, allocated_quantity):
+                continue
+            total += entry['quantity']
+        if plan:
+            self.inventory.save_products()
+        return total
+
+    def allocate_orders(self, dry_run=False, product_names=None):
+        """依優先級與日期一次分配所有待分配訂單
+
+        Args:
+            dry_run: True 時只回傳試算結果，不修改資料
+            product_names: 只分配這些產品，None 表示全部
+
+        Returns:
+            分配明細列表（見 plan_allocation）
+        """
+        plan = self.plan_allocation(product_names)
+        if dry_run:
+            return plan
+        total = self.apply_allocation(plan)
+        print(f"批次分配完成：{len(plan)} 筆訂單，共分配 {total} 個")
+        return plan
+
+    # ==================== 待料訂單佇列 ====================
+
+    def _push_backorder(self, order_key, order):
+        """待分配的訂單放入所屬產品的佇列；已離開待分配狀態的項目在取出時才移除"""
+        if order.status not in self.ALLOCATABLE_STATUSES:
+            return
+        entry_key = (order.prod_name, order_key)
+        if entry_key in self._backorder_keys:
+            return
+        self._backorder_keys.add(entry_key)
+        heapq.heappush(self._backorders.setdefault(order.prod_name, []),
+                       (self._allocation_key(order_key, order), order_key))
+
+    def plan_backorder_allocation(self, product_name):
+        """試算將產品目前的尚可分配量依佇列順序分給待料訂單
+
+        只檢視佇列前端、實際分得數量的訂單，每筆成本為 O(log n)，不需掃描全部訂單。
+
+        Returns:
+            分配明細列表（格式同 plan_allocation）
+        """
+        heap = self._backorders.get(product_name)
+        available = self.inventory.get_available_quantity(product_name)
+        plan = []
+        while heap and available > 0:
+            sort_key, order_key = heap[0]
+            order = self._orders.get(order_key)
+            remaining = order.quantity - (getattr(order, 'allocated_quantity', 0) or 0) if order is not None else 0
+            if (order is None or order.prod_name != product_name
+                    or order.status not in self.ALLOCATABLE_STATUSES or remaining <= 0):
+                # 已出貨、取消、改品名或已分配完成的項目
+                heapq.heappop(heap)
+                self._backorder_keys.discard((product_name, order_key))
+                continue
+            current_key = self._allocation_key(order_key, order)
+            if current_key != sort_key:
+                # 優先級或日期已變更，依新順序放回
+                heapq.heapreplace(heap, (current_key, order_key))
+                continue
+            quantity = min(remaining, available)
+            available -= quantity
+            plan.append({
+                'order_key': order_key,
+                'product': product_name,
+                'quantity': quantity,
+                'allocated_quantity': order.quantity - remaining + quantity,
+                'status': "已分配" if quantity >= remaining else "部分分配"
+            })
+            if quantity < remaining:
+                break  # 可分配量已用完，此訂單留在佇列前端
+            heapq.heappop(heap)
+            self._backorder_keys.discard((product_name, order_key))
+        return plan
+
+    def allocate_backorders(self, product_name, quantity=None):
+        """將產品的尚可分配量分給等待中的訂單
+
+        Args:
+            product_name: 產品名稱
+            quantity: 本次入庫數量（供 Inventory.stock_listeners 呼叫，分配以目前尚可分配量為準）
+
+        Returns:
+            分配明細列表
+        """
+        plan = self.plan_backorder_allocation(product_name)
+        if plan:
+            total = self.apply_allocation(plan)
+            print(f"'{product_name}' 入庫後自動分配 {total} 個給 {len(plan)} 筆待料訂單")
+        return plan
+
+    def get_backorders(self, product_name):
+        """依分配順序列出產品的待料訂單"""
+        return [self._orders[order_key] for _, order_key in sorted(self._backorders.get(product_name, []))
+                if order_key in self._orders
+                and self._orders[order_key].prod_name == product_name
+                and self._orders[order_key].status in self.ALLOCATABLE_STATUSES]
+
+    def set_auto_allocation(self, enabled):
+        """設定可分配庫存增加時是否自動分配給待料訂單"""
+        listeners = self.inventory.stock_listeners
+        if enabled and self.allocate_backorders not in listeners:
+            listeners.append(self.allocate_backorders)
+        elif not enabled and self.allocate_backorders in listeners:
+            listeners.remove(self.allocate_backorders)
+
+    # ==================== 缺料分析 ====================
+
+    # 已結束、不再計入需求的訂單狀態
+    CLOSED_STATUSES = ("已出貨", "已取消")
+
+    def plan_shortfall(self, lookback_days=30, today=None):
+        """彙總所有未結訂單的需求與庫存供給，計算各產品缺料量、需生產量與可用天數
+
+        訂單只走訪一次收集成陣列，之後以產品代碼 (pd.factorize) 搭配 np.bincount 一次彙總，
+        產品數再多也只是陣列運算。
+
+        Args:
+            lookback_days: 計算平均日出庫量的回溯天數
+            today: 計算基準日，預設為今天
+
+        Returns:
+            DataFrame，每個產品一列，欄位為 品名、未結需求、已分配量、待分配需求、現有庫存量、
+            尚可分配量、生產中數量、缺料量、需生產量、日均出庫量、可用天數，依需生產量遞減排序
+        """
+        if self.order_table is not None:
+            # 欄位式訂單表直接取欄位陣列，不建立訂單物件
+            table = self.order_table
+            selected = table.mask() & ~table.mask(status=list(self.CLOSED_STATUSES))
+            order_products = list(table.column('prod_name')[selected])
+            order_quantity = table.column('quantity')[selected].astype(float)
+            allocated = np.nan_to_num(table.column('allocated_quantity')[selected].astype(float))
+            in_production = np.where(table.mask(status="生產中")[selected],
+                                     order_quantity - table.column('produced_quantity')[selected], 0)
+        else:
+            open_orders = [order for order in self._orders.values() if order.status not in self.CLOSED_STATUSES]
+            order_products = [order.prod_name for order in open_orders]
+            order_quantity = np.array([order.quantity for order in open_orders], dtype=float)
+            allocated = np.array([getattr(order, 'allocated_quantity', 0) or 0 for order in open_orders], dtype=float)
+            in_production = np.array([order.quantity - order.produced_quantity if order.status == "生產中" else 0
+                                      for order in open_orders], dtype=float)
+
+        # 產品代碼：庫存中的產品在前，只出現在訂單中的產品接在後面
+        stock_names = list(self.inventory.products)
+        codes, names = pd.factorize(pd.Index(stock_names + order_products))
+        order_codes = codes[len(stock_names):]
+        size = len(names)
+
+        def per_product(values, index=order_codes):
+            return np.bincount(index, weights=values, minlength=size)
+
+        on_hand = np.zeros(size)
+        allocatable = np.zeros(size)
+        on_hand[:len(stock_names)] = [info.get('quantity', 0) for info in self.inventory.products.values()]
+        allocatable[:len(stock_names)] = [self.inventory.get_available_quantity(name) for name in stock_names]
+
+        # 平均日出庫量
+        today = today or datetime.now()
+        start = (today - timedelta(days=lookback_days)).isoformat()
+        shipped = pd.DataFrame(
+            [(t['ProductName'], t['Quantity']) for t in self.inventory.get_transactions(start=start, end=today.isoformat())
+             if t['TransactionType'] == 'out'],
+            columns=['ProductName', 'Quantity'])
+        daily_usage = np.zeros(size)
+        if not shipped.empty:
+            usage_codes = names.get_indexer(shipped['ProductName'])
+            known = usage_codes >= 0
+            daily_usage = per_product(shipped['Quantity'].to_numpy(dtype=float)[known], usage_codes[known]) / lookback_days
+
+        demand = per_product(order_quantity)
+        allocated_total = per_product(allocated)
+        unallocated = np.maximum(demand - allocated_total, 0)
+        production_total = per_product(in_production)
+        shortfall = np.maximum(unallocated - allocatable, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coverage = np.where(daily_usage > 0, on_hand / daily_usage, np.inf)
+
+        result = pd.DataFrame({
+            '品名': names,
+            '未結需求': demand,
+            '已分配量': allocated_total,
+            '待分配需求': unallocated,
+            '現有庫存量': on_hand,
+            '尚可分配量': allocatable,
+            '生產中數量': production_total,
+            '缺料量': shortfall,
+            '需生產量': np.maximum(shortfall - production_total, 0),
+            '日均出庫量': daily_usage,
+            '可用天數': coverage
+        })
+        return result.sort_values(['需生產量', '缺料量'], ascending=False, kind='stable').reset_index(drop=True)
@@ -0,0 +1,638 @@
+import os
+import json
+import sqlite3
+import threading
+
+from json_stream import iter_json, iter_section
+
+
+# ==================== 應用程式儲存設定 ====================
+STORAGE_MODE = "journal"  # 'json'、'journal' 或 'sqlite'
+INVENTORY_JSON_PATH = "working_data/inventory_data.json"
+ORDERS_JSON_PATH = "working_data/orders_data.json"
+ORDER_EVENTS_PATH = "working_data/order_events.jsonl"
+SQLITE_PATH = "working_data/erp_data.db"
+
+
+# ==================== 共用工具 ====================
+def atomic_write_json(path, data, indent=4):
+    """以「暫存檔 + 改名」方式寫入 JSON，避免寫到一半時檔案損毀"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def snapshot_products(products):
+    """複製產品表（每個產品資訊各自複製一份）
+
+    背景寫檔執行緒序列化時使用，避免介面執行緒同時修改產品表造成讀到一半的狀態。
+    """
+    return {name: dict(info) for name, info in dict(products).items()}
+
+
+# ==================== JsonStorage ====================
+class JsonStorage:
+    """單一 JSON 檔案儲存（原有格式），每次保存都重寫整個檔案"""
+
+    supports_append = False
+    HEADER_FIELDS = frozenset()  # 延遲載入讀取表頭時必須取得的單值欄位
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.lock = threading.RLock()  # 介面與背景寫檔執行緒共用的寫入鎖
+
+    def exists(self):
+        """資料檔案是否存在"""
+        return os.path.exists(self.database_path)
+
+    def load(self):
+        """載入資料
+
+        Returns:
+            (products, transactions)，transactions 為交易字典列表
+        """
+        products, transactions = {}, []
+        for chunk in self.iter_load(products):
+            transactions.extend(chunk)
+        return products, transactions
+
+    def iter_load(self, products, chunk_size=1000):
+        """串流載入資料，產品表就地填入 products，交易記錄分段產出
+
+        Args:
+            products: 用來接收產品表的字典
+            chunk_size: 每段交易字典筆數
+        """
+        yield from self._iter_snapshot(products, chunk_size, {})
+
+    def load_lazy(self):
+        """只讀取產品表，交易記錄留待 iter_history 讀取
+
+        Returns:
+            (products, 歷史標記)，標記交給 iter_history 以取得載入當時的交易記錄
+        """
+        products = {}
+        self._read_header(products, {})
+        return products, None
+
+    def iter_history(self, mark, chunk_size=1000):
+        """分段產出 load_lazy 當時已存在的交易字典"""
+        yield from self._iter_snapshot({}, chunk_size, {})
+
+    def _read_header(self, products, meta):
+        """讀取快照中交易記錄之前的部分（產品表與單值欄位），讀到交易區段即停止"""
+        for section, record in iter_json(self.database_path):
+            if section == 'transactions':
+                # 舊版快照的 journal_seq 寫在交易之後，只能繼續往下找
+                if self.HEADER_FIELDS <= meta.keys():
+                    return
+            elif section == 'products':
+                name, product_info = record
+                products[name] = product_info
+            else:
+                meta[section] = record
+
+    def _iter_snapshot(self, products, chunk_size, meta):
+        """逐筆解析快照檔，產品寫入 products、其他單值欄位寫入 meta，交易分段產出"""
+        chunk = []
+        for section, record in iter_json(self.database_path):
+            if section == 'transactions':
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            elif section == 'products':
+                name, product_info = record
+                products[name] = product_info
+            else:
+                meta[section] = record
+        if chunk:
+            yield chunk
+
+    def needs_compaction(self):
+        """單一檔案每次都完整保存，不需要合併"""
+        return False
+
+    def rewrite(self, products, transactions):
+        """以目前的產品表與交易記錄完整取代儲存內容（封存後移除舊交易用）"""
+        self.save(products, transactions)
+
+    def save(self, products, transactions):
+        """保存完整的產品表與交易記錄"""
+        with self.lock:
+            data = {
+                'products': snapshot_products(products),
+                'transactions': [t.to_dict() for t in transactions]
+            }
+            atomic_write_json(self.database_path, data)
+
+
+# ==================== JournalStorage ====================
+class JournalStorage(JsonStorage):
+    """快照 + 追加式交易日誌儲存
+
+    快照沿用原本的 inventory_data.json 格式；每次異動只在日誌檔
+    (inventory_data.journal) 追加一行精簡 JSON，寫入成本與歷史長度無關。
+    日誌紀錄格式：
+        {"s": 序號, "n": 產品名稱, "p": 產品資訊, "t": 交易字典(可省略)}  單一產品異動
+        {"s": 序號, "all": 完整產品表}                                  整批取代產品表
+    快照中的 journal_seq 記錄已併入快照的最後序號，重播時會略過，
+    因此即使在寫快照與清空日誌之間中斷也不會重複套用。
+    """
+
+    supports_append = True
+    HEADER_FIELDS = frozenset(['journal_seq'])
+
+    def __init__(self, database_path, compact_threshold=5000):
+        super().__init__(database_path)
+        self.compact_threshold = compact_threshold  # 日誌累積筆數超過此值時合併為新快照
+        self.seq = 0  # 最後一筆日誌序號
+        self.pending_records = 0  # 尚未併入快照的日誌筆數
+
+    @property
+    def journal_path(self):
+        """日誌檔路徑，與快照同目錄同檔名"""
+        return os.path.splitext(self.database_path)[0] + ".journal"
+
+    def exists(self):
+        return os.path.exists(self.database_path) or os.path.exists(self.journal_path)
+
+    def iter_load(self, products, chunk_size=1000):
+        meta = {}
+        if os.path.exists(self.database_path):
+            yield from self._iter_snapshot(products, chunk_size, meta)
+        snapshot_seq = meta.get('journal_seq', 0)
+
+        self.seq = snapshot_seq
+        self.pending_records = 0
+        transactions = []
+        for record in self._iter_journal(snapshot_seq):
+            self._apply_record(record, products, transactions)
+            self.seq = record['s']
+            self.pending_records += 1
+            if len(transactions) >= chunk_size:
+                yield transactions
+                transactions = []
+        if transactions:
+            yield transactions
+
+    def load_lazy(self):
+        """讀取快照的產品表並重播日誌中的產品異動，交易記錄留待 iter_history 讀取"""
+        products, meta = {}, {}
+        if os.path.exists(self.database_path):
+            self._read_header(products, meta)
+        snapshot_seq = meta.get('journal_seq', 0)
+
+        self.seq = snapshot_seq
+        self.pending_records = 0
+        for record in self._iter_journal(snapshot_seq):
+            self._apply_record(record, products, [])
+            self.seq = record['s']
+            self.pending_records += 1
+        return products, self.seq
+
+    def iter_history(self, mark, chunk_size=1000):
+        """分段產出序號不超過 mark 的交易字典（快照中的交易 + 日誌中的交易）"""
+        meta = {}
+        if os.path.exists(self.database_path):
+            yield from self._iter_snapshot({}, chunk_size, meta)
+        transactions = []
+        for record in self._iter_journal(meta.get('journal_seq', 0)):
+            if record['s'] > mark:
+                break
+            if record.get('t'):
+                transactions.append(record['t'])
+                if len(transactions) >= chunk_size:
+                    yield transactions
+                    transactions = []
+        if transactions:
+            yield transactions
+
+    def _iter_journal(self, after_seq):
+        """依序產出日誌中序號大於 after_seq 的紀錄"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 最後一行可能因中斷而不完整，忽略其後內容
+                    print(f"交易日誌第 {line_no} 行不完整，已略過其後內容")
+                    return
+                if record['s'] > after_seq:
+                    yield record
+
+    @staticmethod
+    def _apply_record(record, products, transactions):
+        """將單筆日誌紀錄套用到產品表與交易列表"""
+        if 'all' in record:
+            products.clear()
+            products.update(record['all'])
+            return
+        products[record['n']] = record['p']
+        if record.get('t'):
+            transactions.append(record['t'])
+
+    def append(self, changes):
+        """追加異動到日誌
+
+        Args:
+            changes: (產品名稱, 產品資訊, 交易物件或None) 的列表
+        """
+        with self.lock:
+            lines = []
+            for name, product_info, transaction in changes:
+                self.seq += 1
+                record = {'s': self.seq, 'n': name, 'p': product_info}
+                if transaction is not None:
+                    record['t'] = transaction.to_dict()
+                lines.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+            self._write_lines(lines)
+
+    def append_products(self, products):
+        """以單筆紀錄取代整個產品表（用於匯入或直接修改產品資訊後的保存）
+
+        產品表在持有寫入鎖時才複製，因此內容不會比日誌中已寫入的紀錄舊。
+        """
+        with self.lock:
+            self.seq += 1
+            record = {'s': self.seq, 'all': snapshot_products(products)}
+            self._write_lines([json.dumps(record, ensure_ascii=False, separators=(',', ':'))])
+
+    def _write_lines(self, lines):
+        if not lines:
+            return
+        directory = os.path.dirname(self.journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+        self.pending_records += len(lines)
+
+    def needs_compaction(self):
+        """日誌是否已累積到需要合併為快照"""
+        return self.pending_records >= self.compact_threshold
+
+    def save(self, products, transactions):
+        """寫入新快照並清空日誌"""
+        with self.lock:
+            # journal_seq 寫在交易之前，延遲載入時讀完表頭即可停止
+            data = {
+                'products': snapshot_products(products),
+                'journal_seq': self.seq,
+                'transactions': [t.to_dict() for t in transactions]
+            }
+            atomic_write_json(self.database_path, data)
+            if os.path.exists(self.journal_path):
+                open(self.journal_path, 'w', encoding='utf-8').close()
+            self.pending_records = 0
+
+
+# ==================== SqliteStorage ====================
+class SqliteStorage:
+    """SQLite 儲存（WAL 模式），產品、交易與訂單各自一張表
+
+    交易依產品名稱、時間與訂單編號建立索引，訂單依單號、狀態與日期建立索引，
+    歷史查詢與報表篩選可直接走索引，不需載入整個檔案。
+    """
+
+    supports_append = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS products (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            order_id TEXT,
+            notes TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_product ON transactions(product_name, seq);
+        CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_transactions_order ON transactions(order_id);
+        CREATE TABLE IF NOT EXISTS orders (
+            order_key TEXT PRIMARY KEY,
+            trans_id TEXT,
+            status TEXT,
+            cust_name TEXT,
+            prod_name TEXT,
+            date TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_trans_id ON orders(trans_id);
+        CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status, date);
+        CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(date);
+    """
+
+    TRANSACTION_COLUMNS = "transaction_id, timestamp, product_name, transaction_type, quantity, order_id, notes"
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.stored_transactions = 0  # 記憶體中已寫入資料庫的交易筆數
+        self._local = threading.local()  # 每個執行緒各自的資料庫連線
+
+    @property
+    def conn(self):
+        """延遲建立資料庫連線（SQLite 連線不能跨執行緒，背景寫檔執行緒會取得自己的連線）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.database_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.database_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """關閉目前執行緒的資料庫連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def exists(self):
+        return os.path.exists(self.database_path)
+
+    @staticmethod
+    def _transaction_row(t):
+        return (t['TransactionID'], t['Timestamp'], t['ProductName'], t['TransactionType'],
+                t['Quantity'], t.get('OrderID'), t.get('Notes', ''))
+
+    @staticmethod
+    def _transaction_dict(row):
+        return {
+            "TransactionID": row[0],
+            "Timestamp": row[1],
+            "ProductName": row[2],
+            "TransactionType": row[3],
+            "Quantity": row[4],
+            "OrderID": row[5],
+            "Notes": row[6]
+        }
+
+    def load_products(self):
+        """只讀取產品表"""
+        return {name: json.loads(data) for name, data in self.conn.execute("SELECT name, data FROM products")}
+
+    def load(self):
+        products = self.load_products()
+        transactions = self.query_transactions()
+        self.stored_transactions = len(transactions)
+        return products, transactions
+
+    def iter_load(self, products, chunk_size=1000):
+        """產品表就地填入 products，交易記錄以游標分段讀取"""
+        products.update(self.load_products())
+        self.stored_transactions = 0
+        for chunk in self.iter_history(None, chunk_size):
+            self.stored_transactions += len(chunk)
+            yield chunk
+
+    def load_lazy(self):
+        """只讀取產品表，標記為目前最後一筆交易的序號"""
+        count, last_seq = self.conn.execute("SELECT COUNT(*), MAX(seq) FROM transactions").fetchone()
+        self.stored_transactions = count  # 延遲載入的歷史交易都已在資料庫中
+        return self.load_products(), last_seq or 0
+
+    def iter_history(self, mark, chunk_size=1000):
+        """以游標分段產出序號不超過 mark 的交易字典（mark 為 None 時產出全部）"""
+        sql = f"SELECT {self.TRANSACTION_COLUMNS} FROM transactions"
+        params = []
+        if mark is not None:
+            sql += " WHERE seq <= ?"
+            params.append(mark)
+        cursor = self.conn.execute(sql + " ORDER BY seq", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [self._transaction_dict(row) for row in rows]
+
+    def save(self, products, transactions):
+        """覆寫產品表，並補寫尚未寫入的交易"""
+        with self.conn:
+            self._replace_products(products)
+            new_transactions = transactions[self.stored_transactions:]
+            self.conn.executemany(
+                f"INSERT INTO transactions ({self.TRANSACTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._transaction_row(t.to_dict()) for t in new_transactions]
+            )
+        self.stored_transactions = len(transactions)
+
+    def rewrite(self, products, transactions):
+        """以目前的產品表與交易記錄完整取代資料庫內容（封存後移除舊交易用）"""
+        with self.conn:
+            self._replace_products(products)
+            self.conn.execute("DELETE FROM transactions")
+            self.conn.executemany(
+                f"INSERT INTO transactions ({self.TRANSACTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._transaction_row(t.to_dict()) for t in transactions]
+            )
+        self.stored_transactions = len(transactions)
+
+    def _replace_products(self, products):
+        self.conn.execute("DELETE FROM products")
+        self.conn.executemany(
+            "INSERT INTO products (name, data) VALUES (?, ?)",
+            [(name, json.dumps(info, ensure_ascii=False)) for name, info in snapshot_products(products).items()]
+        )
+
+    def append(self, changes):
+        with self.conn:
+            for name, product_info, transaction in changes:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO products (name, data) VALUES (?, ?)",
+                    (name, json.dumps(product_info, ensure_ascii=False))
+                )
+                if transaction is not None:
+                    self.conn.execute(
+                        f"INSERT INTO transactions ({self.TRANSACTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        self._transaction_row(transaction.to_dict())
+                    )
+                    self.stored_transactions += 1
+
+    def append_products(self, products):
+        with self.conn:
+            self._replace_products(products)
+
+    def needs_compaction(self):
+        return False
+
+    # ---------- 索引查詢 ----------
+
+    def query_transactions(self, start=None, end=None, product_name=None, order_id=None):
+        """依條件查詢交易記錄
+
+        Args:
+            start: 起始時間 (ISO 字串，含)
+            end: 結束時間 (ISO 字串，不含)
+            product_name: 產品名稱
+            order_id: 訂單編號
+
+        Returns:
+            交易字典列表，依寫入順序排列
+        """
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        if product_name is not None:
+            conditions.append("product_name = ?")
+            params.append(product_name)
+        if order_id is not None:
+            conditions.append("order_id = ?")
+            params.append(order_id)
+        sql = f"SELECT {self.TRANSACTION_COLUMNS} FROM transactions"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY seq"
+        return [self._transaction_dict(row) for row in self.conn.execute(sql, params)]
+
+    def product_history(self, product_name):
+        """查詢單一產品的交易記錄"""
+        return self.query_transactions(product_name=product_name)
+
+    def transaction_dates(self):
+        """所有有交易的日期 (YYYY-MM-DD)"""
+        return [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 10) FROM transactions ORDER BY 1")]
+
+    # ---------- 訂單 ----------
+
+    def save_orders(self, orders):
+        """以訂單字典列表（orders_data.json 格式）覆寫訂單表"""
+        with self.conn:
+            self.conn.execute("DELETE FROM orders")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO orders (order_key, trans_id, status, cust_name, prod_name, date, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((f"{o.get('trans_id', '')}-{o.get('seq_id', '')}", o.get('trans_id'), o.get('status'),
+                  o.get('cust_name'), o.get('prod_name'), o.get('date'), json.dumps(o, ensure_ascii=False))
+                 for o in orders)
+            )
+
+    def load_orders(self, status=None, start_date=None, end_date=None, trans_id=None):
+        """依條件查詢訂單
+
+        Args:
+            status: 訂單狀態
+            start_date: 起始日期 (YYYY-MM-DD，含)
+            end_date: 結束日期 (YYYY-MM-DD，含)
+            trans_id: 單號
+
+        Returns:
+            訂單字典列表（orders_data.json 格式）
+        """
+        conditions, params = [], []
+        for column, op, value in (("status", "=", status), ("date", ">=", start_date),
+                                  ("date", "<=", end_date), ("trans_id", "=", trans_id)):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+        sql = "SELECT data FROM orders"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY rowid"
+        return [json.loads(row[0]) for row in self.conn.execute(sql, params)]
+
+    # ---------- JSON 匯入 / 匯出 ----------
+
+    def import_json(self, inventory_path=None, orders_path=None):
+        """從原有 JSON 格式匯入（庫存檔會一併讀取交易日誌）"""
+        with self.conn:
+            if inventory_path and JournalStorage(inventory_path).exists():
+                products = {}
+                self.conn.execute("DELETE FROM transactions")
+                self.stored_transactions = 0
+                for chunk in JournalStorage(inventory_path).iter_load(products):
+                    self.conn.executemany(
+                        f"INSERT INTO transactions ({self.TRANSACTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [self._transaction_row(t) for t in chunk]
+                    )
+                    self.stored_transactions += len(chunk)
+                self._replace_products(products)
+        if orders_path and os.path.exists(orders_path):
+            self.save_orders(iter_section(orders_path, 'orders'))
+
+    def export_json(self, inventory_path=None, orders_path=None):
+        """匯出為原有 JSON 格式"""
+        if inventory_path:
+            products, transactions = self.load()
+            atomic_write_json(inventory_path, {'products': products, 'transactions': transactions})
+        if orders_path:
+            atomic_write_json(orders_path, {'orders': self.load_orders()})
+
+
+STORAGE_CLASSES = {
+    "json": JsonStorage,
+    "journal": JournalStorage,
+    "sqlite": SqliteStorage,
+}
+
+
+def create_storage(storage_mode, database_path):
+    """依儲存模式建立儲存物件"""
+    if storage_mode not in STORAGE_CLASSES:
+        raise ValueError(f"不支援的儲存模式: {storage_mode}")
+    return STORAGE_CLASSES[storage_mode](database_path)
+
+
+def app_database_path():
+    """目前儲存模式下的庫存資料路徑"""
+    return SQLITE_PATH if STORAGE_MODE == "sqlite" else INVENTORY_JSON_PATH
+
+
+def load_order_records(status=None):
+    """讀取應用程式保存的訂單字典列表
+
+    Args:
+        status: 只回傳此狀態的訂單（SQLite 模式走索引）
+
+    Raises:
+        FileNotFoundError: 尚未保存任何訂單資料
+    """
+    if STORAGE_MODE == "sqlite":
+        if not os.path.exists(SQLITE_PATH):
+            raise FileNotFoundError(SQLITE_PATH)
+        storage = SqliteStorage(SQLITE_PATH)
+        try:
+            return storage.load_orders(status=status)
+        finally:
+            storage.close()
+
+    # 串流讀取，篩選在解析時進行，不需先把整個檔案讀入
+    orders = iter_section(ORDERS_JSON_PATH, 'orders')
+    if status is not None:
+        return [order for order in orders if order.get('status') == status]
+    return list(orders)
+
+
+def load_inventory_file(path):
+    """讀取庫存資料檔（含尚未合併的交易日誌）
+
+    Returns:
+        (products, transactions)，transactions 為交易字典列表
+    """
+    return JournalStorage(path).load()
@@ -0,0 +1,148 @@
+import re
+import json
+
+
+_WHITESPACE = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+_NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+# ==================== 串流解析器 ====================
+class _StreamParser:
+    """以固定大小區塊讀取檔案的 JSON 解析器，只保留尚未解析的部分在記憶體中"""
+
+    def __init__(self, f, read_size):
+        self.f = f
+        self.read_size = read_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """再讀入一個區塊，並丟棄已解析的內容；已到檔尾時回傳 False"""
+        data = self.f.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        if self.pos >= self.read_size:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf += data
+        return True
+
+    def peek(self):
+        """略過空白並回傳下一個字元（檔尾回傳空字串）"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        """讀取指定的結構字元"""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON 格式錯誤：預期 {char!r}，實際為 {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """解析一個完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                # 數字可能被區塊邊界截斷（例如 "-2" 後面還有 ".5"），需讀到非數字字元才算完整
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def items(self, close):
+        """逐一走訪容器內的元素，呼叫端需在每次產出後解析該元素（開頭字元已讀取）"""
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            separator = self.peek()
+            self.pos += 1
+            if separator == close:
+                return
+            if separator != ',':
+                raise ValueError(f"JSON 格式錯誤：預期 ',' 或 {close!r}，實際為 {separator!r}")
+
+    def members(self):
+        """走訪物件成員，產出 (鍵, 值)"""
+        for _ in self.items('}'):
+            key = self.value()
+            self.expect(':')
+            yield key, self.value()
+
+    def elements(self):
+        """走訪陣列元素"""
+        for _ in self.items(']'):
+            yield self.value()
+
+
+# ==================== 公用函式 ====================
+def iter_json(path, read_size=1 << 16):
+    """串流讀取 JSON 檔案，逐筆產出頂層區段中的紀錄
+
+    頂層為物件時，陣列型的區段逐一產出 (區段名稱, 元素)，物件型的區段逐一產出
+    (區段名稱, (鍵, 值))，其他值產出 (區段名稱, 值)；頂層為陣列時產出 (None, 元素)。
+    檔案只以區塊讀入，記憶體用量與單筆紀錄大小相關而非整個檔案。
+
+    Args:
+        path: JSON 檔案路徑
+        read_size: 每次讀取的字元數
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        parser = _StreamParser(f, read_size)
+        first = parser.peek()
+        if first == '[':
+            parser.pos += 1
+            for element in parser.elements():
+                yield None, element
+            return
+        parser.expect('{')
+        for _ in parser.items('}'):
+            section = parser.value()
+            parser.expect(':')
+            kind = parser.peek()
+            if kind == '[':
+                parser.pos += 1
+                for element in parser.elements():
+                    yield section, element
+            elif kind == '{':
+                parser.pos += 1
+                for member in parser.members():
+                    yield section, member
+            else:
+                yield section, parser.value()
+
+
+def iter_section(path, name):
+    """只產出指定區段的紀錄；該區段讀完即停止，不再讀取檔案其餘部分"""
+    seen = False
+    for section, record in iter_json(path):
+        if section == name:
+            seen = True
+            yield record
+        elif seen:
+            return
+
+
+def iter_chunks(records, size=1000):
+    """將紀錄分段，每段為最多 size 筆的列表"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,150 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+
+# ==================== 訂單狀態機 ====================
+
+# 目前狀態 -> 允許轉換到的狀態；同狀態的轉換代表進度更新（例如再分配一部分、再生產一批）
+ORDER_TRANSITIONS = {
+    "待處理": {"新訂單", "已取消"},
+    "新訂單": {"生產中", "部分分配", "已分配", "已取消"},
+    "部分分配": {"部分分配", "已分配", "已出貨", "已取消"},
+    "已分配": {"已出貨", "已取消"},
+    "生產中": {"生產中", "待出貨", "已取消"},
+    "待出貨": {"已出貨", "已取消"},
+    "已出貨": set(),
+    "已取消": set(),
+}
+
+# 事件數量欄位的意義：到達該狀態後訂單的累計數量
+ALLOCATION_STATUSES = ("部分分配", "已分配")  # 已分配量
+PRODUCTION_STATUSES = ("生產中", "待出貨")  # 已生產數量
+
+# 第一次到達狀態時記錄的日期屬性
+STATUS_DATE_FIELDS = {
+    "生產中": 'production_date',
+    "待出貨": 'production_complete_date',
+    "已出貨": 'shipping_date',
+}
+
+
+def can_transition(from_status, to_status):
+    """狀態轉換是否合法；表中沒有的舊狀態（例如匯入資料自訂的狀態）不做限制"""
+    allowed = ORDER_TRANSITIONS.get(from_status)
+    return allowed is None or to_status in allowed
+
+
+def apply_event(order, to_status, quantity, timestamp):
+    """將事件套用到訂單：更新狀態、累計數量與狀態日期
+
+    數量記錄的是累計值而非增量，重複套用同一事件結果不變，
+    因此快照與事件之間即使有重疊也能安全重播。
+    """
+    if to_status in ALLOCATION_STATUSES:
+        order.allocated_quantity = quantity
+    elif to_status in PRODUCTION_STATUSES:
+        order.produced_quantity = quantity
+    date_field = STATUS_DATE_FIELDS.get(to_status)
+    if date_field and not getattr(order, date_field, None):
+        setattr(order, date_field, datetime.fromisoformat(timestamp))
+    order.status = to_status
+
+
+# ==================== OrderEventLog ====================
+class OrderEventLog:
+    """訂單生命週期事件日誌（只追加）
+
+    每次狀態轉換寫入一行精簡 JSON：
+        {"s": 序號, "k": 訂單key, "f": 原狀態, "t": 新狀態, "q": 數量, "ts": 時間}
+    訂單快照記錄寫入時的最後序號，重新啟動時只需重播其後的事件，
+    狀態變更不必每次重寫整份訂單資料。日誌本身保留完整歷史，可供稽核與前置時間分析。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seq = 0  # 最後一筆事件序號
+        self.lock = threading.Lock()
+        self._file = None
+        for event in self.iter_events():
+            self.seq = event['s']
+
+    def append(self, order_key, from_status, to_status, quantity=0):
+        """追加一筆事件並立即寫入
+
+        Returns:
+            事件字典
+        """
+        with self.lock:
+            self.seq += 1
+            if not isinstance(quantity, (int, float)):
+                quantity = float(quantity)  # 例如由 Excel 讀入的 NumPy 數值
+            event = {'s': self.seq, 'k': order_key, 'f': from_status, 't': to_status,
+                     'q': quantity, 'ts': datetime.now().isoformat()}
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._file.flush()
+        return event
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def iter_events(self, after_seq=0):
+        """依序產出序號大於 after_seq 的事件"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # 最後一行可能因中斷而不完整，忽略其後內容
+                    print(f"訂單事件日誌第 {line_no} 行不完整，已略過其後內容")
+                    return
+                if event['s'] > after_seq:
+                    yield event
+
+    def replay(self, orders, after_seq=0):
+        """將事件重播到訂單上（不寫入日誌）
+
+        Args:
+            orders: 訂單key -> 訂單物件
+            after_seq: 快照已包含的最後序號
+
+        Returns:
+            套用的事件數
+        """
+        applied = 0
+        for event in self.iter_events(after_seq):
+            order = orders.get(event['k'])
+            if order is None:
+                continue
+            apply_event(order, event['t'], event['q'], event['ts'])
+            applied += 1
+        return applied
+
+    def status_times(self):
+        """各訂單第一次到達各狀態的時間，供前置時間分析
+
+        Returns:
+            DataFrame，索引為訂單key，欄位為狀態，值為時間 (datetime64)
+        """
+        first = {}
+        for event in self.iter_events():
+            first.setdefault((event['k'], event['t']), event['ts'])
+        if not first:
+            return pd.DataFrame()
+        frame = pd.Series(first).unstack()
+        return frame.apply(pd.to_datetime)
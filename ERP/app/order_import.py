@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+
+# ==================== 欄位對應 ====================
+
+# Excel 欄位 -> (訂單屬性, 空白時的預設值)
+ORDER_COLUMNS = {
+    '交易類型': ('trans_type', "SO"),
+    '單號': ('trans_id', ""),
+    '序號': ('seq_id', ""),
+    '品號': ('prod_id', ""),
+    '品名': ('prod_name', ""),
+    '訂購數量': ('quantity', np.nan),
+    '單價': ('price', 0.0),
+    '客戶代號': ('cust_id', ""),
+    '客戶名稱': ('cust_name', ""),
+    '廠商代號': ('facto_id', "F001"),
+    '廠商名稱': ('facto_name', "預設廠商"),
+    '提交日期': ('date', ""),
+    '狀態': ('status', "新訂單"),
+    '已分配量': ('allocated_quantity', 0),
+}
+
+# 數值欄位；其餘皆為文字
+NUMERIC_COLUMNS = ('訂購數量', '單價', '已分配量')
+
+# 錯誤報告的欄位
+ERROR_COLUMNS = ['列號', '單號', '序號', '原因']
+
+# 庫存 Excel 欄位 -> 產品屬性；皆為必要欄位
+INVENTORY_COLUMNS = {
+    '品名': 'product_name',
+    '品號': 'product_id',
+    '單位成本': 'cost',
+    '尚可分配量': 'allocatable',
+    '現有庫存量': 'quantity',
+}
+INVENTORY_ERROR_COLUMNS = ['列號', '品名', '原因']
+
+
+def _text(series):
+    """將欄位轉為去除前後空白的文字；整數值的浮點數（例如含空白儲存格的單號欄）不帶 .0，空白為空字串"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime("%Y-%m-%d").fillna("")
+    if pd.api.types.is_float_dtype(series):
+        integral = series.notna() & (series == series.round())
+        text = series.astype(object)
+        text[integral] = series[integral].astype(np.int64)
+        series = text
+    missing = series.isna()
+    return series.astype(str).str.strip().mask(missing, "")
+
+
+# ==================== 訂單表整理 ====================
+
+def normalize_order_frame(df, row_numbers=None, seen_keys=None):
+    """以向量化運算整理由 Excel 讀入的訂單資料
+
+    欄位改為訂單屬性名稱並補上預設值，文字去除空白、序號補足 3 位數、數值轉型，
+    缺少單號或品名、數量不是數字、以及重複的訂單key（保留第一筆）都移到錯誤報告。
+
+    Args:
+        df: pd.read_excel 讀入的 DataFrame（欄位為中文名稱，缺少的欄位使用預設值）
+        row_numbers: 各列在工作表中的列號，用於錯誤報告；預設由標題列之後的第 2 列依序編號
+        seen_keys: 分段匯入時，先前各段已接受的訂單key 集合；在其中的訂單視為重複，
+                   本段接受的訂單key 會加入此集合
+
+    Returns:
+        (orders, errors)：orders 的欄位為訂單屬性名稱，可直接交給 ProductionManager.add_order_frame；
+        errors 的欄位為 列號、單號、序號、原因
+    """
+    if row_numbers is None:
+        row_numbers = pd.RangeIndex(2, len(df) + 2)
+    row_numbers = pd.Index(row_numbers)
+    df = df.reset_index(drop=True)
+    frame = pd.DataFrame(index=df.index)
+    for column, (field, default) in ORDER_COLUMNS.items():
+        if column not in df:
+            frame[field] = default
+        elif column in NUMERIC_COLUMNS:
+            frame[field] = pd.to_numeric(df[column], errors='coerce')
+        else:
+            frame[field] = _text(df[column])
+
+    # 空白儲存格使用預設值
+    for column, (field, default) in ORDER_COLUMNS.items():
+        if column in NUMERIC_COLUMNS:
+            if column != '訂購數量':
+                frame[field] = frame[field].fillna(default)
+        elif default:
+            frame[field] = frame[field].mask(frame[field] == "", default)
+    frame['seq_id'] = frame['seq_id'].str.zfill(3)
+
+    # 驗證：每列只記錄第一個錯誤原因
+    reason = pd.Series("", index=frame.index, dtype=object)
+    for invalid, message in ((frame['trans_id'] == "", "缺少單號"),
+                             (frame['prod_name'] == "", "缺少品名"),
+                             (frame['quantity'].isna(), "訂購數量不是數字")):
+        reason = reason.mask(invalid & (reason == ""), message)
+    order_key = frame['trans_id'] + "-" + frame['seq_id']
+    duplicated = order_key.duplicated()
+    if seen_keys is not None:
+        duplicated |= order_key.isin(seen_keys)
+    duplicated &= reason == ""
+    reason = reason.mask(duplicated, "重複的訂單")
+
+    invalid = reason != ""
+    errors = pd.DataFrame({
+        '列號': row_numbers[invalid.to_numpy()],
+        '單號': frame['trans_id'][invalid],
+        '序號': frame['seq_id'][invalid],
+        '原因': reason[invalid],
+    }, columns=ERROR_COLUMNS).reset_index(drop=True)
+
+    orders = frame[~invalid].reset_index(drop=True)
+    if seen_keys is not None:
+        seen_keys.update(order_key[~invalid])
+    orders['price'] = orders['price'].astype(float)
+    for field in ('quantity', 'allocated_quantity'):
+        # 數量全為整數時保留整數型別
+        values = orders[field]
+        if len(values) and (values == values.round()).all():
+            orders[field] = values.astype(np.int64)
+    return orders, errors
+
+
+# ==================== 庫存表整理 ====================
+
+def normalize_inventory_frame(df, row_numbers=None, seen_keys=None):
+    """以向量化運算整理由 Excel 讀入的庫存資料
+
+    缺少品名、數值欄位不是數字、以及重複的品名（保留第一筆）都移到錯誤報告。
+
+    Args:
+        df: 庫存 DataFrame，必須包含 INVENTORY_COLUMNS 的所有欄位
+        row_numbers: 各列在工作表中的列號（見 normalize_order_frame）
+        seen_keys: 分段匯入時，先前各段已接受的品名集合（見 normalize_order_frame）
+
+    Returns:
+        (products, errors)：products 的欄位為 product_name、product_id、cost、allocatable、quantity；
+        errors 的欄位為 列號、品名、原因
+
+    Raises:
+        ValueError: 缺少必要欄位
+    """
+    missing = [column for column in INVENTORY_COLUMNS if column not in df]
+    if missing:
+        raise ValueError(f"庫存資料缺少欄位：{'、'.join(missing)}")
+    if row_numbers is None:
+        row_numbers = pd.RangeIndex(2, len(df) + 2)
+    row_numbers = pd.Index(row_numbers)
+    df = df.reset_index(drop=True)
+
+    frame = pd.DataFrame({
+        'product_name': _text(df['品名']),
+        'product_id': _text(df['品號']),
+        'cost': pd.to_numeric(df['單位成本'], errors='coerce'),
+        'allocatable': pd.to_numeric(df['尚可分配量'], errors='coerce'),
+        'quantity': pd.to_numeric(df['現有庫存量'], errors='coerce'),
+    })
+
+    reason = pd.Series("", index=frame.index, dtype=object)
+    reason = reason.mask(frame['product_name'] == "", "缺少品名")
+    numbers_missing = frame[['cost', 'allocatable', 'quantity']].isna().any(axis=1)
+    reason = reason.mask(numbers_missing & (reason == ""), "成本或數量不是數字")
+    duplicated = frame['product_name'].duplicated()
+    if seen_keys is not None:
+        duplicated |= frame['product_name'].isin(seen_keys)
+    reason = reason.mask(duplicated & (reason == ""), "重複的品名")
+
+    invalid = reason != ""
+    errors = pd.DataFrame({
+        '列號': row_numbers[invalid.to_numpy()],
+        '品名': frame['product_name'][invalid],
+        '原因': reason[invalid],
+    }, columns=INVENTORY_ERROR_COLUMNS).reset_index(drop=True)
+
+    products = frame[~invalid].reset_index(drop=True)
+    products['cost'] = products['cost'].astype(float)
+    for field in ('allocatable', 'quantity'):
+        products[field] = products[field].astype(np.int64)  # 與 int() 相同，小數部分捨去
+    if seen_keys is not None:
+        seen_keys.update(products['product_name'])
+    return products, errors
+
+
+def format_error_report(errors, limit=20):
+    """將錯誤報告轉為文字（最多列出 limit 筆）"""
+    label_columns = [column for column in errors.columns if column not in ('列號', '原因')]
+    lines = [f"第 {row[0]} 列 {'-'.join(str(value) for value in row[1:-1])}：{row[-1]}"
+             for row in errors[['列號'] + label_columns + ['原因']].head(limit).itertuples(index=False, name=None)]
+    if len(errors) > limit:
+        lines.append(f"...另有 {len(errors) - limit} 筆")
+    return "\n".join(lines)
@@ -0,0 +1,275 @@
+from array import array
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+# ==================== 欄位定義 ====================
+
+# 字串欄位：以代碼陣列 + 字典儲存，相同的客戶、品名、狀態只保存一份
+STRING_FIELDS = ('trans_type', 'trans_id', 'seq_id', 'prod_id', 'prod_name', 'cust_id', 'cust_name',
+                 'facto_id', 'facto_name', 'trans_name', 'status', 'date')
+
+# 數值欄位 -> (array 型別碼, 未設定時的預設值)
+NUMERIC_FIELDS = {
+    'quantity': ('q', 0),
+    'price': ('d', 0.0),
+    'priority': ('b', 1),
+    'allocated_quantity': ('q', 0),
+    'produced_quantity': ('q', 0),
+}
+
+# 時間欄位：以 epoch 秒數存於 double 陣列，NaN 表示 None
+TIME_FIELDS = ('submitted', 'created_time', 'updated_time')
+
+# 不在欄位中、但訂單一定有的屬性預設值；其餘屬性（生產日期等）只在有設定的列保存
+EXTRA_DEFAULTS = {'shipping_date': None, 'remarks': ""}
+
+COLUMN_FIELDS = frozenset(STRING_FIELDS) | frozenset(NUMERIC_FIELDS) | frozenset(TIME_FIELDS)
+
+
+# ==================== OrderRow ====================
+class OrderRow:
+    """OrderTable 中一列的檢視，屬性讀寫直接對應到欄位，可代替 Order 物件使用
+
+    索引欄位被修改時與 Order 相同，會呼叫 ProductionManager 掛上的 _index_listener。
+    """
+
+    def __init__(self, table, row):
+        object.__setattr__(self, '_table', table)
+        object.__setattr__(self, '_row', row)
+
+    def __getattr__(self, name):
+        # 只有在一般屬性（_table、_row、索引通知等）找不到時才會進入
+        table = self.__dict__.get('_table')
+        if table is None:
+            raise AttributeError(name)
+        return table.get(self._row, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+            return
+        table = self._table
+        listener = self.__dict__.get('_index_listener')
+        if listener is None or name not in table.indexed_fields:
+            table.set(self._row, name, value)
+            return
+        old_value = table.get(self._row, name)
+        table.set(self._row, name, value)
+        if old_value != value:
+            listener(self, name, old_value, value)
+
+    def __repr__(self):
+        return f"<OrderRow {self.order_key} 第 {self._row} 列>"
+
+    @property
+    def amount(self) -> float:
+        """計算訂單金額"""
+        return self.quantity * self.price
+
+    @property
+    def order_key(self) -> str:
+        """訂單唯一識別碼"""
+        return f"{self.trans_id}-{self.seq_id}"
+
+    def to_dict(self):
+        """將訂單轉換為字典格式（與 Order.to_dict 相同）"""
+        return self._table.order_class.to_dict(self)
+
+
+# ==================== OrderTable ====================
+class OrderTable:
+    """欄位式訂單表
+
+    每個欄位是一個型別化陣列（array 模組，可直接以記憶體複製轉成 NumPy 陣列），字串欄位以字典編碼，
+    不常用的屬性只存於有設定的列。每筆訂單不再是一個帶有二十多個屬性的物件，
+    報表可直接對欄位陣列篩選與彙總；需要逐筆操作時再以 OrderRow 檢視存取。
+    被覆蓋的訂單列只標記為失效，不會搬移其他列。
+    """
+
+    def __init__(self, order_class, indexed_fields=frozenset()):
+        """建立空的訂單表
+
+        Args:
+            order_class: 訂單類別 (Order)，OrderRow.to_dict 借用其轉換方法
+            indexed_fields: 修改時需通知索引的欄位
+        """
+        self.order_class = order_class
+        self.indexed_fields = indexed_fields
+        self._size = 0
+        self._alive = array('b')
+        self._codes = {field: array('i') for field in STRING_FIELDS}
+        self._vocab = {field: [] for field in STRING_FIELDS}  # 代碼 -> 字串
+        self._vocab_index = {field: {} for field in STRING_FIELDS}  # 字串 -> 代碼
+        self._numbers = {field: array(typecode) for field, (typecode, _) in NUMERIC_FIELDS.items()}
+        self._times = {field: array('d') for field in TIME_FIELDS}
+        self._extras = {}  # 列號 -> {屬性: 值}
+
+    def __len__(self):
+        """有效（未被覆蓋）的訂單數"""
+        return sum(self._alive)
+
+    # ==================== 單列存取 ====================
+
+    def _encode(self, field, value):
+        index = self._vocab_index[field]
+        code = index.get(value)
+        if code is None:
+            code = len(self._vocab[field])
+            self._vocab[field].append(value)
+            index[value] = code
+        return code
+
+    def append(self, order):
+        """加入一筆訂單（Order 物件或任何具有相同屬性的物件）
+
+        Returns:
+            新列的 OrderRow 檢視
+        """
+        row = self._size
+        self._size += 1
+        self._alive.append(1)
+        for field in STRING_FIELDS:
+            self._codes[field].append(self._encode(field, getattr(order, field, '')))
+        for field, (_, default) in NUMERIC_FIELDS.items():
+            self._numbers[field].append(default)
+            self.set(row, field, getattr(order, field, default))
+        for field in TIME_FIELDS:
+            value = getattr(order, field, None)
+            self._times[field].append(value.timestamp() if value else np.nan)
+
+        # 其他屬性（生產日期、出貨日期、備註等）；OrderRow 的屬性存於來源表，而非物件本身
+        source = order._table._extras.get(order._row, {}) if isinstance(order, OrderRow) else vars(order)
+        extras = {}
+        for name, value in source.items():
+            if name.startswith('_') or name in COLUMN_FIELDS:
+                continue
+            if name in EXTRA_DEFAULTS and value == EXTRA_DEFAULTS[name]:
+                continue
+            extras[name] = value
+        if extras:
+            self._extras[row] = extras
+        return OrderRow(self, row)
+
+    def discard(self, row):
+        """標記列為失效（訂單被覆蓋）"""
+        self._alive[row] = 0
+
+    def get(self, row, name):
+        """讀取單一欄位值"""
+        codes = self._codes.get(name)
+        if codes is not None:
+            return self._vocab[name][codes[row]]
+        numbers = self._numbers.get(name)
+        if numbers is not None:
+            return numbers[row]
+        times = self._times.get(name)
+        if times is not None:
+            value = times[row]
+            return None if value != value else datetime.fromtimestamp(value)
+        extras = self._extras.get(row)
+        if extras is not None and name in extras:
+            return extras[name]
+        if name in EXTRA_DEFAULTS:
+            return EXTRA_DEFAULTS[name]
+        raise AttributeError(name)
+
+    def set(self, row, name, value):
+        """寫入單一欄位值"""
+        if name in self._codes:
+            self._codes[name][row] = self._encode(name, value)
+        elif name in self._numbers:
+            column = self._numbers[name]
+            try:
+                column[row] = value
+            except (TypeError, OverflowError, ValueError):
+                # 整數欄位遇到小數、或數值欄位遇到其他型別時放寬欄位型別
+                self._numbers[name] = column = self._widen(column, value)
+                column[row] = value
+        elif name in self._times:
+            self._times[name][row] = value.timestamp() if value else np.nan
+        else:
+            self._extras.setdefault(row, {})[name] = value
+
+    @staticmethod
+    def _widen(column, value):
+        if isinstance(column, array) and column.typecode != 'd' and isinstance(value, float):
+            return array('d', column)
+        return list(column)
+
+    # ==================== 欄位運算 ====================
+
+    def alive_mask(self):
+        """有效列的布林陣列"""
+        return np.frombuffer(self._alive, dtype=np.int8).astype(bool) if self._size else np.zeros(0, dtype=bool)
+
+    @staticmethod
+    def _to_numpy(column, dtype):
+        # 複製一份，避免 NumPy 檢視鎖住 array 的緩衝區，之後無法再追加列
+        return np.frombuffer(column, dtype=dtype).copy() if len(column) else np.zeros(0, dtype=dtype)
+
+    def column(self, field):
+        """取得整個欄位的 NumPy 陣列（含失效列，需搭配 mask 使用）
+
+        數值欄位直接複製記憶體；字串欄位依代碼還原為物件陣列。
+        """
+        if field in self._codes:
+            codes, vocab = self.codes(field)
+            return np.asarray(vocab, dtype=object)[codes] if len(codes) else np.zeros(0, dtype=object)
+        if field in self._numbers:
+            column = self._numbers[field]
+            if isinstance(column, array):
+                return self._to_numpy(column, np.dtype(column.typecode))
+            return np.asarray(column)
+        if field in self._times:
+            return self._to_numpy(self._times[field], np.float64)
+        raise KeyError(field)
+
+    def codes(self, field):
+        """取得字串欄位的 (代碼陣列, 字典)，可直接以代碼分組"""
+        return self._to_numpy(self._codes[field], np.int32), self._vocab[field]
+
+    def mask(self, **criteria):
+        """依欄位條件篩選有效列，值可為單一值或值的集合（list、tuple、set）
+
+        Returns:
+            布林陣列
+        """
+        result = self.alive_mask()
+        for field, value in criteria.items():
+            values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+            if field in self._codes:
+                codes, _ = self.codes(field)
+                wanted = [self._vocab_index[field][v] for v in values if v in self._vocab_index[field]]
+                result &= np.isin(codes, wanted)
+            else:
+                result &= np.isin(self.column(field), list(values))
+        return result
+
+    def rows(self, **criteria):
+        """符合條件的有效列 OrderRow 檢視"""
+        return [OrderRow(self, int(row)) for row in np.flatnonzero(self.mask(**criteria))]
+
+    def sum_by(self, group_field, value_field='quantity', **criteria):
+        """依字串欄位分組加總數值欄位，不建立訂單物件
+
+        Returns:
+            分組值 -> 合計
+        """
+        selected = self.mask(**criteria)
+        codes, vocab = self.codes(group_field)
+        totals = np.bincount(codes[selected], weights=self.column(value_field)[selected].astype(float),
+                             minlength=len(vocab))
+        return {vocab[code]: float(total) for code, total in enumerate(totals) if total}
+
+    def to_frame(self, fields=None, **criteria):
+        """符合條件的有效列轉為 DataFrame
+
+        Args:
+            fields: 欄位列表，預設為所有字串與數值欄位
+        """
+        fields = fields or list(STRING_FIELDS) + list(NUMERIC_FIELDS)
+        selected = self.mask(**criteria)
+        return pd.DataFrame({field: self.column(field)[selected] for field in fields})
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+
+
+# ==================== PersistenceWorker ====================
+class PersistenceWorker:
+    """背景寫檔執行緒，讓介面執行緒不必等待磁碟寫入
+
+    每個寫入工作以鍵值登記，尚未執行的同鍵工作會被較新的工作取代，
+    因此連續多次異動只會寫入一次最新狀態。寫入失敗時將 (鍵, 例外) 放入 errors 佇列，
+    由介面執行緒定期取出顯示。
+    """
+
+    def __init__(self, coalesce_delay=0.2):
+        """初始化並啟動背景執行緒
+
+        Args:
+            coalesce_delay: 收到第一個工作後等待的秒數，以合併同一波的連續異動
+        """
+        self.coalesce_delay = coalesce_delay
+        self.errors = queue.Queue()  # (鍵, 例外)
+        self._pending = {}  # 鍵 -> 寫入函式
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="PersistenceWorker", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, job):
+        """登記寫入工作
+
+        Args:
+            key: 合併用的鍵，例如 'orders'、'products'
+            job: 無參數的寫入函式，在背景執行緒中執行
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("背景寫檔執行緒已關閉")
+            self._pending[key] = job
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+            # 等待一小段時間讓同一波異動合併
+            if self.coalesce_delay and not self._closed:
+                time.sleep(self.coalesce_delay)
+            with self._condition:
+                jobs, self._pending = self._pending, {}
+                self._busy = True
+            for key, job in jobs.items():
+                try:
+                    job()
+                except Exception as e:
+                    self.errors.put((key, e))
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """等待所有已登記的工作寫入完成
+
+        Returns:
+            是否在時限內完成
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """寫完剩餘工作後停止背景執行緒"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def pop_errors(self):
+        """取出目前累積的寫入錯誤"""
+        errors = []
+        while True:
+            try:
+                errors.append(self.errors.get_nowait())
+            except queue.Empty:
+                return errors
@@ -4,6 +4,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import json
+import os
 import pandas as pd
 from datetime import datetime, date, timedelta
 import matplotlib.pyplot as plt
@@ -11,6 +12,11 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib
 import numpy as np
 
+import inventory_storage
+from inventory_storage import JournalStorage, SqliteStorage, load_order_records
+from stock_history import StockHistory
+from transaction_archive import TransactionArchive, archive_directory
+
 # 設定中文字體
 matplotlib.rcParams['font.sans-serif'] = ['Microsoft JhengHei', 'Arial Unicode MS']
 matplotlib.rcParams['axes.unicode_minus'] = False
@@ -20,27 +26,59 @@ matplotlib.use("TkAgg")
 class InventoryReports:
     def __init__(self, root):
         self.root = root
-        self.data_file = "working_data/inventory_data.json"
+        self.data_file = inventory_storage.app_database_path()
         self.load_data()
 
+    @property
+    def transactions(self):
+        """交易字典列表，第一次使用時才從檔案讀取"""
+        if self._transactions is None:
+            self._transactions = [t for chunk in self.history_storage.iter_history(self._history_mark) for t in chunk]
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, value):
+        self._transactions = value
+        self._df_transactions = None
+
+    @property
+    def df_transactions(self):
+        """交易記錄 DataFrame，第一次使用時才建立"""
+        if self._df_transactions is None:
+            if self.transactions:
+                self._df_transactions = pd.DataFrame(self.transactions)
+                self._df_transactions['Timestamp'] = pd.to_datetime(self._df_transactions['Timestamp'])
+            else:
+                self._df_transactions = pd.DataFrame()
+        return self._df_transactions
+
+    @df_transactions.setter
+    def df_transactions(self, value):
+        self._df_transactions = value
+
     def load_data(self):
-        """從JSON文件載入庫存數據"""
-        try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+        """載入庫存數據（JSON 模式含尚未合併的交易日誌）
 
-            self.products = data.get('products', {})
-            self.transactions = data.get('transactions', [])
+        開啟時只讀取產品表，交易記錄與 DataFrame 延遲到圖表需要時才建立。
+        """
+        self.transaction_dates = []  # SQLite 模式下由索引查詢取得的交易日期
+        self.stock_history = None  # 時點庫存引擎，首次查詢時建立
+        self.stock_history_from = None  # 引擎涵蓋的最早月份
+        self.archive = TransactionArchive(archive_directory(self.data_file))  # 已結束月份的交易封存區
+        try:
+            if inventory_storage.STORAGE_MODE == "sqlite":
+                self.load_sqlite_data()
+                return
 
-            # 轉換交易數據為DataFrame
-            if self.transactions:
-                self.df_transactions = pd.DataFrame(self.transactions)
-                self.df_transactions['Timestamp'] = pd.to_datetime(self.df_transactions['Timestamp'])
-            else:
-                self.df_transactions = pd.DataFrame()
+            storage = JournalStorage(self.data_file)
+            if not storage.exists():
+                raise FileNotFoundError(self.data_file)
+            self.products, self._history_mark = storage.load_lazy()
+            self.history_storage = storage
+            self.transactions = None
 
         except FileNotFoundError:
-            messagebox.showwarning("尚未開帳", "找不到庫存資料檔案（working_data/inventory_data.json）。\n請先匯入初始資料或進行開帳。")
+            messagebox.showwarning("尚未開帳", f"找不到庫存資料檔案（{self.data_file}）。\n請先匯入初始資料或進行開帳。")
             self.products = {}
             self.transactions = []
             self.df_transactions = pd.DataFrame()
@@ -50,6 +88,45 @@ class InventoryReports:
             self.transactions = []
             self.df_transactions = pd.DataFrame()
 
+    def load_sqlite_data(self):
+        """從 SQLite 資料庫載入產品表，交易日期直接由索引查詢，不載入全部交易"""
+        if not os.path.exists(self.data_file):
+            raise FileNotFoundError(self.data_file)
+        storage = SqliteStorage(self.data_file)
+        try:
+            self.products = storage.load_products()
+            self.transaction_dates = storage.transaction_dates()
+        finally:
+            storage.close()
+        self.transactions = []
+        self.df_transactions = pd.DataFrame()
+
+    def get_stock_as_of(self, as_of):
+        """取得所有產品在指定日期結束時的庫存量
+
+        Args:
+            as_of: 日期 (YYYY-MM-DD)
+
+        Returns:
+            產品名稱 -> 庫存量
+        """
+        month = as_of[:7]
+        if self.stock_history is None or month < self.stock_history_from:
+            # 由目前庫存倒推，只需要查詢月份之後的交易：封存區只開啟這些月份
+            transactions = list(self.archive.iter_range(start=month))
+            if inventory_storage.STORAGE_MODE == "sqlite" and os.path.exists(self.data_file):
+                storage = SqliteStorage(self.data_file)
+                try:
+                    transactions.extend(storage.query_transactions())
+                finally:
+                    storage.close()
+            else:
+                transactions.extend(self.transactions)
+            current = {name: info.get('quantity', 0) for name, info in self.products.items()}
+            self.stock_history = StockHistory(current, transactions)
+            self.stock_history_from = month
+        return self.stock_history.all_stock_as_of(as_of)
+
     def get_available_dates(self):
         """獲取可用的日期列表"""
         dates = set()
@@ -68,6 +145,8 @@ class InventoryReports:
         if not self.df_transactions.empty:
             transaction_dates = self.df_transactions['Timestamp'].dt.date.unique()
             dates.update(transaction_dates)
+        dates.update(datetime.strptime(d, "%Y-%m-%d").date() for d in self.transaction_dates)
+        dates.update(datetime.strptime(d, "%Y-%m-%d").date() for d in self.archive.dates())
 
         # 如果沒有日期，至少提供今天
         if not dates:
@@ -279,13 +358,14 @@ class InventoryReports:
                 tk.Label(chart_frame, text="沒有符合條件的數據", font=("Arial", 14)).pack(expand=True)
                 return
 
-            # 準備數據
+            # 準備數據（以所選日期結束時的庫存量為準）
+            stock_as_of = self.get_stock_as_of(end_date)
             product_names = []
             quantities = []
 
             for product_name, product_info in filtered_products.items():
                 product_names.append(product_name[:15] + '...' if len(product_name) > 15 else product_name)
-                quantities.append(product_info['quantity'])
+                quantities.append(stock_as_of.get(product_name, product_info['quantity']))
 
             # 取前20個產品
             if len(product_names) > 20:
@@ -329,12 +409,9 @@ class InventoryReports:
             for widget in chart_frame.winfo_children():
                 widget.destroy()
 
-            # 載入訂單資料
+            # 載入已出貨訂單（SQLite 模式走狀態索引）
             try:
-                import json
-                with open('working_data/orders_data.json', 'r', encoding='utf-8') as f:
-                    orders_data = json.load(f)
-                orders = orders_data.get('orders', [])
+                shipped_orders = load_order_records(status='已出貨')
             except FileNotFoundError:
                 tk.Label(chart_frame, text="找不到訂單資料檔案", font=("Arial", 14)).pack(expand=True)
                 return
@@ -342,9 +419,6 @@ class InventoryReports:
                 tk.Label(chart_frame, text=f"讀取訂單資料失敗: {str(e)}", font=("Arial", 14)).pack(expand=True)
                 return
 
-            # 篩選已出貨訂單
-            shipped_orders = [order for order in orders if order.get('status') == '已出貨']
-
             if not shipped_orders:
                 tk.Label(chart_frame, text="沒有已出貨的訂單資料", font=("Arial", 14)).pack(expand=True)
                 return
@@ -412,12 +486,9 @@ class InventoryReports:
             for widget in chart_frame.winfo_children():
                 widget.destroy()
 
-            # 載入訂單資料
+            # 載入已出貨訂單（SQLite 模式走狀態索引）
             try:
-                import json
-                with open('working_data/orders_data.json', 'r', encoding='utf-8') as f:
-                    orders_data = json.load(f)
-                orders = orders_data.get('orders', [])
+                shipped_orders = load_order_records(status='已出貨')
             except FileNotFoundError:
                 tk.Label(chart_frame, text="找不到訂單資料檔案", font=("Arial", 14)).pack(expand=True)
                 return
@@ -425,9 +496,6 @@ class InventoryReports:
                 tk.Label(chart_frame, text=f"讀取訂單資料失敗: {str(e)}", font=("Arial", 14)).pack(expand=True)
                 return
 
-            # 篩選已出貨訂單
-            shipped_orders = [order for order in orders if order.get('status') == '已出貨']
-
             if not shipped_orders:
                 tk.Label(chart_frame, text="沒有已出貨的訂單資料", font=("Arial", 14)).pack(expand=True)
                 return
@@ -497,12 +565,9 @@ class InventoryReports:
             for widget in chart_frame.winfo_children():
                 widget.destroy()
 
-            # 載入訂單資料
+            # 載入已出貨訂單（SQLite 模式走狀態索引）
             try:
-                import json
-                with open('working_data/orders_data.json', 'r', encoding='utf-8') as f:
-                    orders_data = json.load(f)
-                orders = orders_data.get('orders', [])
+                shipped_orders = load_order_records(status='已出貨')
             except FileNotFoundError:
                 tk.Label(chart_frame, text="找不到訂單資料檔案", font=("Arial", 14)).pack(expand=True)
                 return
@@ -510,9 +575,6 @@ class InventoryReports:
                 tk.Label(chart_frame, text=f"讀取訂單資料失敗: {str(e)}", font=("Arial", 14)).pack(expand=True)
                 return
 
-            # 篩選已出貨訂單
-            shipped_orders = [order for order in orders if order.get('status') == '已出貨']
-
             if not shipped_orders:
                 tk.Label(chart_frame, text="沒有已出貨的訂單資料", font=("Arial", 14)).pack(expand=True)
                 return
@@ -591,7 +653,8 @@ class InventoryReports:
                 tk.Label(chart_frame, text="沒有符合條件的數據", font=("Arial", 14)).pack(expand=True)
                 return
 
-            # 準備數據 - 按產品類別分組
+            # 準備數據 - 按產品類別分組（以所選日期結束時的庫存量為準）
+            stock_as_of = self.get_stock_as_of(end_date)
             category_values = {}
 
             for product_name, product_info in filtered_products.items():
@@ -609,7 +672,8 @@ class InventoryReports:
                 else:
                     category = '其他'
 
-                value = product_info['quantity'] * product_info.get('cost', 0)
+                quantity = stock_as_of.get(product_name, product_info['quantity'])
+                value = quantity * product_info.get('cost', 0)
                 category_values[category] = category_values.get(category, 0) + value
 
             # 過濾掉值為0的類別
@@ -0,0 +1,108 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+
+# 交易類型對庫存量的影響：入庫加、出庫減、調整記錄的是差額
+TRANSACTION_SIGNS = {
+    'in': 1,
+    'out': -1,
+    'adjust': 1,
+}
+
+
+def _day_end_key(as_of):
+    """將日期轉為時間戳比較用的上限字串（不含），代表該日結束"""
+    if isinstance(as_of, str):
+        as_of = datetime.strptime(as_of[:10], "%Y-%m-%d").date()
+    elif isinstance(as_of, datetime):
+        as_of = as_of.date()
+    return (as_of + timedelta(days=1)).isoformat()
+
+
+# ==================== StockHistory ====================
+class StockHistory:
+    """時點庫存引擎，查詢任一產品在任一日期結束時的庫存量
+
+    每隔 checkpoint_interval 筆交易保存一次全產品的結存量；查詢時找到最接近的檢查點，
+    只重播檢查點之後到查詢日期為止的交易，成本與兩者間的交易筆數成正比。
+    期初結存量由目前庫存量減去所有交易異動推得，因此匯入時直接設定的初始數量也能正確還原。
+    """
+
+    def __init__(self, current_quantities, transactions, checkpoint_interval=1000):
+        """建立引擎
+
+        Args:
+            current_quantities: 產品名稱 -> 目前庫存量
+            transactions: 交易字典（InventoryTransaction.to_dict 格式）列表
+            checkpoint_interval: 每幾筆交易保存一次檢查點
+        """
+        self.checkpoint_interval = checkpoint_interval
+        self.timestamps = []  # 依時間排序的交易時間戳 (ISO 字串)
+        self.products = []  # 與 timestamps 對應的產品名稱
+        self.deltas = []  # 與 timestamps 對應的庫存異動量
+        self.product_positions = {}  # 產品名稱 -> 交易位置列表
+
+        records = sorted(
+            (t['Timestamp'], t['ProductName'], TRANSACTION_SIGNS[t['TransactionType']] * t['Quantity'])
+            for t in transactions if t['TransactionType'] in TRANSACTION_SIGNS
+        )
+
+        # 由目前庫存量倒推期初結存量
+        opening = dict(current_quantities)
+        for _, name, delta in records:
+            opening[name] = opening.get(name, 0) - delta
+
+        self.balances = dict(opening)  # 最新結存量
+        self.checkpoints = [dict(opening)]  # checkpoints[k] 為前 k * interval 筆交易後的結存量
+        for timestamp, name, delta in records:
+            self.append(name, timestamp, delta)
+
+    def append(self, product_name, timestamp, delta):
+        """追加一筆交易（時間需不早於前一筆）"""
+        position = len(self.timestamps)
+        self.timestamps.append(timestamp)
+        self.products.append(product_name)
+        self.deltas.append(delta)
+        self.product_positions.setdefault(product_name, []).append(position)
+        self.balances[product_name] = self.balances.get(product_name, 0) + delta
+        if (position + 1) % self.checkpoint_interval == 0:
+            self.checkpoints.append(dict(self.balances))
+
+    def append_transaction(self, transaction):
+        """追加一筆交易字典"""
+        sign = TRANSACTION_SIGNS.get(transaction['TransactionType'])
+        if sign is not None:
+            self.append(transaction['ProductName'], transaction['Timestamp'], sign * transaction['Quantity'])
+
+    def _locate(self, as_of):
+        """回傳 (查詢日期結束時的交易位置, 最近的檢查點編號)"""
+        end = bisect_left(self.timestamps, _day_end_key(as_of))
+        return end, min(end // self.checkpoint_interval, len(self.checkpoints) - 1)
+
+    def stock_as_of(self, product_name, as_of):
+        """查詢單一產品在指定日期結束時的庫存量
+
+        Args:
+            product_name: 產品名稱
+            as_of: 日期 (date、datetime 或 'YYYY-MM-DD')
+        """
+        end, checkpoint = self._locate(as_of)
+        quantity = self.checkpoints[checkpoint].get(product_name, 0)
+        positions = self.product_positions.get(product_name, [])
+        start = checkpoint * self.checkpoint_interval
+        for i in range(bisect_left(positions, start), bisect_left(positions, end)):
+            quantity += self.deltas[positions[i]]
+        return quantity
+
+    def all_stock_as_of(self, as_of):
+        """查詢所有產品在指定日期結束時的庫存量
+
+        Returns:
+            產品名稱 -> 庫存量
+        """
+        end, checkpoint = self._locate(as_of)
+        balances = dict(self.checkpoints[checkpoint])
+        for i in range(checkpoint * self.checkpoint_interval, end):
+            name = self.products[i]
+            balances[name] = balances.get(name, 0) + self.deltas[i]
+        return balances
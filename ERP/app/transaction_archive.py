@@ -0,0 +1,146 @@
+import os
+import gzip
+import json
+
+from inventory_storage import atomic_write_json
+
+
+def archive_directory(database_path):
+    """資料檔對應的封存目錄（與資料檔同目錄，例如 working_data/inventory_data_archive）"""
+    return os.path.splitext(database_path)[0] + "_archive"
+
+
+def previous_month(month):
+    """回傳前一個月份 (YYYY-MM)"""
+    year, mon = int(month[:4]), int(month[5:7])
+    if mon == 1:
+        return f"{year - 1}-12"
+    return f"{year}-{mon - 1:02d}"
+
+
+# ==================== TransactionArchive ====================
+class TransactionArchive:
+    """依月份分割的交易封存區
+
+    已結束的月份寫成一個壓縮的區段檔 (YYYY-MM.json.gz)，寫入後不再修改；
+    manifest.json 記錄每個區段的時間範圍、交易日期與各產品的入庫/出庫/調整合計，
+    查詢時只開啟與日期範圍重疊、或含有指定產品的區段。
+    目前月份的交易仍留在原本的儲存（熱資料），日常載入與保存不會碰到封存區。
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._manifest = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, self.MANIFEST_NAME)
+
+    @property
+    def manifest(self):
+        """封存清單（第一次使用時讀取）"""
+        if self._manifest is None:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {'archived_through': None, 'segments': {}}
+        return self._manifest
+
+    @property
+    def archived_through(self):
+        """已處理到的最後一個月份，None 表示尚未封存過"""
+        return self.manifest.get('archived_through')
+
+    def months(self):
+        """已封存的月份（由舊到新）"""
+        return sorted(self.manifest['segments'])
+
+    def segment_path(self, month):
+        return os.path.join(self.directory, f"{month}.json.gz")
+
+    def write_month(self, month, transactions):
+        """將一個月份的交易寫成區段檔並登記到清單
+
+        Args:
+            month: 月份 (YYYY-MM)
+            transactions: 該月份的交易字典列表（依時間排序）
+        """
+        if month in self.manifest['segments']:
+            raise ValueError(f"月份 {month} 已封存，區段檔不可修改")
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = self.segment_path(month)
+        temp_path = f"{path}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            json.dump(transactions, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+        products = {}
+        for t in transactions:
+            totals = products.setdefault(t['ProductName'], {'in': 0, 'out': 0, 'adjust': 0})
+            totals[t['TransactionType']] = totals.get(t['TransactionType'], 0) + t['Quantity']
+        self.manifest['segments'][month] = {
+            'file': os.path.basename(path),
+            'count': len(transactions),
+            'start': transactions[0]['Timestamp'] if transactions else None,
+            'end': transactions[-1]['Timestamp'] if transactions else None,
+            'dates': sorted({t['Timestamp'][:10] for t in transactions}),
+            'products': products
+        }
+        self.save_manifest()
+
+    def mark_archived_through(self, month):
+        """記錄已處理到的月份"""
+        if self.archived_through is None or month > self.archived_through:
+            self.manifest['archived_through'] = month
+            self.save_manifest()
+
+    def save_manifest(self):
+        atomic_write_json(self.manifest_path, self.manifest)
+
+    def read_month(self, month):
+        """讀取單一月份的交易字典列表"""
+        with gzip.open(self.segment_path(month), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def months_in_range(self, start=None, end=None):
+        """與日期範圍重疊的月份
+
+        Args:
+            start: 起始時間 (ISO 字串，含)
+            end: 結束時間 (ISO 字串，不含)
+        """
+        months = []
+        for month, segment in sorted(self.manifest['segments'].items()):
+            if not segment['count']:
+                continue
+            if start is not None and segment['end'] < start:
+                continue
+            if end is not None and segment['start'] >= end:
+                continue
+            months.append(month)
+        return months
+
+    def iter_range(self, start=None, end=None, product_name=None):
+        """逐筆產出範圍內的封存交易，只開啟重疊的區段（指定產品時再略過不含該產品的區段）"""
+        for month in self.months_in_range(start, end):
+            if product_name is not None and product_name not in self.manifest['segments'][month]['products']:
+                continue
+            for t in self.read_month(month):
+                if start is not None and t['Timestamp'] < start:
+                    continue
+                if end is not None and t['Timestamp'] >= end:
+                    continue
+                if product_name is not None and t['ProductName'] != product_name:
+                    continue
+                yield t
+
+    def dates(self):
+        """所有封存交易的日期 (YYYY-MM-DD)，由清單取得不需開啟區段"""
+        dates = set()
+        for segment in self.manifest['segments'].values():
+            dates.update(segment['dates'])
+        return dates
@@ -0,0 +1,53 @@
+import pandas as pd
+from openpyxl import load_workbook
+
+
+# ==================== 分段讀取工作表 ====================
+
+def iter_workbook_chunks(file_path, chunk_size=5000, sheet_name=None, progress=None):
+    """以唯讀模式逐列讀取工作表，每 chunk_size 列產出一個 DataFrame
+
+    openpyxl 的唯讀模式不會把整張工作表載入記憶體，搭配分段產出，
+    同一時間只保留一段資料，記憶體用量與檔案大小無關。第一列視為標題列，完全空白的列略過。
+
+    Args:
+        file_path: xlsx 檔案路徑
+        chunk_size: 每段的列數
+        sheet_name: 工作表名稱，預設為第一個工作表
+        progress: 每段讀取後呼叫 progress(已讀取列數, 總列數)；工作表未記錄範圍時總列數為 0
+
+    Yields:
+        DataFrame，欄位為標題列，索引為資料在工作表中的列號
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name).strip() if name is not None else f"欄位{position + 1}"
+                   for position, name in enumerate(header)]
+        width = len(columns)
+        total = max((sheet.max_row or 0) - 1, 0)
+
+        records, row_numbers = [], []
+        done = 0
+        for row_number, values in enumerate(rows, start=2):
+            if all(value is None for value in values):
+                continue
+            records.append(values[:width])
+            row_numbers.append(row_number)
+            if len(records) >= chunk_size:
+                done += len(records)
+                yield pd.DataFrame.from_records(records, columns=columns, index=row_numbers, coerce_float=True)
+                records, row_numbers = [], []
+                if progress:
+                    progress(done, total)
+        if records:
+            done += len(records)
+            yield pd.DataFrame.from_records(records, columns=columns, index=row_numbers, coerce_float=True)
+        if progress:
+            progress(done, max(total, done))
+    finally:
+        workbook.close()
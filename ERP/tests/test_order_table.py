@@ -0,0 +1,23 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from inventory_core import Inventory, Order, ProductionManager  # noqa: E402
+
+
+def test_reassigning_orders_keeps_extra_fields_in_columnar_mode(tmp_path):
+    inventory = Inventory(str(tmp_path / "inventory.json"))
+    manager = ProductionManager(inventory, columnar=True)
+    order = Order("SO", "A1", "001", "P001", "產品A", 5, 10.0, "C001", "客戶", "F001", "廠商")
+    order.remarks = "hello"
+    order.production_date = datetime(2024, 2, 1)
+    manager.add_order(order)
+
+    manager.orders = dict(manager.orders)
+
+    row = manager.orders["A1-001"]
+    assert row.remarks == "hello"
+    assert row.production_date == datetime(2024, 2, 1)
+    assert row.quantity == 5